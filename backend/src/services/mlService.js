@@ -32,6 +32,67 @@ class MLService {
     }
   }
 
+  // Queues the image on the ML service's /jobs API and returns the job ({ job_id, status, ... }).
+  async submitDiagnosisJob(imageBuffer, cropType = 'tomato', priority = 'interactive') {
+    try {
+      const formData = new FormData();
+      formData.append('image', imageBuffer, {
+        filename: 'image.jpg',
+        contentType: 'image/jpeg'
+      });
+      formData.append('crop_type', cropType);
+      formData.append('priority', priority);
+
+      const response = await this.client.post('/jobs', formData, {
+        headers: {
+          ...formData.getHeaders()
+        }
+      });
+
+      return response.data;
+    } catch (error) {
+      console.error('ML Job Submit Error:', error.message);
+      throw new Error('Disease prediction service is temporarily unavailable');
+    }
+  }
+
+  // Job status; waitSeconds > 0 long-polls until the job finishes or the wait runs out.
+  async getDiagnosisJob(jobId, waitSeconds = 0) {
+    const response = await this.client.get(`/jobs/${jobId}`, {
+      params: { wait: waitSeconds },
+      timeout: waitSeconds * 1000 + 10000
+    });
+
+    return response.data;
+  }
+
+  // Drop-in alternative to predictDisease that never holds one connection for the whole inference.
+  async predictDiseaseAsync(imageBuffer, cropType = 'tomato', { priority = 'interactive', timeoutMs = 60000, pollSeconds = 20 } = {}) {
+    const job = await this.submitDiagnosisJob(imageBuffer, cropType, priority);
+    const deadline = Date.now() + timeoutMs;
+
+    while (Date.now() < deadline) {
+      const wait = Math.max(1, Math.min(pollSeconds, Math.ceil((deadline - Date.now()) / 1000)));
+      let status;
+      try {
+        status = await this.getDiagnosisJob(job.job_id, wait);
+      } catch (error) {
+        console.error('ML Job Error:', error.message);
+        throw new Error('Disease prediction service is temporarily unavailable');
+      }
+
+      if (status.status === 'done') {
+        return status.result;
+      }
+      // The job's own outcome (e.g. an unreadable image) reaches the caller as is
+      if (status.status === 'failed' || status.status === 'expired') {
+        throw new Error(status.error || `Diagnosis job ${status.status}`);
+      }
+    }
+
+    throw new Error('Disease prediction timed out');
+  }
+
   async getRecommendations(disease, cropType) {
     try {
       const response = await this.client.get('/recommendations', {
@@ -4,35 +4,177 @@ This service loads a trained PyTorch/TorchScript model from the `ml/models`
 directory (or a custom path supplied via environment variables) and exposes a
 `/predict` endpoint that mirrors the contract expected by the Node backend.
 
+Per-crop models live in `MODEL_DIR/<crop_type>/` (with an optional
+`classes.json` next to them) and serve requests whose `crop_type` form field
+matches the directory name; everything else uses the default model. Artefacts
+are hot reloaded when they change on disk (see registry.py), and
+`/admin/models` lists and activates versions.
+
+`/predict` and `/predict/batch` answer with the class metadata of every top-k
+hit embedded, pre-serialized per model (see responses.py). Clients holding a
+copy of `/metadata` (served with an `ETag`) can send `?compact=true` or
+`Accept: application/vnd.krishi-mitra.compact+json` to get class ids and
+scores only.
+
+`/predict` can average the logits of several flipped and cropped views of the
+image (test-time augmentation), run as one batched forward pass. In `gated` mode
+only images whose single-view confidence falls below TTA_THRESHOLD pay for the
+extra views (see `benchmarks/tta_bench.py` for the accuracy/latency trade-off).
+
+`/predict/raw` takes images the client already resized to the model's input
+size as raw uint8 RGB pixels (see rawtensor.py for the format): they are wrapped
+as a tensor in place and only normalized, skipping the JPEG decode and resize
+(see `benchmarks/raw_bench.py` for the CPU this saves per request).
+
+To run several workers without one model copy per worker, start the service
+with `python serve.py --workers N` (pre-fork mode, see serve.py) rather than
+`uvicorn --workers N`.
+
+`/jobs` runs the same prediction asynchronously: the upload is queued and
+answered with a job id, and `GET /jobs/{job_id}?wait=N` polls or long-polls for
+the result (see jobs.py).
+
+`/similar` answers with previously validated cases that look like the photo:
+the pooled features in front of the default model's classifier are looked up in
+an on-disk nearest-neighbour index built with `routes/build_index.py` (see
+embedding_index.py), and `/admin/similar` adds a newly validated case to it.
+
 Environment variables:
   - MODEL_PATH: Absolute/relative path to the model file (.pt or .pth).
   - MODEL_DIR: Directory to search for default model artefacts.
   - CLASS_MAP_PATH: Optional JSON that maps class indices to rich metadata.
-  - MODEL_ARCH: Architecture to instantiate when loading state_dict models
-				(default: mobilenet_v2).
+  - MODEL_VARIANT: Exported variant to serve when MODEL_PATH is not set:
+				fp32, frozen, int8, int8_dynamic or onnx (see routes/export.py).
+				INT8 and ONNX variants always run on CPU.
+  - QUANTIZED_ENGINE: Optional torch quantized engine for INT8 variants
+				(e.g. x86, fbgemm, qnnpack); must match the export.
+  - MODEL_ARCH: Architecture to instantiate when loading state_dict models:
+				mobilenet_v2 (default), improved_cnn or pooled_cnn. Checkpoints
+				written by routes/distill.py carry their own arch and width.
+  - MODEL_INPUT_SIZE: Side of the square input images are resized to
+				(default: 224; distilled students may be trained for less).
+  - FAST_START: Set to `true` to bind immediately and import torch, load and
+				warm the models on a background thread; `/health` reports
+				`loading` until they are ready (default: false).
+  - WARMUP_BATCH_SIZES: Comma separated batch sizes run through every newly
+				loaded model before it serves traffic (default: 1,BATCH_MAX_SIZE).
+  - MODEL_WATCH_INTERVAL: Seconds between scans of MODEL_DIR for new or
+				changed artefacts (default: 5, use 0 to disable hot reload).
+  - ADMIN_TOKEN: Enables `/admin/models`; callers must send it in the
+				`X-Admin-Token` header.
+  - BATCH_MAX_SIZE: Maximum number of images gathered into one forward pass
+				(default: 8, use 1 to disable micro-batching).
+  - BATCH_MAX_WAIT_MS: How long the first queued image waits for companions
+				before its batch is dispatched (default: 10).
+  - EXECUTOR_MODE: Where decode/preprocess/inference run: `thread` (default,
+				inference stays on the micro-batcher) or `process` (each worker
+				process loads its own copy of the model).
+  - EXECUTOR_WORKERS: Worker threads/processes (default: CPU count).
+  - EXECUTOR_MAX_PENDING: Requests allowed to wait for a free worker before
+				new ones are rejected with 503 (default: 32). In thread mode a
+				request keeps its place until the micro-batcher has answered it.
+  - EXECUTOR_RETRY_AFTER: Retry-After seconds sent with those 503s (default: 1).
+  - PREPROCESS_MODE: `fast` (default) decodes JPEGs in draft mode and fuses
+				normalization (see preprocess.py); `pil` runs the torchvision
+				Resize/ToTensor/Normalize pipeline.
+  - MAX_UPLOAD_BYTES: Largest image accepted by `/predict` and per
+				`/predict/batch` entry; uploads are streamed and cut off with
+				413 once they cross it (default: 16777216, 0 disables).
+  - MAX_IMAGE_PIXELS: Largest width x height accepted, read from the image
+				header before the body is decoded (default: 40000000).
+  - UPLOAD_SPOOL_BYTES: `/predict` uploads larger than this continue into a
+				temporary file instead of memory (default: 1048576).
+  - TTA_MODE: Test-time augmentation on `/predict`: `off` (default), `always`
+				or `gated`. Requests can override it with `?tta=off|always|gated`.
+  - TTA_VIEWS: Views averaged per TTA prediction, 2-12: the full frame, then
+				center and corner crops, each followed by its mirror (default: 6).
+  - TTA_THRESHOLD: Single-view top-1 score below which `gated` escalates to
+				TTA (default: 0.7).
+  - PREDICT_BATCH_CHUNK: Images decoded and inferred together by
+				`/predict/batch` (default: BATCH_MAX_SIZE).
+  - PREDICT_BATCH_MAX_FILES: Maximum multipart files accepted by
+				`/predict/batch` (default: 1000; use an archive for more).
+  - PREDICT_BATCH_WAIT: Seconds a `/predict/batch` chunk waits for saturated
+				workers before giving up (default: 30). The first chunk answers
+				503; a later one ends the stream with per-image errors.
+  - JOB_WORKERS: Concurrent `/jobs` predictions (default: BATCH_MAX_SIZE, so
+				queued jobs can fill a micro-batch; 0 disables `/jobs`).
+  - JOB_QUEUE_MAX: Queued jobs accepted before `/jobs` answers 503 (default: 256).
+  - JOB_QUEUE_MAX_BYTES: Image bytes allowed in the queue (default: 268435456).
+  - JOB_TTL: Seconds after submission at which a job expires, unrun if still
+				queued, and its result is dropped (default: 600).
+  - JOB_STORE_PATH: Optional SQLite file that makes the job queue survive
+				restarts; payloads are then kept on disk instead of in memory.
+  - JOB_MAX_WAIT: Longest `?wait=` long poll on `/jobs/{job_id}` (default: 30).
+  - SIMILAR_INDEX_PATH: Embedding index directory that enables `/similar`
+				(built by routes/build_index.py from the default model).
+  - SIMILAR_NPROBE: Index lists scanned per `/similar` query; more is slower
+				and closer to an exact search (default: 16).
+  - SIMILAR_MAX_K: Largest `?k=` accepted by `/similar` (default: 50).
+  - PROFILE_EVERY_N: Capture a torch profiler trace for every Nth forward
+				pass (default: 0, disabled).
+  - PROFILE_DIR: Where profiler traces are written (default: ml/profiles).
+  - PREDICTION_CACHE: Set to `false` to disable the prediction cache.
+  - PREDICTION_CACHE_TTL: Seconds a cached prediction stays valid (default: 3600).
+  - PREDICTION_CACHE_MAX_BYTES: Memory budget of the in-process cache
+				(default: 67108864).
+  - PREDICTION_CACHE_URL: Optional redis:// URL to share the cache between
+				replicas instead of keeping it in-process.
 """
 
 from __future__ import annotations
 
-import io
+import asyncio
+import functools
+import hmac
+import itertools
 import json
 import os
+import threading
+import time
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Tuple
+
+_IMPORT_STARTED = time.perf_counter()
 
-import torch
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Match
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from PIL import Image
-from torchvision import models, transforms
 from dotenv import load_dotenv
 
+import metrics
+from bulk import chunked, iter_archive, iter_uploads
+from cache import MemoryCacheBackend, PredictionCache, RedisCacheBackend, model_identity
+from jobs import PRIORITIES, Job, JobQueue, QueueFull
+from rawtensor import RawHeader, RawTensorError, parse_header
+from registry import DEFAULT_SLOT, LoadedModel, ModelRegistry, ModelSpec
+from responses import ResponseTable, dumps, wants_compact
+from uploads import ImageBuffer, ImageSink, UploadRejected, read_image_form
+from workers import PoolSaturated, WorkerPool
+
+if TYPE_CHECKING:
+	import torch
+
 
 load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent
 DEFAULT_MODEL_DIR = BASE_DIR / "models"
 MODEL_DIR = Path(os.getenv("MODEL_DIR", DEFAULT_MODEL_DIR))
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "").lower()
+MODEL_VARIANT_FILES = {
+	"fp32": "plant_disease_model.pt",
+	"frozen": "plant_disease_model_frozen.pt",
+	"int8": "plant_disease_model_int8.pt",
+	"int8_dynamic": "plant_disease_model_int8_dynamic.pt",
+	"onnx": "plant_disease_model.onnx",
+}
+CPU_ONLY_VARIANTS = {"int8", "int8_dynamic", "onnx"}
+DEFAULT_ARTEFACTS = ["plant_disease_model.pt", "best_model.pth", "final_model.pth"]
 
 
 def _resolve_model_path() -> Path:
@@ -40,17 +182,20 @@ def _resolve_model_path() -> Path:
 	if explicit_path:
 		return Path(explicit_path)
 
-	scripted_default = MODEL_DIR / "plant_disease_model.pt"
-	if scripted_default.exists():
-		return scripted_default
-
-	best_default = MODEL_DIR / "best_model.pth"
-	if best_default.exists():
-		return best_default
+	if MODEL_VARIANT:
+		if MODEL_VARIANT not in MODEL_VARIANT_FILES:
+			raise ValueError(
+				f"Unsupported MODEL_VARIANT '{MODEL_VARIANT}'. Supported options: {', '.join(MODEL_VARIANT_FILES)}"
+			)
+		variant_path = MODEL_DIR / MODEL_VARIANT_FILES[MODEL_VARIANT]
+		if not variant_path.exists():
+			raise FileNotFoundError(f"MODEL_VARIANT={MODEL_VARIANT} but {variant_path} does not exist. Run routes/export.py first.")
+		return variant_path
 
-	final_default = MODEL_DIR / "final_model.pth"
-	if final_default.exists():
-		return final_default
+	for name in DEFAULT_ARTEFACTS:
+		default_path = MODEL_DIR / name
+		if default_path.exists():
+			return default_path
 
 	raise FileNotFoundError(
 		"No model artefact found. Set MODEL_PATH or place a .pt/.pth file in ml/models/."
@@ -60,21 +205,124 @@ def _resolve_model_path() -> Path:
 MODEL_PATH = _resolve_model_path()
 CLASS_MAP_PATH = Path(os.getenv("CLASS_MAP_PATH", MODEL_DIR / "classes.json"))
 MODEL_ARCH = os.getenv("MODEL_ARCH", "mobilenet_v2").lower()
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+MODEL_INPUT_SIZE = int(os.getenv("MODEL_INPUT_SIZE", "224"))
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "5"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+TTA_MODES = ("off", "always", "gated")
+TTA_MODE = os.getenv("TTA_MODE", "off").lower()
+TTA_VIEWS = int(os.getenv("TTA_VIEWS", "6"))
+TTA_THRESHOLD = float(os.getenv("TTA_THRESHOLD", "0.7"))
+if TTA_MODE not in TTA_MODES:
+	raise ValueError(f"Unsupported TTA_MODE '{TTA_MODE}'. Supported options: {', '.join(TTA_MODES)}")
+if TTA_VIEWS < 2:
+	raise ValueError("TTA_VIEWS must be at least 2")
+# TTA batches are TTA_VIEWS rows (`always`) or TTA_VIEWS - 1 (a `gated` escalation).
+_DEFAULT_WARMUP = f"1,{BATCH_MAX_SIZE}" + (f",{TTA_VIEWS - 1},{TTA_VIEWS}" if TTA_MODE != "off" else "")
+WARMUP_BATCH_SIZES = sorted({int(size) for size in os.getenv("WARMUP_BATCH_SIZES", _DEFAULT_WARMUP).split(",") if size.strip()})
+FAST_START = os.getenv("FAST_START", "false").lower() == "true"
+EXECUTOR_MODE = os.getenv("EXECUTOR_MODE", "thread").lower()
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", "0")) or None
+EXECUTOR_MAX_PENDING = int(os.getenv("EXECUTOR_MAX_PENDING", "32"))
+EXECUTOR_RETRY_AFTER = int(os.getenv("EXECUTOR_RETRY_AFTER", "1"))
+PREPROCESS_MODE = os.getenv("PREPROCESS_MODE", "fast").lower()
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(16 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "40000000"))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+ALLOWED_UPLOAD_TYPES = {"image/jpeg", "image/png", "image/jpg", "application/octet-stream"}
+PREDICT_BATCH_CHUNK = int(os.getenv("PREDICT_BATCH_CHUNK", "0")) or BATCH_MAX_SIZE
+PREDICT_BATCH_MAX_FILES = int(os.getenv("PREDICT_BATCH_MAX_FILES", "1000"))
+PREDICT_BATCH_WAIT = float(os.getenv("PREDICT_BATCH_WAIT", "30"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", str(BATCH_MAX_SIZE)))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "256"))
+JOB_QUEUE_MAX_BYTES = int(os.getenv("JOB_QUEUE_MAX_BYTES", str(256 * 1024 * 1024)))
+JOB_TTL = float(os.getenv("JOB_TTL", "600"))
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH")
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+SIMILAR_INDEX_PATH = os.getenv("SIMILAR_INDEX_PATH")
+SIMILAR_NPROBE = int(os.getenv("SIMILAR_NPROBE", "16"))
+SIMILAR_MAX_K = int(os.getenv("SIMILAR_MAX_K", "50"))
+PROFILE_EVERY_N = int(os.getenv("PROFILE_EVERY_N", "0"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", BASE_DIR / "profiles"))
+PREDICTION_CACHE = os.getenv("PREDICTION_CACHE", "true").lower() == "true"
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+PREDICTION_CACHE_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PREDICTION_CACHE_URL = os.getenv("PREDICTION_CACHE_URL")
+
+
+profiler_sampler = metrics.TorchProfilerSampler(PROFILE_EVERY_N, PROFILE_DIR)
+
+# Backstop for anything decoded without going through uploads.py: Pillow raises
+# DecompressionBombError above twice this many pixels.
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS or None
+
+# Bound by _import_runtime(): torch and the modules built on it take seconds to
+# import, so they are deferred until the model is loaded.
+DEVICE: Any = None
+MicroBatcher: Any = None
+BatcherStopped: Any = None
+inference_transforms: Any = None
+fast_preprocessor: Any = None
+open_image: Any = None
+crop_box: Any = None
+tta_views: Any = None
+embedding_head: Any = None
+EmbeddingIndex: Any = None
+startup: Dict[str, Any] = {"status": "loading", "error": None, "phases": {}}
+
+
+def _import_runtime() -> None:
+	global torch, DEVICE, MicroBatcher, BatcherStopped, inference_transforms, fast_preprocessor, open_image, crop_box, tta_views, embedding_head, EmbeddingIndex
+
+	if DEVICE is not None:
+		return
 
+	import torch
 
-inference_transforms = transforms.Compose(
-	[
-		transforms.Resize((224, 224)),
-		transforms.ToTensor(),
-		transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-	]
-)
+	from batching import BatcherStopped, MicroBatcher
+	from embedding_index import EmbeddingIndex, embedding_head
+	from preprocess import IMAGENET_MEAN, IMAGENET_STD, FastPreprocessor, crop_box, open_image, tta_views
+
+	tta_views(TTA_VIEWS)  # rejects counts above MAX_TTA_VIEWS at startup
+
+	if PREPROCESS_MODE != "fast":
+		# Any torchvision import pulls in torchvision.ops and torch._dynamo (~2s).
+		from torchvision import transforms
+
+		inference_transforms = transforms.Compose(
+			[
+				transforms.Resize((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)),
+				transforms.ToTensor(),
+				transforms.Normalize(list(IMAGENET_MEAN), list(IMAGENET_STD)),
+			]
+		)
+	fast_preprocessor = FastPreprocessor((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE))
+	DEVICE = torch.device("cuda" if torch.cuda.is_available() and MODEL_VARIANT not in CPU_ONLY_VARIANTS else "cpu")
 
 
-class_metadata: List[Dict[str, Any]] = []
-class_names: List[str] = []
-model: torch.nn.Module | torch.jit.ScriptModule | None = None
+class _OnnxModel:
+	def __init__(self, path: Path) -> None:
+		try:
+			import onnxruntime as ort  # type: ignore
+		except ImportError as exc:
+			raise RuntimeError("Serving an ONNX variant requires the `onnxruntime` package.") from exc
+
+		self.session = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+		self.input_name = self.session.get_inputs()[0].name
+
+	def __call__(self, inputs: torch.Tensor) -> torch.Tensor:
+		return torch.from_numpy(self.session.run(None, {self.input_name: inputs.cpu().numpy()})[0])
+
+
+# Filled by serve.py before it forks its workers, keyed by model_identity():
+# _load_module adopts these (weights in shared memory) instead of reading the artefact.
+PRELOADED: Dict[str, Tuple[Any, int | None]] = {}
+
+pool: WorkerPool | None = None
+prediction_cache: PredictionCache | None = None
+job_queue: JobQueue | None = None
+similar_index: Any = None
 
 
 def _shape_metadata(entry: Any, index: int) -> Dict[str, Any]:
@@ -95,9 +343,9 @@ def _shape_metadata(entry: Any, index: int) -> Dict[str, Any]:
 	return {"label": f"class_{index}", "common_name": None, "scientific_name": None}
 
 
-def _load_class_metadata(num_classes_hint: int | None = None) -> List[Dict[str, Any]]:
-	if CLASS_MAP_PATH.exists():
-		with CLASS_MAP_PATH.open("r", encoding="utf-8") as fp:
+def _load_class_metadata(class_map_path: Path, num_classes_hint: int | None = None) -> List[Dict[str, Any]]:
+	if class_map_path.exists():
+		with class_map_path.open("r", encoding="utf-8") as fp:
 			data = json.load(fp)
 
 		if isinstance(data, dict):
@@ -119,44 +367,70 @@ def _load_class_metadata(num_classes_hint: int | None = None) -> List[Dict[str,
 	return [_shape_metadata(item, idx) for idx, item in enumerate(items)]
 
 
-def _build_model(num_classes: int) -> torch.nn.Module:
-	if MODEL_ARCH == "mobilenet_v2":
-		net = models.mobilenet_v2(weights=None)
+def _build_model(num_classes: int, arch: str = MODEL_ARCH, width_mult: float = 1.0) -> torch.nn.Module:
+	if arch == "mobilenet_v2":
+		# Deferred like all torchvision imports (see _import_runtime): only state_dict loads need it.
+		from torchvision import models
+
+		net = models.mobilenet_v2(weights=None, width_mult=width_mult)
 		net.classifier[1] = torch.nn.Linear(net.classifier[1].in_features, num_classes)
 		return net
 
-	if MODEL_ARCH == "improved_cnn":
+	if arch in ("improved_cnn", "pooled_cnn"):
 		# Lazy import to avoid pulling training dependencies unnecessarily
 		from routes.predict import ImprovedCNN  # type: ignore
 
-		return ImprovedCNN(num_classes=num_classes)
+		return ImprovedCNN(num_classes=num_classes, pooled=arch == "pooled_cnn")
 
-	raise ValueError(f"Unsupported MODEL_ARCH '{MODEL_ARCH}'. Supported options: mobilenet_v2, improved_cnn")
+	raise ValueError(f"Unsupported MODEL_ARCH '{arch}'. Supported options: mobilenet_v2, improved_cnn, pooled_cnn")
 
 
-def _load_model() -> None:
-	global model, class_metadata, class_names
+def _load_module(path: Path) -> Tuple[Any, int | None]:
+	# Returns the loaded model and, for state_dict checkpoints, the class count stored in it.
+	preloaded = PRELOADED.pop(model_identity(path), None)
+	if preloaded is not None:
+		return preloaded
+
+	if path.suffix == ".onnx":
+		return _OnnxModel(path), None
 
-	scripted = MODEL_PATH.suffix == ".pt" and os.getenv("FORCE_STATE_DICT", "false").lower() != "true"
+	scripted = path.suffix == ".pt" and os.getenv("FORCE_STATE_DICT", "false").lower() != "true"
 
 	if scripted:
-		loaded_model = torch.jit.load(str(MODEL_PATH), map_location=DEVICE)
+		loaded_model = torch.jit.load(str(path), map_location=DEVICE)
 		loaded_model.eval()
 		loaded_model.to(DEVICE)
-		class_metadata = _load_class_metadata()
-		class_names = [meta.get("label", f"class_{idx}") for idx, meta in enumerate(class_metadata)]
-		model = loaded_model
-		return
+		if path.name == MODEL_VARIANT_FILES["frozen"]:
+			# Frozen exports are specialised for this host's kernels at load time.
+			loaded_model = torch.jit.optimize_for_inference(loaded_model)
+		return loaded_model, None
 
-	state = torch.load(str(MODEL_PATH), map_location=DEVICE)
-	if isinstance(state, dict) and "state_dict" in state:
-		state = state["state_dict"]
+	try:
+		# Memory-mapped: tensors are paged in from the file instead of read and copied up front.
+		state = torch.load(str(path), map_location="cpu", mmap=True)
+	except RuntimeError:
+		# Legacy (pre-zipfile) checkpoints cannot be memory-mapped.
+		state = torch.load(str(path), map_location="cpu")
+	arch, width_mult = MODEL_ARCH, 1.0
+	if isinstance(state, dict) and "arch" in state:
+		# Distilled students (routes/distill.py) record how to rebuild them.
+		arch, width_mult = state["arch"], state.get("width_mult", 1.0)
+		input_size = state.get("input_size", MODEL_INPUT_SIZE)
+		if input_size != MODEL_INPUT_SIZE:
+			print(f"⚠️ {path.name} was trained on {input_size}x{input_size} inputs but MODEL_INPUT_SIZE is {MODEL_INPUT_SIZE}")
+	for key in ("model_state_dict", "state_dict"):
+		# Training checkpoints (save_checkpoint in routes/predict.py) wrap the weights.
+		if isinstance(state, dict) and key in state:
+			state = state[key]
+			break
 
 	if not isinstance(state, dict):
 		raise RuntimeError("Unsupported model checkpoint format. Provide a state_dict or TorchScript module.")
 
 	if "classifier.1.weight" in state:
 		num_classes = state["classifier.1.weight"].shape[0]
+	elif "fc3.weight" in state:
+		num_classes = state["fc3.weight"].shape[0]
 	else:
 		num_classes = int(os.getenv("MODEL_NUM_CLASSES", 0))
 		if num_classes <= 0:
@@ -164,57 +438,298 @@ def _load_model() -> None:
 				"Unable to infer number of classes from checkpoint. Set MODEL_NUM_CLASSES or provide a TorchScript model."
 			)
 
-	class_metadata = _load_class_metadata(num_classes)
-	if not class_metadata:
+	with torch.device("meta"):
+		# No point randomly initialising weights that the checkpoint replaces.
+		net = _build_model(num_classes, arch, width_mult)
+	net.load_state_dict(state, assign=True)
+	net.to(DEVICE)
+	net.eval()
+	return net, num_classes
+
+
+def preload_models() -> int:
+	"""Load every slot's wanted artefact once, weights moved to shared memory, for forked workers to adopt.
+
+	Called by serve.py in the pre-fork parent; returns the bytes shared. Modules
+	without parameters (frozen, quantized, ONNX) keep their weights in ordinary
+	memory, which forked workers still share copy-on-write since inference never
+	writes to it.
+	"""
+	_import_runtime()
+	if DEVICE.type != "cpu":
+		# CUDA contexts cannot cross a fork; every worker loads its own copy.
+		return 0
+	registry.default_path = MODEL_PATH
+	shared = 0
+	for slot in registry.slots():
+		spec = registry.wanted(slot)
+		if spec is None:
+			continue
+		loaded, num_classes = _load_module(spec.path)
+		if isinstance(loaded, torch.nn.Module):
+			for tensor in itertools.chain(loaded.parameters(), loaded.buffers()):
+				tensor.share_memory_()
+		PRELOADED[model_identity(spec.path)] = (loaded, num_classes)
+		shared += _memory_bytes(loaded, spec.path)
+	return shared
+
+
+def _memory_bytes(loaded: Any, path: Path) -> int:
+	if isinstance(loaded, torch.nn.Module):
+		total = sum(tensor.numel() * tensor.element_size() for tensor in itertools.chain(loaded.parameters(), loaded.buffers()))
+		if total:
+			return total
+	# Frozen, quantized and ONNX graphs keep their weights as constants; the artefact size is the closest measure.
+	return path.stat().st_size
+
+
+def _load_entry(spec: ModelSpec) -> LoadedModel:
+	started = time.perf_counter()
+	quantized_engine = os.getenv("QUANTIZED_ENGINE")
+	if quantized_engine:
+		torch.backends.quantized.engine = quantized_engine
+
+	loaded_model, num_classes = _load_module(spec.path)
+	class_metadata = _load_class_metadata(spec.class_map_path, num_classes)
+	if not class_metadata and num_classes:
 		class_metadata = [_shape_metadata(None, idx) for idx in range(num_classes)]
 	class_names = [meta.get("label", f"class_{idx}") for idx, meta in enumerate(class_metadata)]
 
-	net = _build_model(num_classes)
-	net.load_state_dict(state)
-	net.to(DEVICE)
-	net.eval()
-	model = net
+	load_seconds = time.perf_counter() - started
 
+	# Warm-up passes at the batch sizes traffic will use, so the first requests after a
+	# swap do not pay for lazy initialisation, page faults or allocator growth.
+	with torch.no_grad():
+		for batch_size in WARMUP_BATCH_SIZES:
+			loaded_model(torch.zeros((batch_size, 3, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), dtype=torch.float32, device=DEVICE))
+
+	entry = LoadedModel(
+		spec=spec,
+		identity=model_identity(spec.path),
+		model=loaded_model,
+		class_metadata=class_metadata,
+		class_names=class_names,
+		memory_bytes=_memory_bytes(loaded_model, spec.path),
+		load_seconds=load_seconds,
+		warmup_seconds=time.perf_counter() - started - load_seconds,
+		responses=ResponseTable(class_metadata, class_names, MODEL_ARCH),
+		embed=embedding_head(loaded_model),
+	)
+	if EXECUTOR_MODE != "process":
+		# Each model gets its own batcher so a forward pass never mixes models.
+		entry.batcher = MicroBatcher(
+			functools.partial(_forward, entry),
+			max_batch_size=BATCH_MAX_SIZE,
+			max_wait_ms=BATCH_MAX_WAIT_MS,
+			name=f"micro-batcher[{spec.label}]",
+		)
+		entry.batcher.start()
+	return entry
+
+
+def _publish_models(entry: LoadedModel, previous: LoadedModel | None) -> None:
+	metrics.set_model_info(
+		[(active.label, str(active.spec.path), active.memory_bytes) for active in registry.entries()],
+		MODEL_ARCH,
+		str(DEVICE),
+	)
+
+
+def _retire_model(entry: LoadedModel) -> None:
+	# Runs once the last request that started on this model has finished.
+	if entry.batcher is not None:
+		entry.batcher.stop()
+
+
+registry = ModelRegistry(
+	_load_entry,
+	MODEL_DIR,
+	MODEL_PATH,
+	CLASS_MAP_PATH,
+	[MODEL_VARIANT_FILES[MODEL_VARIANT]] if MODEL_VARIANT else DEFAULT_ARTEFACTS,
+	watch_interval=MODEL_WATCH_INTERVAL,
+	on_swap=_publish_models,
+	on_retire=_retire_model,
+)
 
-def _prepare_image(image_bytes: bytes) -> torch.Tensor:
+
+def _load_model() -> None:
+	_import_runtime()
+	registry.default_path = MODEL_PATH
+	registry.refresh(DEFAULT_SLOT, force=True, strict=True)
+
+
+def _prepare_into(image_bytes: bytes | ImageBuffer, out: torch.Tensor, label: str) -> None:
 	try:
-		pil_image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+		with metrics.stage("decode", label):
+			if PREPROCESS_MODE == "fast":
+				pil_image = fast_preprocessor.decode(image_bytes)
+			else:
+				pil_image = open_image(image_bytes).convert("RGB")
 	except Exception as exc:
 		raise HTTPException(status_code=400, detail=f"Unable to read image: {exc}") from exc
 
-	tensor = inference_transforms(pil_image).unsqueeze(0)
+	with metrics.stage("transform", label):
+		if PREPROCESS_MODE == "fast":
+			fast_preprocessor.to_tensor(pil_image, out=out)
+		else:
+			out.copy_(inference_transforms(pil_image))
+
+
+def _prepare_image(image_bytes: bytes | ImageBuffer, label: str) -> torch.Tensor:
+	tensor = torch.empty((1, 3, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), dtype=torch.float32)
+	_prepare_into(image_bytes, tensor[0], label)
 	return tensor.to(DEVICE)
 
 
-def _format_prediction(probabilities: torch.Tensor) -> Dict[str, Any]:
-	probs = torch.softmax(probabilities, dim=1)
+def _prepare_views(image_bytes: bytes | ImageBuffer, count: int, label: str, skip: int = 0) -> torch.Tensor:
+	"""The first `count` TTA views of one image as one batch, minus the `skip` leading ones the caller already ran."""
+	views = tta_views(count)[skip:]
+	batch = torch.empty((len(views), 3, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), dtype=torch.float32)
+	try:
+		with metrics.stage("decode", label):
+			if PREPROCESS_MODE == "fast":
+				pil_image = fast_preprocessor.decode(image_bytes, resize=False)
+			else:
+				pil_image = open_image(image_bytes).convert("RGB")
+	except Exception as exc:
+		raise HTTPException(status_code=400, detail=f"Unable to read image: {exc}") from exc
+
+	with metrics.stage("transform", label):
+		for row, (crop, mirrored) in enumerate(views):
+			if mirrored and row > 0 and views[row - 1][0] == crop:
+				# Mirror of the view just built: flip its tensor instead of resizing again.
+				batch[row] = batch[row - 1].flip(-1)
+				continue
+			# Crop and resize in one pass; the full view equals what _prepare_into produces.
+			view = pil_image.resize((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), Image.BILINEAR, box=crop_box(crop, *pil_image.size))
+			if PREPROCESS_MODE == "fast":
+				fast_preprocessor.to_tensor(view, out=batch[row])
+			else:
+				batch[row].copy_(inference_transforms(view))
+			if mirrored:
+				batch[row] = batch[row].flip(-1)
+	return batch.to(DEVICE)
+
+
+def _prepare_raw(body: bytearray, header: RawHeader, label: str) -> torch.Tensor:
+	with metrics.stage("transform", label):
+		# A view of the request body itself: no copy until the normalized float tensor is written.
+		pixels = torch.frombuffer(body, dtype=torch.uint8, count=header.pixel_bytes, offset=header.size)
+		pixels = pixels.view(header.count, header.height, header.width, header.channels).permute(0, 3, 1, 2)
+		return fast_preprocessor.normalize(pixels).to(DEVICE)
+
+
+def _prepare_batch(payloads: List[ImageBuffer], label: str) -> Tuple[torch.Tensor | None, List[str | None]]:
+	# Decodes straight into one preallocated batch tensor; failed images leave no row behind.
+	batch = torch.empty((len(payloads), 3, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), dtype=torch.float32)
+	errors: List[str | None] = []
+	rows = 0
+	for payload in payloads:
+		try:
+			_prepare_into(payload, batch[rows], label)
+		except HTTPException as exc:
+			errors.append(str(exc.detail))
+			continue
+		errors.append(None)
+		rows += 1
+
+	if rows == 0:
+		return None, errors
+	return batch[:rows].to(DEVICE), errors
+
+
+def _top_k(logits: torch.Tensor) -> List[List[Any]]:
+	# [[class_id, score], ...]: what the prediction cache stores and both response modes render from.
+	probs = torch.softmax(logits, dim=1)
 	top_scores, top_indices = torch.topk(probs, k=min(3, probs.shape[1]))
+	return [[idx, score] for idx, score in zip(top_indices[0].tolist(), top_scores[0].tolist())]
 
-	def _pack(idx: int, score: float) -> Dict[str, Any]:
-		meta = class_metadata[idx] if idx < len(class_metadata) else {"label": f"class_{idx}"}
-		return {
-			"label": meta.get("label", f"class_{idx}"),
-			"score": float(score),
-			"common_name": meta.get("common_name"),
-			"scientific_name": meta.get("scientific_name"),
-			"metadata": meta,
-		}
 
-	top_k = [_pack(int(idx), float(score)) for score, idx in zip(top_scores[0], top_indices[0])]
-	primary = top_k[0]
+def _forward(entry: LoadedModel, inputs: torch.Tensor) -> torch.Tensor:
+	metrics.BATCH_ROWS.labels(entry.label).observe(inputs.shape[0])
+	with metrics.stage("forward", entry.label), profiler_sampler.maybe_profile():
+		return entry.model(inputs)
+
+
+def _embed_image(entry: LoadedModel, image_bytes: bytes | ImageBuffer) -> Tuple[torch.Tensor, torch.Tensor]:
+	"""(logits, pooled embedding) of one image from a single forward pass, outside the micro-batcher."""
+	if entry.embed is None:
+		raise HTTPException(status_code=409, detail=f"Model '{entry.label}' does not expose embeddings (frozen, quantized and ONNX exports do not).")
+	inputs = _prepare_image(image_bytes, entry.label)
+	with torch.no_grad(), metrics.stage("forward", entry.label):
+		logits, embedding = entry.embed(inputs)
+	return logits, embedding.float().cpu()
+
+
+def _init_process_worker(num_threads: int) -> None:
+	_import_runtime()
+	torch.set_num_threads(num_threads)
+	_load_model()
+
+
+def _worker_entry(spec: ModelSpec, identity: str) -> LoadedModel:
+	# Process workers follow the parent's registry: they (re)load whatever it currently serves.
+	entry = registry.get(spec.slot)
+	if entry is None or entry.spec != spec or entry.identity != identity:
+		entry = _load_entry(spec)
+		registry.swap(entry)
+	return entry
 
-	return {
-		"disease": primary["label"],
-		"confidence": primary["score"],
-		"common_name": primary.get("common_name"),
-		"scientific_name": primary.get("scientific_name"),
-		"top_k": top_k,
-	}
 
+def _process_predict(image_bytes: bytes | bytearray, spec: ModelSpec, identity: str) -> torch.Tensor:
+	# Runs inside a process-pool worker that loaded its own model copy.
+	entry = _worker_entry(spec, identity)
+	with torch.no_grad():
+		return _forward(entry, _prepare_image(image_bytes, entry.label))
+
+
+def _process_predict_views(image_bytes: bytes | bytearray, spec: ModelSpec, identity: str, count: int, skip: int) -> torch.Tensor:
+	entry = _worker_entry(spec, identity)
+	with torch.no_grad():
+		return _forward(entry, _prepare_views(image_bytes, count, entry.label, skip))
+
+
+def _process_embed(image_bytes: bytes | bytearray, spec: ModelSpec, identity: str) -> Tuple[torch.Tensor, torch.Tensor]:
+	return _embed_image(_worker_entry(spec, identity), image_bytes)
 
-def _ensure_model_loaded() -> None:
-	if model is None:
+
+def _process_predict_raw(body: bytearray, header: RawHeader, spec: ModelSpec, identity: str) -> torch.Tensor:
+	entry = _worker_entry(spec, identity)
+	with torch.no_grad():
+		return _forward(entry, _prepare_raw(body, header, entry.label))
+
+
+def _process_predict_batch(payloads: List[bytearray | bytes], spec: ModelSpec, identity: str) -> Tuple[torch.Tensor | None, List[str | None]]:
+	entry = _worker_entry(spec, identity)
+	inputs, errors = _prepare_batch(payloads, entry.label)
+	if inputs is None:
+		return None, errors
+	with torch.no_grad():
+		return _forward(entry, inputs), errors
+
+
+def _ensure_model_loaded(entry: LoadedModel | None) -> LoadedModel:
+	if startup["status"] == "loading":
+		raise HTTPException(status_code=503, detail="Model is still loading.", headers={"Retry-After": "1"})
+	if entry is None:
 		raise HTTPException(status_code=503, detail="Model is not loaded. Check server logs for details.")
+	return entry
+
+
+def _slot(crop_type: str | None) -> str:
+	return (crop_type or DEFAULT_SLOT).strip().lower()
+
+
+def _open_similar_index(entry: LoadedModel) -> None:
+	global similar_index
+
+	similar_index = EmbeddingIndex(Path(SIMILAR_INDEX_PATH))
+	built_with = similar_index.meta.get("model")
+	if built_with and built_with != entry.spec.path.name:
+		# Embeddings of another model live in another space: neighbours would be meaningless.
+		print(f"⚠️ Similar-case index was built with {built_with}, serving {entry.spec.path.name}; rebuild it with routes/build_index.py")
+	print(f"🔎 Similar-case index: {len(similar_index)} case(s) from {SIMILAR_INDEX_PATH}")
 
 
 app = FastAPI(title="Krishi Mitra ML Service", version="1.0.0")
@@ -227,70 +742,729 @@ app.add_middleware(
 )
 
 
-@app.on_event("startup")
-def load_model() -> None:
+def _boot(raise_errors: bool = True) -> None:
+	"""Import torch, load and warm the models and start the workers, timing each phase."""
+	global pool
+
+	phases: Dict[str, float] = startup["phases"]
+	started = time.perf_counter()
 	try:
+		mark = time.perf_counter()
+		_import_runtime()
+		phases["import_runtime"] = time.perf_counter() - mark
+
 		MODEL_DIR.mkdir(parents=True, exist_ok=True)
 		_load_model()
-		if isinstance(model, torch.nn.Module):
-			model.to(DEVICE)
+		entry = registry.get()
+		phases["load_model"] = entry.load_seconds  # type: ignore[union-attr]
+		phases["warm_up"] = entry.warmup_seconds  # type: ignore[union-attr]
 		print(f"✅ Model loaded from {MODEL_PATH} on device {DEVICE}")
+
+		# Per-crop models are optional: one that fails to load is logged and retried when its file changes.
+		mark = time.perf_counter()
+		registry.poll()
+		phases["crop_models"] = time.perf_counter() - mark
+
+		mark = time.perf_counter()
+		if EXECUTOR_MODE == "process":
+			workers = EXECUTOR_WORKERS or os.cpu_count() or 1
+			pool = WorkerPool(
+				"process",
+				max_workers=workers,
+				max_pending=EXECUTOR_MAX_PENDING,
+				retry_after=EXECUTOR_RETRY_AFTER,
+				initializer=_init_process_worker,
+				initargs=(max(1, (os.cpu_count() or 1) // workers),),
+			)
+			pool.warm()
+		else:
+			pool = WorkerPool(
+				EXECUTOR_MODE,
+				max_workers=EXECUTOR_WORKERS,
+				max_pending=EXECUTOR_MAX_PENDING,
+				retry_after=EXECUTOR_RETRY_AFTER,
+			)
+		phases["worker_pool"] = time.perf_counter() - mark
+
+		if SIMILAR_INDEX_PATH:
+			mark = time.perf_counter()
+			_open_similar_index(entry)  # type: ignore[arg-type]
+			phases["similar_index"] = time.perf_counter() - mark
 	except Exception as exc:  # pylint: disable=broad-except
+		startup.update(status="error", error=str(exc))
 		print(f"❌ Failed to load model: {exc}")
-		raise
+		if raise_errors:
+			raise
+		return
+
+	phases["boot_total"] = time.perf_counter() - started
+	startup["status"] = "ok"
+	registry.start()
+	print("⏱️ Startup: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in phases.items()))
+
+
+@app.on_event("startup")
+def load_model() -> None:
+	global prediction_cache
+
+	# From the first third-party import of this module until the server is about to serve.
+	startup["phases"]["import_app"] = time.perf_counter() - _IMPORT_STARTED
+
+	metrics.QUEUE_DEPTH.set_function(
+		lambda: sum(entry.batcher.queue_depth() for entry in registry.entries() if entry.batcher is not None)
+	)
+	metrics.POOL_IN_FLIGHT.set_function(lambda: pool.stats()["in_flight"] if pool is not None else 0)
+
+	if PREDICTION_CACHE:
+		if PREDICTION_CACHE_URL:
+			backend = RedisCacheBackend(PREDICTION_CACHE_URL, ttl_seconds=PREDICTION_CACHE_TTL)
+		else:
+			backend = MemoryCacheBackend(ttl_seconds=PREDICTION_CACHE_TTL, max_bytes=PREDICTION_CACHE_MAX_BYTES)
+		prediction_cache = PredictionCache(backend)
+
+	if FAST_START:
+		# Requests get 503 + Retry-After (and /health says `loading`) until _boot finishes.
+		threading.Thread(target=_boot, kwargs={"raise_errors": False}, name="model-loader", daemon=True).start()
+	else:
+		_boot()
+
+
+def _record_job(job: Job) -> None:
+	metrics.JOBS.labels(job.priority, job.status).inc()
+	if job.wait_seconds is not None:
+		metrics.JOB_WAIT_SECONDS.labels(job.priority).observe(job.wait_seconds)
+	if job.run_seconds is not None:
+		metrics.JOB_RUN_SECONDS.labels(job.priority).observe(job.run_seconds)
+
+
+@app.on_event("startup")
+async def start_jobs() -> None:
+	global job_queue
+
+	if JOB_WORKERS <= 0:
+		return
+	job_queue = JobQueue(
+		max_jobs=JOB_QUEUE_MAX,
+		max_bytes=JOB_QUEUE_MAX_BYTES,
+		ttl=JOB_TTL,
+		store_path=Path(JOB_STORE_PATH) if JOB_STORE_PATH else None,
+		retry_after=EXECUTOR_RETRY_AFTER,
+		on_finish=_record_job,
+	)
+	for priority in PRIORITIES:
+		metrics.JOB_QUEUE_DEPTH.labels(priority).set_function(functools.partial(job_queue.queue_depth, priority))
+	await job_queue.start(_run_job, JOB_WORKERS)
+
+
+@app.on_event("shutdown")
+async def stop_jobs() -> None:
+	if job_queue is not None:
+		await job_queue.stop()
+
+
+@app.on_event("shutdown")
+def stop_workers() -> None:
+	registry.stop()
+	for entry in registry.entries():
+		_retire_model(entry)
+	if pool is not None:
+		pool.shutdown()
+
+
+async def _batched(entry: LoadedModel, inputs: torch.Tensor) -> torch.Tensor:
+	try:
+		return await asyncio.wrap_future(entry.batcher.submit(inputs))
+	except BatcherStopped as exc:
+		# The model was retired (hot swap, shutdown) while this request prepared its input.
+		raise HTTPException(status_code=503, detail="Model is being replaced. Please retry shortly.", headers={"Retry-After": "1"}) from exc
+
+
+async def _infer(entry: LoadedModel, image_bytes: bytes | ImageBuffer, views: int = 1, skip: int = 0) -> torch.Tensor:
+	"""Logits of the standard view, or with `views` > 1 one row per TTA view after the first `skip`."""
+	assert pool is not None
+	try:
+		if pool.mode == "process":
+			# Stage metrics recorded inside worker processes are not visible here.
+			with metrics.stage("process_worker", entry.label):
+				# A spooled (memory-mapped) upload cannot be pickled; it is copied once for the worker.
+				payload = image_bytes if isinstance(image_bytes, (bytes, bytearray)) else bytes(image_bytes)
+				if views > 1:
+					return await pool.run(_process_predict_views, payload, entry.spec, entry.identity, views, skip)
+				return await pool.run(_process_predict, payload, entry.spec, entry.identity)
+
+		# The slot is held until the batcher answers, so its queue is bounded by the pool too.
+		with pool.admit():
+			if views > 1:
+				input_tensor = await pool.call(_prepare_views, image_bytes, views, entry.label, skip)
+			else:
+				input_tensor = await pool.call(_prepare_image, image_bytes, entry.label)
+			return await _batched(entry, input_tensor)
+	except PoolSaturated as exc:
+		metrics.POOL_REJECTED.inc()
+		raise HTTPException(
+			status_code=503,
+			detail="Inference workers are busy. Please retry shortly.",
+			headers={"Retry-After": str(exc.retry_after)},
+		) from exc
+
+
+async def _infer_tta(entry: LoadedModel, image_bytes: bytes | ImageBuffer, mode: str) -> Tuple[torch.Tensor, bool]:
+	"""Logits under TTA `mode` (averaged over the views when they ran) and whether they ran."""
+	if mode == "always":
+		return (await _infer(entry, image_bytes, views=TTA_VIEWS)).mean(dim=0, keepdim=True), True
+
+	outputs = await _infer(entry, image_bytes)
+	if mode == "off" or float(torch.softmax(outputs, dim=1).max()) >= TTA_THRESHOLD:
+		return outputs, False
+	# Escalation re-decodes the upload but skips the standard view, whose logits are already known.
+	extra = await _infer(entry, image_bytes, views=TTA_VIEWS, skip=1)
+	return torch.cat([outputs, extra]).mean(dim=0, keepdim=True), True
+
+
+def _tta_mode(request: Request) -> str:
+	mode = request.query_params.get("tta", TTA_MODE).lower()
+	if mode not in TTA_MODES:
+		raise HTTPException(status_code=400, detail=f"Unsupported tta '{mode}'. Supported options: {', '.join(TTA_MODES)}")
+	return mode
+
+
+async def _infer_raw(entry: LoadedModel, body: bytearray, header: RawHeader) -> torch.Tensor:
+	assert pool is not None
+	try:
+		if pool.mode == "process":
+			with metrics.stage("process_worker", entry.label):
+				return await pool.run(_process_predict_raw, body, header, entry.spec, entry.identity)
+		with pool.admit():
+			inputs = await pool.call(_prepare_raw, body, header, entry.label)
+			return await _batched(entry, inputs)
+	except PoolSaturated as exc:
+		metrics.POOL_REJECTED.inc()
+		raise HTTPException(
+			status_code=503,
+			detail="Inference workers are busy. Please retry shortly.",
+			headers={"Retry-After": str(exc.retry_after)},
+		) from exc
+
+
+async def _infer_batch(entry: LoadedModel, payloads: List[ImageBuffer]) -> Tuple[torch.Tensor | None, List[str | None]]:
+	assert pool is not None
+	if pool.mode == "process":
+		# Spooled (memory-mapped) entries cannot be pickled; they are copied once for the worker.
+		payloads = [payload if isinstance(payload, bytearray) else bytes(payload) for payload in payloads]
+	deadline = time.monotonic() + PREDICT_BATCH_WAIT
+	while True:
+		try:
+			if pool.mode == "process":
+				return await pool.run(_process_predict_batch, payloads, entry.spec, entry.identity)
+
+			with pool.admit():
+				inputs, errors = await pool.call(_prepare_batch, payloads, entry.label)
+				if inputs is None:
+					return None, errors
+				return await _batched(entry, inputs), errors
+		except PoolSaturated as exc:
+			metrics.POOL_REJECTED.inc()
+			if time.monotonic() + exc.retry_after > deadline:
+				raise HTTPException(
+					status_code=503,
+					detail="Inference workers are busy. Please retry shortly.",
+					headers={"Retry-After": str(exc.retry_after)},
+				) from exc
+			# Bulk work yields to interactive traffic for up to PREDICT_BATCH_WAIT seconds.
+			await asyncio.sleep(exc.retry_after)
+
+
+async def _predict_image(entry: LoadedModel, image_bytes: bytes | ImageBuffer, tta: str) -> Dict[str, Any]:
+	"""Cached or freshly inferred `{"top_k": ...}` for one image on `entry`."""
+	# TTA answers differ from single-view ones, so they are cached under their own settings.
+	identity = entry.identity if tta == "off" else f"{entry.identity}|tta={tta}:{TTA_VIEWS}:{TTA_THRESHOLD}"
+	cache_key = prediction_cache.key(identity, image_bytes) if prediction_cache is not None else None
+	prediction = _cache_lookup(cache_key)
+
+	if prediction is None:
+		outputs, escalated = await _infer_tta(entry, image_bytes, tta)
+		if tta != "off":
+			metrics.TTA_PREDICTIONS.labels(entry.label, tta, "true" if escalated else "false").inc()
+		with metrics.stage("postprocess", entry.label):
+			prediction = {"top_k": _top_k(outputs)}
+		if cache_key is not None:
+			prediction_cache.set(cache_key, prediction)  # type: ignore[union-attr]
+	return prediction
+
+
+async def _run_job(job: Job, image_bytes: bytes | ImageBuffer) -> bytes:
+	compact = job.options["compact"]
+	while True:
+		try:
+			with registry.use(_slot(job.crop_type)) as active:
+				entry = _ensure_model_loaded(active)
+				prediction = await _predict_image(entry, image_bytes, job.options["tta"])
+				return entry.responses.render(prediction["top_k"], compact, fields=_response_fields(job.crop_type, entry, compact))
+		except HTTPException as exc:
+			# Loading models or saturated workers: a queued job waits its turn instead of failing.
+			if exc.status_code != 503 or time.time() >= job.expires:
+				raise
+			await asyncio.sleep(float((exc.headers or {}).get("Retry-After", 1)))
+
+
+def _response_fields(crop_type: str, entry: LoadedModel, compact: bool = False) -> Dict[str, Any]:
+	if compact:
+		return {"crop_type": crop_type, "model": entry.label}
+	return {
+		"crop_type": crop_type,
+		"model": entry.label,
+		"model_path": str(entry.spec.path),
+		"device": str(DEVICE),
+		"source": "ml-service",
+	}
+
+
+async def _predict_chunk(entry: LoadedModel, chunk: List[Tuple[str, ImageBuffer | Exception]], start: int, crop_type: str, compact: bool = False) -> List[bytes]:
+	results: List[Dict[str, Any]] = [{} for _ in chunk]
+	pending: List[Tuple[int, ImageBuffer, str | None]] = []
+
+	# Entries were size- and header-checked by their ImageSink while being read (see bulk.py).
+	for position, (_, payload) in enumerate(chunk):
+		if isinstance(payload, UploadRejected):
+			results[position] = {"error": payload.detail}
+		elif isinstance(payload, Exception):
+			results[position] = {"error": f"Unable to read archive entry: {payload}"}
+		else:
+			cache_key = prediction_cache.key(entry.identity, payload) if prediction_cache is not None else None
+			cached = _cache_lookup(cache_key)
+			if cached is not None:
+				results[position] = cached
+			else:
+				pending.append((position, payload, cache_key))
+
+	if pending:
+		outputs, errors = await _infer_batch(entry, [payload for _, payload, _ in pending])
+		row = 0
+		for (position, _, cache_key), error in zip(pending, errors):
+			if error is not None:
+				results[position] = {"error": error}
+				continue
+			prediction = {"top_k": _top_k(outputs[row:row + 1])}  # type: ignore[index]
+			row += 1
+			if cache_key is not None:
+				prediction_cache.set(cache_key, prediction)  # type: ignore[union-attr]
+			results[position] = prediction
+
+	lines = []
+	fields = _response_fields(crop_type, entry, compact)
+	for position, ((filename, _), result) in enumerate(zip(chunk, results)):
+		lead = {"index": start + position, "filename": filename}
+		if "error" in result:
+			lines.append(dumps({**lead, **result}) + b"\n")
+		else:
+			lines.append(entry.responses.render(result["top_k"], compact, lead, fields) + b"\n")
+	return lines
+
+
+def _cache_lookup(cache_key: str | None) -> Dict[str, Any] | None:
+	if cache_key is None:
+		return None
+	cached = prediction_cache.get(cache_key)  # type: ignore[union-attr]
+	metrics.CACHE_LOOKUPS.labels("hit" if cached is not None else "miss").inc()
+	return cached
+
+
+def _endpoint_label(request: Request) -> str:
+	# Route templates (not raw paths) keep label cardinality bounded.
+	for route in app.router.routes:
+		match, _ = route.matches(request.scope)
+		if match == Match.FULL:
+			return getattr(route, "path", "other")
+	return "other"
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next: Any) -> Response:
+	endpoint = _endpoint_label(request)
+	gauge = metrics.IN_FLIGHT.labels(endpoint)
+	gauge.inc()
+	started = time.perf_counter()
+	status = 500
+	try:
+		response = await call_next(request)
+		status = response.status_code
+		return response
+	finally:
+		gauge.dec()
+		metrics.REQUEST_SECONDS.labels(endpoint, request.method).observe(time.perf_counter() - started)
+		metrics.REQUESTS.labels(endpoint, request.method, str(status)).inc()
+
+
+@app.get("/metrics")
+def prometheus_metrics() -> Response:
+	return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+
+def _require_admin(request: Request) -> None:
+	if not ADMIN_TOKEN:
+		raise HTTPException(status_code=403, detail="Admin endpoints are disabled. Set ADMIN_TOKEN to enable them.")
+	if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+		raise HTTPException(status_code=401, detail="Invalid admin token.")
 
 
 @app.get("/health")
 def health() -> Dict[str, Any]:
+	entry = registry.get()
+	status = startup["status"]
+	if status == "ok" and entry is None:
+		status = "error"
 	return {
-		"status": "ok" if model is not None else "error",
-		"device": str(DEVICE),
-		"model_path": str(MODEL_PATH),
-		"num_classes": len(class_metadata),
+		"status": status,
+		"error": startup["error"],
+		"startup": startup["phases"],
+		"device": str(DEVICE) if DEVICE is not None else None,
+		"model_path": str(entry.spec.path if entry is not None else MODEL_PATH),
+		"num_classes": len(entry.class_metadata) if entry is not None else 0,
 		"model_arch": MODEL_ARCH,
+		"models": {active.spec.slot: active.label for active in registry.entries()},
+		"worker_pid": os.getpid(),
 	}
 
 
 @app.get("/metadata")
-def metadata() -> Dict[str, Any]:
-	_ensure_model_loaded()
+def metadata(request: Request, crop_type: str | None = None) -> Response:
+	"""Class names and metadata of a model, pre-serialized at load; compact predictions reference its ETag."""
+	entry = _ensure_model_loaded(registry.get(_slot(crop_type)))
+	headers = {"ETag": entry.responses.metadata_etag, "Cache-Control": "no-cache"}
+	if entry.responses.metadata_etag in request.headers.get("if-none-match", ""):
+		return Response(status_code=304, headers=headers)
+	return Response(content=entry.responses.metadata_body, media_type="application/json", headers=headers)
+
+
+@app.get("/stats")
+def stats() -> Dict[str, Any]:
+	batching = {entry.label: entry.batcher.stats() for entry in registry.entries() if entry.batcher is not None}
 	return {
-		"classes": class_names,
-		"metadata": class_metadata,
-		"model_arch": MODEL_ARCH,
+		"batching": batching or None,
+		"pool": pool.stats() if pool is not None else None,
+		"cache": prediction_cache.stats() if prediction_cache is not None else None,
+		"jobs": job_queue.stats() if job_queue is not None else None,
+		"similar_index": similar_index.describe() if similar_index is not None else None,
 	}
 
 
+@app.get("/admin/models")
+def list_models(request: Request) -> Dict[str, Any]:
+	_require_admin(request)
+	return registry.describe()
+
+
+@app.post("/admin/models/{slot}/activate")
+async def activate_model(slot: str, request: Request, version: str | None = None) -> Dict[str, Any]:
+	"""Pin `slot` to `version` (an artefact file name); without `version` it follows the preferred artefact again."""
+	_require_admin(request)
+	try:
+		entry = await run_in_threadpool(registry.activate, slot, version)
+	except KeyError as exc:
+		raise HTTPException(status_code=404, detail=str(exc.args[0])) from exc
+	except Exception as exc:  # pylint: disable=broad-except
+		raise HTTPException(status_code=400, detail=f"Unable to load model: {exc}") from exc
+	return {"slot": slot, "active": entry.describe()}
+
+
 @app.post("/predict")
-async def predict(
-	image: UploadFile = File(...),
-	crop_type: str = Form("general"),
-) -> Dict[str, Any]:
-	_ensure_model_loaded()
+async def predict(request: Request) -> Response:
+	"""Multipart `image` plus optional `crop_type`; the image is streamed and validated while it uploads."""
+	compact = wants_compact(request)
+	tta = _tta_mode(request)
+	# Fail fast while the model is loading, before reading a potentially large body.
+	_ensure_model_loaded(registry.get())
+
+	started = time.perf_counter()
+	try:
+		form = await read_image_form(request, "image", MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS, ALLOWED_UPLOAD_TYPES, UPLOAD_SPOOL_BYTES)
+	except UploadRejected as exc:
+		raise HTTPException(status_code=exc.status_code, detail=exc.detail) from exc
+	read_seconds = time.perf_counter() - started
+	crop_type = form.fields.get("crop_type") or "general"
+	image_bytes = form.image
 
-	if image.content_type not in {"image/jpeg", "image/png", "image/jpg", "application/octet-stream"}:
-		raise HTTPException(status_code=415, detail="Unsupported file type. Please upload a JPG or PNG image.")
+	with registry.use(_slot(crop_type)) as active:
+		entry = _ensure_model_loaded(active)
+		label = entry.label
+		metrics.observe_stage("upload_read", label, read_seconds)
+		prediction = await _predict_image(entry, image_bytes, tta)
 
-	image_bytes = await image.read()
-	if not image_bytes:
-		raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+		with metrics.stage("serialize", label):
+			body = entry.responses.render(prediction["top_k"], compact, fields=_response_fields(crop_type, entry, compact))
+		return Response(content=body, media_type="application/json", headers={"Vary": "Accept"})
 
-	input_tensor = _prepare_image(image_bytes)
 
-	with torch.no_grad():
-		outputs = model(input_tensor)  # type: ignore[arg-type]
-
-	prediction = _format_prediction(outputs)
-	prediction.update(
-		{
-			"crop_type": crop_type,
-			"model_path": str(MODEL_PATH),
-			"device": str(DEVICE),
-			"source": "ml-service",
+async def _read_raw_body(request: Request) -> Tuple[bytearray, RawHeader]:
+	try:
+		declared = int(request.headers.get("content-length") or 0)
+	except ValueError as exc:
+		raise HTTPException(status_code=400, detail="Malformed Content-Length header.") from exc
+	if MAX_UPLOAD_BYTES and declared > MAX_UPLOAD_BYTES:
+		raise HTTPException(status_code=413, detail=f"Body exceeds the {MAX_UPLOAD_BYTES} byte limit.")
+	# The one copy of the pixels: out of the socket chunks into a buffer the tensor can wrap.
+	body = bytearray()
+	async for chunk in request.stream():
+		body += chunk
+		if MAX_UPLOAD_BYTES and len(body) > MAX_UPLOAD_BYTES:
+			raise HTTPException(status_code=413, detail=f"Body exceeds the {MAX_UPLOAD_BYTES} byte limit.")
+	try:
+		header = parse_header(body)
+	except RawTensorError as exc:
+		raise HTTPException(status_code=400, detail=str(exc)) from exc
+	if (header.height, header.width) != (MODEL_INPUT_SIZE, MODEL_INPUT_SIZE):
+		raise HTTPException(status_code=400, detail=f"Images must be {MODEL_INPUT_SIZE}x{MODEL_INPUT_SIZE}, got {header.height}x{header.width}.")
+	return body, header
+
+
+@app.post("/predict/raw")
+async def predict_raw(request: Request, crop_type: str = "general") -> Response:
+	"""Pre-resized uint8 RGB pixels (see rawtensor.py); one image answers like `/predict`, several with NDJSON lines like `/predict/batch`."""
+	compact = wants_compact(request)
+	_ensure_model_loaded(registry.get())
+
+	started = time.perf_counter()
+	body, header = await _read_raw_body(request)
+	read_seconds = time.perf_counter() - started
+
+	with registry.use(_slot(crop_type)) as active:
+		entry = _ensure_model_loaded(active)
+		if header.model_version and header.model_version != entry.spec.path.name:
+			raise HTTPException(status_code=409, detail=f"Serving model version '{entry.spec.path.name}', not '{header.model_version}'.")
+		label = entry.label
+		metrics.observe_stage("upload_read", label, read_seconds)
+		# No TTA (its crops need the full-resolution photo) and no prediction cache, which keys on encoded uploads.
+		outputs = await _infer_raw(entry, body, header)
+
+		with metrics.stage("serialize", label):
+			fields = _response_fields(crop_type, entry, compact)
+			if header.count == 1:
+				return Response(content=entry.responses.render(_top_k(outputs), compact, fields=fields), media_type="application/json", headers={"Vary": "Accept"})
+			lines = [entry.responses.render(_top_k(outputs[row:row + 1]), compact, {"index": row}, fields) + b"\n" for row in range(header.count)]
+		return Response(content=b"".join(lines), media_type="application/x-ndjson", headers={"Vary": "Accept"})
+
+
+def _require_similar() -> Any:
+	if similar_index is None:
+		raise HTTPException(status_code=403, detail="Similar-case search is disabled. Set SIMILAR_INDEX_PATH to enable it.")
+	return similar_index
+
+
+async def _embed(entry: LoadedModel, image_bytes: bytes | ImageBuffer) -> Tuple[torch.Tensor, torch.Tensor]:
+	assert pool is not None
+	try:
+		if pool.mode == "process":
+			payload = image_bytes if isinstance(image_bytes, (bytes, bytearray)) else bytes(image_bytes)
+			return await pool.run(_process_embed, payload, entry.spec, entry.identity)
+		return await pool.run(_embed_image, entry, image_bytes)
+	except PoolSaturated as exc:
+		metrics.POOL_REJECTED.inc()
+		raise HTTPException(
+			status_code=503,
+			detail="Inference workers are busy. Please retry shortly.",
+			headers={"Retry-After": str(exc.retry_after)},
+		) from exc
+
+
+async def _read_similar_form(request: Request) -> Any:
+	try:
+		return await read_image_form(request, "image", MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS, ALLOWED_UPLOAD_TYPES, UPLOAD_SPOOL_BYTES)
+	except UploadRejected as exc:
+		raise HTTPException(status_code=exc.status_code, detail=exc.detail) from exc
+
+
+def _check_index_dim(index: Any, embedding: torch.Tensor) -> None:
+	if embedding.shape[1] != index.meta["input_dim"]:
+		raise HTTPException(
+			status_code=409,
+			detail=f"Similar-case index expects {index.meta['input_dim']}-d embeddings, the model produces {embedding.shape[1]}-d ones. Rebuild the index.",
+		)
+
+
+@app.post("/similar")
+async def similar(request: Request, k: int = 5) -> Response:
+	"""Multipart `image`; the `k` most similar indexed cases plus the default model's prediction from the same forward pass."""
+	index = _require_similar()
+	if not 1 <= k <= SIMILAR_MAX_K:
+		raise HTTPException(status_code=400, detail=f"k must be between 1 and {SIMILAR_MAX_K}.")
+	_ensure_model_loaded(registry.get())
+	form = await _read_similar_form(request)
+
+	# The index holds embeddings of the default model, whatever the crop type.
+	with registry.use(DEFAULT_SLOT) as active:
+		entry = _ensure_model_loaded(active)
+		logits, embedding = await _embed(entry, form.image)
+		_check_index_dim(index, embedding)
+
+		started = time.perf_counter()
+		await run_in_threadpool(index.refresh)
+		with metrics.stage("similar_search", entry.label):
+			neighbors = (await run_in_threadpool(index.search, embedding.numpy(), k, SIMILAR_NPROBE))[0]
+		search_ms = (time.perf_counter() - started) * 1000
+
+		classes = index.classes
+		fields = {
+			**_response_fields(str(form.fields.get("crop_type") or "general"), entry),
+			"neighbors": [
+				{
+					"key": neighbor.key,
+					"class_id": neighbor.label,
+					"label": classes[neighbor.label] if 0 <= neighbor.label < len(classes) else None,
+					"score": round(min(neighbor.score, 1.0), 4),
+				}
+				for neighbor in neighbors
+			],
+			"search_ms": round(search_ms, 3),
+			"index_size": len(index),
 		}
+		body = entry.responses.render(_top_k(logits), False, fields=fields)
+		return Response(content=body, media_type="application/json")
+
+
+@app.post("/admin/similar", status_code=201)
+async def add_similar_case(request: Request) -> Dict[str, Any]:
+	"""Add a validated case to the similar-case index: multipart `image`, `label` (class name or id) and `key`."""
+	_require_admin(request)
+	index = _require_similar()
+	_ensure_model_loaded(registry.get())
+	form = await _read_similar_form(request)
+	label, key = str(form.fields.get("label") or ""), str(form.fields.get("key") or "").strip()
+	if not key:
+		raise HTTPException(status_code=400, detail="`key` (e.g. the case's image path or id) is required.")
+	if label in index.classes:
+		class_id = index.classes.index(label)
+	elif label.isdigit() and (not index.classes or int(label) < len(index.classes)):
+		class_id = int(label)
+	else:
+		raise HTTPException(status_code=400, detail=f"Unknown label '{label}'.")
+
+	with registry.use(DEFAULT_SLOT) as active:
+		entry = _ensure_model_loaded(active)
+		_, embedding = await _embed(entry, form.image)
+	_check_index_dim(index, embedding)
+	await run_in_threadpool(index.add, embedding.numpy(), [class_id], [key])
+	return {"key": key, "class_id": class_id, "index": index.describe()}
+
+
+def _require_jobs() -> JobQueue:
+	if job_queue is None:
+		raise HTTPException(status_code=403, detail="Job endpoints are disabled. Set JOB_WORKERS to enable them.")
+	return job_queue
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: Request) -> JSONResponse:
+	"""Same form (and `compact`/`tta` options) as `/predict` plus an optional `priority`; answers with a job id to poll."""
+	queue = _require_jobs()
+	options = {"compact": wants_compact(request), "tta": _tta_mode(request)}
+	try:
+		form = await read_image_form(request, "image", MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS, ALLOWED_UPLOAD_TYPES, UPLOAD_SPOOL_BYTES)
+	except UploadRejected as exc:
+		raise HTTPException(status_code=exc.status_code, detail=exc.detail) from exc
+	priority = (form.fields.get("priority") or request.query_params.get("priority") or "interactive").lower()
+	if priority not in PRIORITIES:
+		raise HTTPException(status_code=400, detail=f"Unsupported priority '{priority}'. Supported options: {', '.join(PRIORITIES)}")
+
+	try:
+		job = await queue.submit(form.image, priority, form.fields.get("crop_type") or "general", options)
+	except QueueFull as exc:
+		metrics.JOBS.labels(priority, "rejected").inc()
+		raise HTTPException(
+			status_code=503,
+			detail="Job queue is full. Please retry shortly.",
+			headers={"Retry-After": str(exc.retry_after)},
+		) from exc
+	return JSONResponse(
+		{**job.describe(), "status_url": f"/jobs/{job.id}"},
+		status_code=202,
+		headers={"Location": f"/jobs/{job.id}"},
 	)
 
-	return prediction
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0) -> Response:
+	"""Status of a job; once `done`, `result` holds the `/predict` body. `wait` long-polls up to JOB_MAX_WAIT seconds."""
+	queue = _require_jobs()
+	job = queue.get(job_id)
+	if job is None:
+		raise HTTPException(status_code=404, detail="Unknown or expired job.")
+	job = await queue.wait(job, min(max(wait, 0.0), JOB_MAX_WAIT))
+
+	body = dumps(job.describe())
+	if job.result is not None:
+		body = body[:-1] + b',"result":' + job.result + b"}"
+	headers = {} if job.done.is_set() else {"Retry-After": "1"}
+	return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request) -> StreamingResponse:
+	"""Multipart `images` (repeated) or one zip/tar `archive`; streams one NDJSON line per image."""
+	_ensure_model_loaded(registry.get())
+	compact = wants_compact(request)
+
+	# Parsed by hand: FastAPI closes File() uploads as soon as the handler returns,
+	# before a StreamingResponse has read them.
+	form = await request.form(max_files=PREDICT_BATCH_MAX_FILES)
+	crop_type = str(form.get("crop_type") or "general")
+	uploads = [item for item in form.getlist("images") if isinstance(item, StarletteUploadFile)]
+	archive = form.get("archive")
+
+	def make_sink() -> ImageSink:
+		return ImageSink(MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS, UPLOAD_SPOOL_BYTES)
+
+	try:
+		if isinstance(archive, StarletteUploadFile):
+			entries = await run_in_threadpool(iter_archive, archive.file, make_sink)
+		elif uploads:
+			entries = iter_uploads(uploads, make_sink)
+		else:
+			raise HTTPException(status_code=400, detail="Upload one or more `images` or a zip/tar `archive`.")
+	except HTTPException:
+		await form.close()
+		raise
+	except Exception as exc:  # pylint: disable=broad-except
+		await form.close()
+		raise HTTPException(status_code=400, detail=f"Unable to open archive: {exc}") from exc
+
+	chunks = chunked(entries, PREDICT_BATCH_CHUNK)
+
+	async def predict(chunk: List[Tuple[str, ImageBuffer | Exception]], start: int) -> List[bytes]:
+		# Each chunk pins the model that is active when it starts, so a hot swap lands between chunks.
+		with registry.use(_slot(crop_type)) as entry:
+			return await _predict_chunk(_ensure_model_loaded(entry), chunk, start, crop_type, compact)
+
+	# The first chunk runs before the response starts, so saturation there is still a plain 503.
+	try:
+		first = await run_in_threadpool(next, chunks, None)
+		first_lines = await predict(first, 0) if first is not None else []
+	except BaseException:
+		await form.close()
+		raise
+
+	async def stream() -> AsyncIterator[bytes]:
+		chunk, lines, start = first, first_lines, 0
+		try:
+			while chunk is not None:
+				for line in lines:
+					yield line
+				start += len(chunk)
+				chunk = await run_in_threadpool(next, chunks, None)
+				if chunk is None:
+					break
+				try:
+					lines = await predict(chunk, start)
+				except HTTPException as exc:
+					if exc.status_code != 503:
+						raise
+					# Too late for a status code: this chunk's images carry the error and the stream ends.
+					for position, (filename, _) in enumerate(chunk):
+						yield dumps({"index": start + position, "filename": filename, "error": exc.detail}) + b"\n"
+					break
+		finally:
+			await form.close()
+
+	return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+"""Dynamic micro-batching for the Krishi Mitra inference service.
+
+Concurrent callers submit preprocessed image tensors to a `MicroBatcher`. A
+single worker thread gathers submissions until either `max_batch_size` rows are
+queued or `max_wait_ms` has elapsed since the first one arrived, runs one
+forward pass over the concatenated batch and resolves every caller's future
+with its own slice of the output logits.
+
+Once `stop` is called, `submit` raises `BatcherStopped`; work queued before the
+stop is still answered, and any future the worker did not reach fails with
+`BatcherStopped` rather than waiting forever.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+import torch
+
+
+_Submission = Tuple[torch.Tensor, Future]
+
+
+class BatcherStopped(RuntimeError):
+	def __init__(self, name: str) -> None:
+		super().__init__(f"{name} is stopped")
+
+
+def _bucket(value: int) -> int:
+	# Power-of-two buckets keep the queue depth histogram small.
+	bucket = 1
+	while bucket < value:
+		bucket <<= 1
+	return bucket
+
+
+class MicroBatcher:
+	def __init__(
+		self,
+		forward: Callable[[torch.Tensor], torch.Tensor],
+		max_batch_size: int = 8,
+		max_wait_ms: float = 10.0,
+		name: str = "micro-batcher",
+	) -> None:
+		if max_batch_size < 1:
+			raise ValueError("max_batch_size must be at least 1")
+
+		self.forward = forward
+		self.max_batch_size = max_batch_size
+		self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+		self.name = name
+
+		self._queue: "queue.Queue[_Submission | None]" = queue.Queue()
+		self._thread: threading.Thread | None = None
+		self._carry: _Submission | None = None
+		# Guards `_stopped` so nothing is queued behind the stop sentinel.
+		self._submit_lock = threading.Lock()
+		self._stopped = False
+		self._stats_lock = threading.Lock()
+		self._batch_sizes: Dict[int, int] = {}
+		self._queue_depths: Dict[int, int] = {}
+		self._batches = 0
+		self._rows = 0
+
+	def start(self) -> None:
+		if self._thread is not None and self._thread.is_alive():
+			return
+		self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout: float | None = 5.0) -> None:
+		with self._submit_lock:
+			if self._stopped:
+				return
+			self._stopped = True
+			self._queue.put(None)
+		if self._thread is None:
+			self._drain()
+			return
+		self._thread.join(timeout)
+		self._thread = None
+
+	def submit(self, inputs: torch.Tensor) -> Future:
+		"""Queue `inputs` (N x C x H x W) and return a future for its N output rows."""
+		future: Future = Future()
+		with self._submit_lock:
+			if self._stopped:
+				raise BatcherStopped(self.name)
+			self._queue.put((inputs, future))
+		return future
+
+	def _drain(self) -> None:
+		# Fails whatever is still queued once the worker has gone (or never ran).
+		pending = [self._carry] if self._carry is not None else []
+		self._carry = None
+		while True:
+			try:
+				item = self._queue.get_nowait()
+			except queue.Empty:
+				break
+			if item is not None:
+				pending.append(item)
+		for _, future in pending:
+			if future.set_running_or_notify_cancel():
+				future.set_exception(BatcherStopped(self.name))
+
+	def queue_depth(self) -> int:
+		return self._queue.qsize()
+
+	def stats(self) -> Dict[str, Any]:
+		with self._stats_lock:
+			return {
+				"max_batch_size": self.max_batch_size,
+				"max_wait_ms": self.max_wait * 1000.0,
+				"queue_depth": self.queue_depth(),
+				"batches": self._batches,
+				"rows": self._rows,
+				"mean_batch_size": (self._rows / self._batches) if self._batches else 0.0,
+				"batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+				"queue_depth_histogram": dict(sorted(self._queue_depths.items())),
+			}
+
+	def _collect(self, first: _Submission) -> Tuple[List[_Submission], bool]:
+		batch = [first]
+		rows = first[0].shape[0]
+		deadline = time.perf_counter() + self.max_wait
+
+		while rows < self.max_batch_size:
+			remaining = deadline - time.perf_counter()
+			try:
+				item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+			except queue.Empty:
+				break
+			if item is None:
+				return batch, True
+			if rows + item[0].shape[0] > self.max_batch_size:
+				# Multi-row submissions never split; hold this one for the next batch.
+				self._carry = item
+				break
+			batch.append(item)
+			rows += item[0].shape[0]
+
+		return batch, False
+
+	def _run(self) -> None:
+		while True:
+			if self._carry is not None:
+				first, self._carry = self._carry, None
+			else:
+				first = self._queue.get()
+			if first is None:
+				self._drain()
+				return
+
+			batch, stopping = self._collect(first)
+			self._dispatch(batch)
+			if stopping:
+				self._drain()
+				return
+
+	def _dispatch(self, batch: List[_Submission]) -> None:
+		# Drop callers that gave up (e.g. client disconnects cancelling the awaitable).
+		live = [(inputs, future) for inputs, future in batch if future.set_running_or_notify_cancel()]
+		if not live:
+			return
+
+		depth = self.queue_depth()
+		try:
+			inputs = live[0][0] if len(live) == 1 else torch.cat([item for item, _ in live])
+			with torch.no_grad():
+				outputs = self.forward(inputs)
+		except Exception as exc:  # pylint: disable=broad-except
+			for _, future in live:
+				future.set_exception(exc)
+			return
+
+		rows = int(inputs.shape[0])
+		with self._stats_lock:
+			self._batches += 1
+			self._rows += rows
+			self._batch_sizes[rows] = self._batch_sizes.get(rows, 0) + 1
+			depth_bucket = _bucket(depth) if depth else 0
+			self._queue_depths[depth_bucket] = self._queue_depths.get(depth_bucket, 0) + 1
+
+		offset = 0
+		for item, future in live:
+			count = item.shape[0]
+			future.set_result(outputs[offset:offset + count])
+			offset += count
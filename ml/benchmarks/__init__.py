@@ -0,0 +1 @@
+"""Benchmarks and load tests for the Krishi Mitra ML service (see `python -m benchmarks --help`)."""
@@ -0,0 +1,117 @@
+"""Command line entry point for the ML service benchmark suite.
+
+Usage (from the `ml/` directory):
+  python -m benchmarks run --output results.json
+  python -m benchmarks run --quick --baseline benchmarks/baseline.json
+  python -m benchmarks run --save-baseline benchmarks/baseline.json
+  python -m benchmarks compare results.json benchmarks/baseline.json
+
+`run` exits with status 1 when a `--baseline` is given and any stage's p50
+latency regressed by more than `--tolerance` (default 10%). Baselines are
+hardware specific: record them on the machine class you deploy to.
+
+Focused tools live alongside the suite: `python -m benchmarks.load_test`
+(micro-batching throughput vs latency), `python -m benchmarks.preprocess_bench`
+(fast vs torchvision preprocessing), `python -m benchmarks.response_bench`
+(bytes and serialization time per `/predict` response),
+`python -m benchmarks.upload_bench` (server memory under concurrent slow uploads),
+`python -m benchmarks.tta_bench` (test-time augmentation accuracy and
+latency on a validation set), `python -m benchmarks.prefork_bench` (memory of
+pre-fork vs uvicorn workers), `python -m benchmarks.index_bench` (similar-case
+index build time, query latency and recall) and `python -m benchmarks.raw_bench`
+(server CPU per request of `/predict/raw` vs JPEG uploads).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.suite import SweepConfig, compare, run_suite
+
+
+def _parse_size(value: str) -> tuple:
+	width, height = value.lower().split("x")
+	return int(width), int(height)
+
+
+def _print_results(results: Dict[str, Any]) -> None:
+	print(f"{'benchmark':<52} {'p50 ms':>9} {'p99 ms':>9} {'items/s':>10}")
+	for row in results["results"]:
+		print(f"{row['name']:<52} {row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['items_per_s']:>10.1f}")
+
+
+def _print_comparison(rows: List[Dict[str, Any]]) -> bool:
+	regressed = False
+	print(f"{'benchmark':<52} {'base p50':>9} {'now p50':>9} {'ratio':>7}")
+	for row in rows:
+		marker = "  REGRESSION" if row["regression"] else ""
+		regressed = regressed or row["regression"]
+		print(f"{row['name']:<52} {row['baseline_p50_ms']:>9.2f} {row['current_p50_ms']:>9.2f} {row['ratio']:>7.2f}{marker}")
+	return regressed
+
+
+def _load(path: Path) -> Dict[str, Any]:
+	with path.open("r", encoding="utf-8") as fp:
+		return json.load(fp)
+
+
+def _write(path: Path, payload: Dict[str, Any]) -> None:
+	path.parent.mkdir(parents=True, exist_ok=True)
+	with path.open("w", encoding="utf-8") as fp:
+		json.dump(payload, fp, indent=2)
+
+
+def main(argv: List[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	sub = parser.add_subparsers(dest="command", required=True)
+
+	run = sub.add_parser("run", help="Run the benchmark sweep")
+	run.add_argument("--quick", action="store_true", help="Small sweep for CI smoke runs")
+	run.add_argument("--batch-sizes", type=int, nargs="+")
+	run.add_argument("--threads", type=int, nargs="+", help="torch.set_num_threads values to sweep")
+	run.add_argument("--archs", nargs="+", choices=["mobilenet_v2", "improved_cnn"])
+	run.add_argument("--formats", nargs="+", choices=["state_dict", "torchscript"])
+	run.add_argument("--image-sizes", type=_parse_size, nargs="+", help="e.g. 640x480 4000x3000")
+	run.add_argument("--iterations", type=int)
+	run.add_argument("--output", type=Path, help="Write machine-readable results here")
+	run.add_argument("--baseline", type=Path, help="Compare against a stored baseline")
+	run.add_argument("--save-baseline", type=Path, help="Store these results as the new baseline")
+	run.add_argument("--tolerance", type=float, default=0.10)
+
+	cmp = sub.add_parser("compare", help="Compare two stored result files")
+	cmp.add_argument("current", type=Path)
+	cmp.add_argument("baseline", type=Path)
+	cmp.add_argument("--tolerance", type=float, default=0.10)
+
+	args = parser.parse_args(argv)
+
+	if args.command == "compare":
+		return 1 if _print_comparison(compare(_load(args.current), _load(args.baseline), args.tolerance)) else 0
+
+	config = SweepConfig.quick() if args.quick else SweepConfig()
+	for name in ("batch_sizes", "threads", "archs", "formats", "image_sizes", "iterations"):
+		value = getattr(args, name)
+		if value:
+			setattr(config, name, value)
+
+	results = run_suite(config)
+	_print_results(results)
+	if args.output:
+		_write(args.output, results)
+	if args.save_baseline:
+		_write(args.save_baseline, results)
+
+	if args.baseline:
+		if not args.baseline.exists():
+			print(f"Baseline {args.baseline} not found; record one with --save-baseline.", file=sys.stderr)
+			return 1
+		return 1 if _print_comparison(compare(results, _load(args.baseline), args.tolerance)) else 0
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
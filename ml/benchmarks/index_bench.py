@@ -0,0 +1,183 @@
+"""Build time, size, query latency and recall of the similar-case index.
+
+Indexes `--vectors` synthetic 1280-d embeddings shaped like MobileNetV2's pooled
+features (non-negative, clustered, low intrinsic rank: ReLU of a random
+projection of `--clusters` noisy 64-d cluster centres). They are generated in
+chunks from per-chunk seeds, so a million vectors never sit in memory at once
+and the exact search can regenerate them.
+
+Reported per `--nprobe` value:
+
+  p50/p99 ms     single-query `EmbeddingIndex.search` latency
+  recall@k       overlap with the exact top-k by cosine similarity of the raw
+                 1280-d vectors, computed by a streamed brute-force pass
+  ivf recall@k   overlap with the exact top-k over the same PCA-projected
+                 vectors, i.e. what the list probing and int8 quantization
+                 lose on top of the PCA reduction
+
+Build time is split into training (PCA + k-means on `--train-sample`
+vectors), appending every vector and compacting. Disk bytes are those of the
+index directory.
+
+Usage (from the `ml/` directory):
+  python -m benchmarks.index_bench --vectors 1000000 --nprobe 1,4,16,64
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from benchmarks.suite import measure
+from embedding_index import EmbeddingIndex
+
+
+INPUT_DIM = 1280
+LATENT_DIM = 64
+# Chunk numbers of the training sample and the queries, disjoint from the indexed chunks.
+TRAIN_CHUNK = 2**31 - 1
+QUERY_CHUNK = 2**31 - 2
+
+
+class SyntheticEmbeddings:
+	def __init__(self, clusters: int, seed: int = 0) -> None:
+		rng = np.random.default_rng(seed)
+		self.seed = seed
+		self.basis = rng.normal(size=(LATENT_DIM, INPUT_DIM)).astype(np.float32) / np.sqrt(LATENT_DIM)
+		self.centres = rng.normal(size=(clusters, LATENT_DIM)).astype(np.float32)
+
+	def chunk(self, number: int, rows: int) -> Tuple[np.ndarray, np.ndarray]:
+		rng = np.random.default_rng([self.seed, number])
+		labels = rng.integers(0, len(self.centres), rows)
+		latent = self.centres[labels] + 0.6 * rng.normal(size=(rows, LATENT_DIM)).astype(np.float32)
+		noise = 0.1 * rng.normal(size=(rows, INPUT_DIM)).astype(np.float32)
+		return np.maximum(latent @ self.basis + noise, 0), labels
+
+	def chunks(self, total: int, rows: int) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+		for number, start in enumerate(range(0, total, rows)):
+			vectors, labels = self.chunk(number, min(rows, total - start))
+			yield start, vectors, labels
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+	return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def exact_top_k(data: SyntheticEmbeddings, total: int, chunk_rows: int, queries: np.ndarray, k: int, index: EmbeddingIndex) -> Tuple[np.ndarray, np.ndarray]:
+	"""Exact top-k row ids of each query in raw cosine space and in the index's projected space."""
+	raw_queries, projected_queries = _normalize(queries), index.project(queries)
+	best: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+	for start, vectors, _ in data.chunks(total, chunk_rows):
+		for name, scores in (("raw", raw_queries @ _normalize(vectors).T), ("projected", projected_queries @ index.project(vectors).T)):
+			ids = np.broadcast_to(np.arange(start, start + len(vectors)), scores.shape)
+			if name in best:
+				scores, ids = np.concatenate([best[name][0], scores], 1), np.concatenate([best[name][1], ids], 1)
+			top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+			best[name] = (np.take_along_axis(scores, top, 1), np.take_along_axis(ids, top, 1))
+	return best["raw"][1], best["projected"][1]
+
+
+def _recall(found: List[List[Any]], truth: np.ndarray) -> float:
+	return float(np.mean([len({int(neighbor.key) for neighbor in row} & set(expected.tolist())) / truth.shape[1] for row, expected in zip(found, truth)]))
+
+
+def _disk_bytes(path: Path) -> int:
+	return sum(item.stat().st_size for item in path.iterdir() if item.is_file())
+
+
+def run(args: argparse.Namespace, directory: Path) -> Dict[str, Any]:
+	data = SyntheticEmbeddings(args.clusters, args.seed)
+	sample, _ = data.chunk(TRAIN_CHUNK, min(args.train_sample, args.vectors))
+
+	started = time.perf_counter()
+	index = EmbeddingIndex.train(directory, sample, dim=args.dim, nlist=args.nlist, classes=[f"cluster_{i}" for i in range(args.clusters)])
+	index.compact_rows = args.vectors + 1
+	train_seconds = time.perf_counter() - started
+
+	started = time.perf_counter()
+	for start, vectors, labels in data.chunks(args.vectors, args.chunk):
+		index.add(vectors, labels.tolist(), [str(row) for row in range(start, start + len(vectors))])
+		print(f"  added {start + len(vectors)}/{args.vectors}", end="\r", flush=True)
+	add_seconds = time.perf_counter() - started
+	print()
+	started = time.perf_counter()
+	index.compact()
+	compact_seconds = time.perf_counter() - started
+	print(f"  built in {train_seconds + add_seconds + compact_seconds:.1f}s, {_disk_bytes(directory) / 2**20:.0f} MiB on disk", flush=True)
+
+	# Held-out queries: new draws from the same clusters, as a new photo of a known disease would be.
+	queries, _ = data.chunk(QUERY_CHUNK, args.queries)
+	raw_truth, projected_truth = exact_top_k(data, args.vectors, args.chunk, queries, args.k, index)
+
+	# Reopened from disk, as the service does.
+	index = EmbeddingIndex(directory)
+	rows = []
+	for nprobe in [int(value) for value in args.nprobe.split(",") if value.strip()]:
+		found = index.search(queries, args.k, nprobe)
+		cycle = itertools.cycle(queries)
+		timing = measure(lambda: index.search(next(cycle), args.k, nprobe), warmup=10, iterations=args.queries)
+		rows.append(
+			{
+				"nprobe": nprobe,
+				"p50_ms": timing["p50_ms"],
+				"p99_ms": timing["p99_ms"],
+				"recall": _recall(found, raw_truth),
+				"ivf_recall": _recall(found, projected_truth),
+			}
+		)
+	return {
+		"vectors": args.vectors,
+		"dim": index.meta["dim"],
+		"nlist": index.meta["nlist"],
+		"k": args.k,
+		"train_seconds": train_seconds,
+		"add_seconds": add_seconds,
+		"compact_seconds": compact_seconds,
+		"disk_bytes": _disk_bytes(directory),
+		"results": rows,
+	}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--vectors", type=int, default=1_000_000)
+	parser.add_argument("--clusters", type=int, default=1000, help="Synthetic look-alike groups")
+	parser.add_argument("--dim", type=int, default=128)
+	parser.add_argument("--nlist", type=int, default=None)
+	parser.add_argument("--train-sample", type=int, default=50_000)
+	parser.add_argument("--chunk", type=int, default=50_000, help="Vectors generated and added at a time")
+	parser.add_argument("--queries", type=int, default=200)
+	parser.add_argument("--k", type=int, default=10)
+	parser.add_argument("--nprobe", default="1,4,16,64")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--index-dir", type=Path, default=None, help="Keep the built index here (default: a temporary directory)")
+	parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as scratch:
+		results = run(args, args.index_dir or Path(scratch) / "index")
+
+	mib = 2**20
+	print(
+		f"{results['vectors']} vectors, {results['dim']}-d int8, {results['nlist']} lists: "
+		f"train {results['train_seconds']:.1f}s, add {results['add_seconds']:.1f}s, compact {results['compact_seconds']:.1f}s, "
+		f"{results['disk_bytes'] / mib:.0f} MiB on disk"
+	)
+	print(f"{'nprobe':>6} {'p50 ms':>8} {'p99 ms':>8} {'recall@' + str(args.k):>10} {'ivf recall':>11}")
+	for row in results["results"]:
+		print(f"{row['nprobe']:>6} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['recall']:>10.3f} {row['ivf_recall']:>11.3f}")
+
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as fp:
+			json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,130 @@
+"""Closed-loop load test for the `/predict` micro-batcher.
+
+Drives a `MicroBatcher` in-process with a fixed number of concurrent clients and
+reports throughput against p50/p99 latency for each `max_batch_size`. The model
+is a randomly initialised serving architecture, so no trained artefact is
+required; latency depends only on tensor shapes.
+
+Usage (from the `ml/` directory):
+  python -m benchmarks.load_test --batch-sizes 1 2 4 8 16 32 --concurrency 32
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from typing import Any, Dict, List
+
+import torch
+from torchvision import models
+
+from batching import MicroBatcher
+
+
+def _build_model(arch: str, num_classes: int) -> torch.nn.Module:
+	if arch == "mobilenet_v2":
+		net = models.mobilenet_v2(weights=None)
+		net.classifier[1] = torch.nn.Linear(net.classifier[1].in_features, num_classes)
+	elif arch == "improved_cnn":
+		from routes.predict import ImprovedCNN  # type: ignore
+
+		net = ImprovedCNN(num_classes=num_classes)
+	else:
+		raise ValueError(f"Unsupported arch '{arch}'")
+	return net.eval()
+
+
+def _percentile(values: List[float], pct: float) -> float:
+	ordered = sorted(values)
+	index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+	return ordered[index]
+
+
+def run_load(
+	model: torch.nn.Module,
+	max_batch_size: int,
+	max_wait_ms: float,
+	concurrency: int,
+	duration: float,
+	warmup: float,
+) -> Dict[str, Any]:
+	batcher = MicroBatcher(model, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+	batcher.start()
+
+	sample = torch.randn(1, 3, 224, 224)
+	latencies: List[float] = []
+	lock = threading.Lock()
+	start_at = time.perf_counter() + warmup
+	stop_at = start_at + duration
+
+	def client() -> None:
+		local: List[float] = []
+		while True:
+			began = time.perf_counter()
+			if began >= stop_at:
+				break
+			batcher.submit(sample).result()
+			finished = time.perf_counter()
+			if began >= start_at:
+				local.append(finished - began)
+		with lock:
+			latencies.extend(local)
+
+	threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	stats = batcher.stats()
+	batcher.stop()
+
+	return {
+		"max_batch_size": max_batch_size,
+		"max_wait_ms": max_wait_ms,
+		"concurrency": concurrency,
+		"requests": len(latencies),
+		"throughput_rps": len(latencies) / duration,
+		"p50_ms": statistics.median(latencies) * 1000.0 if latencies else None,
+		"p99_ms": _percentile(latencies, 99) * 1000.0 if latencies else None,
+		"mean_batch_size": stats["mean_batch_size"],
+		"batch_size_histogram": stats["batch_size_histogram"],
+	}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--arch", default="mobilenet_v2", choices=["mobilenet_v2", "improved_cnn"])
+	parser.add_argument("--num-classes", type=int, default=38)
+	parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+	parser.add_argument("--max-wait-ms", type=float, default=10.0)
+	parser.add_argument("--concurrency", type=int, default=32)
+	parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds per batch size")
+	parser.add_argument("--warmup", type=float, default=2.0)
+	parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads override")
+	parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+	args = parser.parse_args()
+
+	if args.threads:
+		torch.set_num_threads(args.threads)
+
+	model = _build_model(args.arch, args.num_classes)
+	results = []
+	print(f"{'batch':>5} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'mean bs':>8}")
+	for max_batch_size in args.batch_sizes:
+		result = run_load(model, max_batch_size, args.max_wait_ms, args.concurrency, args.duration, args.warmup)
+		results.append(result)
+		print(
+			f"{max_batch_size:>5} {result['throughput_rps']:>9.1f} {result['p50_ms'] or 0:>9.1f} "
+			f"{result['p99_ms'] or 0:>9.1f} {result['mean_batch_size']:>8.2f}"
+		)
+
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as fp:
+			json.dump({"arch": args.arch, "threads": torch.get_num_threads(), "results": results}, fp, indent=2)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,182 @@
+"""Total memory and throughput of multi-worker serving as the worker count grows.
+
+For every worker count, starts the service twice in a subprocess:
+
+  uvicorn  `uvicorn app:app --workers N`: every worker loads its own models
+  prefork  `python serve.py --workers N`: models loaded once and shared
+
+Once every worker answers `/health`, `--clients` concurrent clients post a
+synthetic JPEG to `/predict` for `--duration` seconds. Memory is then summed
+over the whole process tree from /proc/<pid>/smaps_rollup: RSS counts shared
+pages once per process, PSS splits them between the processes mapping them
+(the honest total), USS is what each process holds privately. The model is a
+randomly initialised TorchScript mobilenet_v2 unless `--model` is given.
+Linux only.
+
+Usage (from the `ml/` directory):
+  python -m benchmarks.prefork_bench --workers 1,2,4 --duration 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.suite import _make_artefact, synthetic_jpeg
+from benchmarks.upload_bench import _free_port
+
+
+ML_DIR = Path(__file__).resolve().parent.parent
+
+
+def _tree(pid: int) -> List[int]:
+	pids = [pid]
+	try:
+		for task in os.listdir(f"/proc/{pid}/task"):
+			with open(f"/proc/{pid}/task/{task}/children", encoding="ascii") as fp:
+				for child in fp.read().split():
+					pids.extend(_tree(int(child)))
+	except OSError:
+		pass
+	return pids
+
+
+def tree_memory(pid: int) -> Dict[str, int]:
+	totals = {"rss": 0, "pss": 0, "uss": 0, "processes": 0}
+	for member in _tree(pid):
+		try:
+			with open(f"/proc/{member}/smaps_rollup", encoding="ascii") as fp:
+				values = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in fp if line.split(":")[0] in ("Rss", "Pss", "Private_Clean", "Private_Dirty")}
+		except OSError:
+			continue
+		totals["rss"] += values.get("Rss", 0)
+		totals["pss"] += values.get("Pss", 0)
+		totals["uss"] += values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+		totals["processes"] += 1
+	return totals
+
+
+def _wait_ready(base_url: str, workers: int, server: subprocess.Popen, timeout: float = 300) -> None:
+	pids = set()
+	deadline = time.time() + timeout
+	while len(pids) < workers:
+		if time.time() > deadline or server.poll() is not None:
+			raise RuntimeError(f"only {len(pids)} of {workers} workers became ready")
+		try:
+			# A fresh connection per probe, so the kernel spreads them over the workers.
+			health = httpx.get(f"{base_url}/health", timeout=2).json()
+			if health.get("status") == "ok":
+				pids.add(health.get("worker_pid"))
+				continue
+		except httpx.HTTPError:
+			pass
+		time.sleep(0.2)
+
+
+def _load(base_url: str, payload: bytes, clients: int, duration: float) -> Dict[str, Any]:
+	latencies: List[float] = []
+	errors = [0]
+	lock = threading.Lock()
+	deadline = time.perf_counter() + duration
+
+	def client() -> None:
+		with httpx.Client(base_url=base_url, timeout=60) as http:
+			while time.perf_counter() < deadline:
+				started = time.perf_counter()
+				response = http.post("/predict", files={"image": ("leaf.jpg", payload, "image/jpeg")})
+				with lock:
+					if response.status_code == 200:
+						latencies.append(time.perf_counter() - started)
+					else:
+						errors[0] += 1
+
+	threads = [threading.Thread(target=client) for _ in range(clients)]
+	started = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	elapsed = time.perf_counter() - started
+	return {
+		"requests": len(latencies),
+		"errors": errors[0],
+		"requests_per_s": len(latencies) / elapsed,
+		"p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+	}
+
+
+def run_one(mode: str, workers: int, model_path: Path, payload: bytes, clients: int, duration: float) -> Dict[str, Any]:
+	port = _free_port()
+	env = {
+		**os.environ,
+		"MODEL_DIR": str(model_path.parent),
+		"MODEL_PATH": str(model_path),
+		"CLASS_MAP_PATH": str(model_path.parent / "missing-classes.json"),
+		"PREDICTION_CACHE": "false",
+		"MODEL_WATCH_INTERVAL": "0",
+		"JOB_WORKERS": "0",
+	}
+	if mode == "uvicorn":
+		command = [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+	else:
+		command = [sys.executable, "serve.py", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+	server = subprocess.Popen(command, cwd=ML_DIR, env=env, stdout=subprocess.DEVNULL)
+	base_url = f"http://127.0.0.1:{port}"
+	try:
+		_wait_ready(base_url, workers, server)
+		idle = tree_memory(server.pid)
+		load = _load(base_url, payload, clients, duration)
+		loaded = tree_memory(server.pid)
+	finally:
+		server.terminate()
+		server.wait(timeout=60)
+	return {"mode": mode, "workers": workers, "idle": idle, "after_load": loaded, **load}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--workers", default="1,2,4", help="Comma separated worker counts")
+	parser.add_argument("--modes", default="uvicorn,prefork")
+	parser.add_argument("--model", type=Path, default=None, help="Model artefact to serve")
+	parser.add_argument("--clients", type=int, default=0, help="Concurrent clients (default: 2 x workers)")
+	parser.add_argument("--duration", type=float, default=15.0)
+	parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+	args = parser.parse_args()
+
+	payload = synthetic_jpeg((1024, 768))
+	rows = []
+	with tempfile.TemporaryDirectory() as scratch:
+		model_path = args.model or _make_artefact(Path(scratch), "mobilenet_v2", "torchscript", 38)
+		for workers in [int(value) for value in args.workers.split(",") if value.strip()]:
+			for mode in args.modes.split(","):
+				rows.append(run_one(mode, workers, model_path, payload, args.clients or 2 * workers, args.duration))
+				row = rows[-1]
+				print(f"  {mode} x{workers}: {row['requests_per_s']:.1f} req/s, PSS {row['after_load']['pss'] / 2**20:.0f} MiB", flush=True)
+
+	mib = 2**20
+	print(f"{'mode':<8} {'workers':>7} {'req/s':>7} {'p50 ms':>7} {'errors':>6} {'RSS MiB':>8} {'PSS MiB':>8} {'USS MiB':>8} {'idle PSS':>9}")
+	for row in rows:
+		memory = row["after_load"]
+		print(
+			f"{row['mode']:<8} {row['workers']:>7} {row['requests_per_s']:>7.1f} {row['p50_ms'] or 0:>7.1f} {row['errors']:>6} "
+			f"{memory['rss'] / mib:>8.0f} {memory['pss'] / mib:>8.0f} {memory['uss'] / mib:>8.0f} {row['idle']['pss'] / mib:>9.0f}"
+		)
+
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as fp:
+			json.dump({"cpu_count": os.cpu_count(), "results": rows}, fp, indent=2)
+
+
+if __name__ == "__main__":
+	main()
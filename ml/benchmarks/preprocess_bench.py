@@ -0,0 +1,149 @@
+"""Microbenchmark: torchvision preprocessing vs `FastPreprocessor`.
+
+For every image in the corpus both pipelines are timed on the raw file bytes
+(decode included) and their outputs compared. The run fails if the mean or max
+absolute difference, measured in normalized units, exceeds the tolerances.
+
+Point `--images` at a directory of real phone photos. Without it, a handful of
+synthetic 12 MP JPEGs (smooth gradients plus sensor-like noise) are generated in
+a temporary directory so the script still runs anywhere.
+
+Usage (from the `ml/` directory):
+  python -m benchmarks.preprocess_bench --images ~/field-photos --repeat 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from preprocess import IMAGENET_MEAN, IMAGENET_STD, FastPreprocessor
+
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+reference_transforms = transforms.Compose(
+	[
+		transforms.Resize((224, 224)),
+		transforms.ToTensor(),
+		transforms.Normalize(list(IMAGENET_MEAN), list(IMAGENET_STD)),
+	]
+)
+
+
+def _reference(image_bytes: bytes) -> torch.Tensor:
+	return reference_transforms(Image.open(io.BytesIO(image_bytes)).convert("RGB"))
+
+
+def synthesize_corpus(directory: Path, count: int = 4, size: tuple = (4000, 3000)) -> List[Path]:
+	rng = np.random.default_rng(0)
+	width, height = size
+	paths = []
+	yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+	for index in range(count):
+		phase = rng.uniform(0, 2 * np.pi, size=3)
+		channels = [
+			127 + 100 * np.sin(xx / (150 + 40 * index) + phase[c]) * np.cos(yy / (210 + 25 * c))
+			for c in range(3)
+		]
+		pixels = np.stack(channels, axis=-1) + rng.normal(0, 6, size=(height, width, 3))
+		path = directory / f"synthetic_{index}.jpg"
+		Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, quality=92)
+		paths.append(path)
+	return paths
+
+
+def _time(fn: Callable[[bytes], torch.Tensor], payload: bytes, repeat: int) -> float:
+	samples = []
+	for _ in range(repeat):
+		started = time.perf_counter()
+		fn(payload)
+		samples.append(time.perf_counter() - started)
+	return statistics.median(samples)
+
+
+def run(paths: List[Path], repeat: int) -> Dict[str, Any]:
+	fast = FastPreprocessor()
+	out = torch.empty((3, 224, 224), dtype=torch.float32)
+	rows = []
+	for path in paths:
+		payload = path.read_bytes()
+		expected = _reference(payload)
+		actual = fast(payload, out=out)
+		diff = (expected - actual).abs()
+		with Image.open(path) as probe:
+			resolution = probe.size
+		rows.append(
+			{
+				"image": path.name,
+				"resolution": list(resolution),
+				"bytes": len(payload),
+				"reference_ms": _time(_reference, payload, repeat) * 1000.0,
+				"fast_ms": _time(lambda data: fast(data, out=out), payload, repeat) * 1000.0,
+				"max_abs_diff": float(diff.max()),
+				"mean_abs_diff": float(diff.mean()),
+			}
+		)
+	return {
+		"images": rows,
+		"reference_ms_median": statistics.median(row["reference_ms"] for row in rows),
+		"fast_ms_median": statistics.median(row["fast_ms"] for row in rows),
+		"max_abs_diff": max(row["max_abs_diff"] for row in rows),
+		"mean_abs_diff": statistics.mean(row["mean_abs_diff"] for row in rows),
+	}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--images", type=Path, default=None, help="Directory of JPG/PNG images")
+	parser.add_argument("--repeat", type=int, default=5)
+	parser.add_argument("--mean-tolerance", type=float, default=0.02)
+	parser.add_argument("--max-tolerance", type=float, default=0.25)
+	parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as scratch:
+		if args.images:
+			paths = sorted(p for p in args.images.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+		else:
+			print("No --images given; generating synthetic 12 MP JPEGs.")
+			paths = synthesize_corpus(Path(scratch))
+		if not paths:
+			sys.exit(f"No images found under {args.images}")
+		results = run(paths, args.repeat)
+
+	print(f"{'image':<28} {'resolution':>11} {'torchvision ms':>15} {'fast ms':>9} {'max diff':>9} {'mean diff':>10}")
+	for row in results["images"]:
+		resolution = "x".join(str(v) for v in row["resolution"])
+		print(
+			f"{row['image'][:28]:<28} {resolution:>11} {row['reference_ms']:>15.1f} {row['fast_ms']:>9.1f} "
+			f"{row['max_abs_diff']:>9.4f} {row['mean_abs_diff']:>10.5f}"
+		)
+	speedup = results["reference_ms_median"] / max(results["fast_ms_median"], 1e-9)
+	print(
+		f"median {results['reference_ms_median']:.1f} ms -> {results['fast_ms_median']:.1f} ms ({speedup:.1f}x), "
+		f"max diff {results['max_abs_diff']:.4f}, mean diff {results['mean_abs_diff']:.5f}"
+	)
+
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as fp:
+			json.dump(results, fp, indent=2)
+
+	if results["mean_abs_diff"] > args.mean_tolerance or results["max_abs_diff"] > args.max_tolerance:
+		sys.exit("FastPreprocessor output is outside the configured tolerance")
+
+
+if __name__ == "__main__":
+	main()
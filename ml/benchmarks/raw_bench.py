@@ -0,0 +1,163 @@
+"""Server CPU per request of `/predict/raw` vs the JPEG `/predict` path.
+
+Starts the service under uvicorn in a subprocess, with a randomly initialised
+model, and sends `--requests` sequential requests per scenario. Server CPU is
+the user + system time of the uvicorn process (read from /proc, so every
+thread counts) divided by the request count; the forward pass is in every
+scenario, so the differences are what ingest and preprocessing cost.
+
+  jpeg_camera  the camera photo (`--image-mp` megapixels) as taken
+  jpeg_224     the same photo resized to 224x224 on the client and re-encoded
+               at `--quality`, which is what the app sends today
+  raw_224      the same resized pixels as a `/predict/raw` body
+
+`forward` is the model alone on one 224x224 input, in the same thread budget,
+for reference. Linux only, because of /proc.
+
+Usage (from the `ml/` directory):
+  python -m benchmarks.raw_bench --requests 200 --threads 1
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+import httpx
+import numpy as np
+import torch
+from PIL import Image
+
+from benchmarks.suite import _make_artefact, synthetic_jpeg
+from benchmarks.upload_bench import _free_port
+from rawtensor import MEDIA_TYPE, encode
+
+
+def _cpu_seconds(pid: int) -> float:
+	with open(f"/proc/{pid}/stat", encoding="ascii") as fp:
+		# Fields 14 and 15 (utime, stime), counted after the parenthesised command name.
+		fields = fp.read().rsplit(")", 1)[1].split()
+	return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def client_payloads(megapixels: float, quality: int, size: int = 224) -> Dict[str, Dict[str, Any]]:
+	width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+	photo = synthetic_jpeg((width, int(width * 3 / 4)))
+	pixels = np.asarray(Image.open(io.BytesIO(photo)).convert("RGB").resize((size, size), Image.BILINEAR), dtype=np.uint8)
+	resized = io.BytesIO()
+	Image.fromarray(pixels).save(resized, format="JPEG", quality=quality)
+	return {
+		"jpeg_camera": {"path": "/predict", "files": {"image": ("leaf.jpg", photo, "image/jpeg")}},
+		"jpeg_224": {"path": "/predict", "files": {"image": ("leaf.jpg", resized.getvalue(), "image/jpeg")}},
+		"raw_224": {"path": "/predict/raw", "content": encode(pixels), "headers": {"Content-Type": MEDIA_TYPE}},
+	}
+
+
+def _forward_cpu_ms(model_path: Path, threads: int, iterations: int) -> float:
+	torch.set_num_threads(threads)
+	model = torch.jit.load(str(model_path)).eval()
+	batch = torch.randn(1, 3, 224, 224)
+	with torch.no_grad():
+		for _ in range(5):
+			model(batch)
+		started = time.process_time()
+		for _ in range(iterations):
+			model(batch)
+	return (time.process_time() - started) / iterations * 1000.0
+
+
+def run(ml_dir: Path, payloads: Dict[str, Dict[str, Any]], requests: int, threads: int) -> Dict[str, Any]:
+	with tempfile.TemporaryDirectory() as scratch:
+		model_path = _make_artefact(Path(scratch), "mobilenet_v2", "torchscript", 38)
+		port = _free_port()
+		env = {
+			**os.environ,
+			"MODEL_DIR": scratch,
+			"MODEL_PATH": str(model_path),
+			"CLASS_MAP_PATH": str(Path(scratch) / "missing-classes.json"),
+			"PREDICTION_CACHE": "false",
+			"MODEL_WATCH_INTERVAL": "0",
+			"OMP_NUM_THREADS": str(threads),
+		}
+		server = subprocess.Popen(
+			[sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+			cwd=ml_dir,
+			env=env,
+		)
+		base_url = f"http://127.0.0.1:{port}"
+		rows = []
+		try:
+			deadline = time.time() + 120
+			while True:
+				try:
+					if httpx.get(f"{base_url}/health", timeout=1).json().get("status") == "ok":
+						break
+				except httpx.HTTPError:
+					pass
+				if time.time() > deadline or server.poll() is not None:
+					raise RuntimeError("service did not start")
+				time.sleep(0.2)
+
+			with httpx.Client(base_url=base_url, timeout=60) as client:
+				for name, request in payloads.items():
+					path, kwargs = request["path"], {key: value for key, value in request.items() if key != "path"}
+					for _ in range(5):
+						client.post(path, **kwargs).raise_for_status()
+					seconds = []
+					cpu_before = _cpu_seconds(server.pid)
+					for _ in range(requests):
+						started = time.perf_counter()
+						client.post(path, **kwargs).raise_for_status()
+						seconds.append(time.perf_counter() - started)
+					cpu = _cpu_seconds(server.pid) - cpu_before
+					body = request.get("content") or request["files"]["image"][1]
+					rows.append(
+						{
+							"scenario": name,
+							"payload_bytes": len(body),
+							"server_cpu_ms": cpu / requests * 1000.0,
+							"p50_ms": statistics.median(seconds) * 1000.0,
+						}
+					)
+		finally:
+			server.terminate()
+			server.wait(timeout=30)
+		forward_ms = _forward_cpu_ms(model_path, threads, requests)
+	return {"requests": requests, "threads": threads, "forward_cpu_ms": forward_ms, "results": rows}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--ml-dir", type=Path, default=Path(__file__).resolve().parent.parent)
+	parser.add_argument("--requests", type=int, default=200)
+	parser.add_argument("--threads", type=int, default=1, help="Torch threads of the server (OMP_NUM_THREADS)")
+	parser.add_argument("--image-mp", type=float, default=12.0)
+	parser.add_argument("--quality", type=int, default=90, help="JPEG quality of the client-side re-encode")
+	parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+	args = parser.parse_args()
+
+	results = run(args.ml_dir, client_payloads(args.image_mp, args.quality), args.requests, args.threads)
+
+	baseline = next(row for row in results["results"] if row["scenario"] == "jpeg_224")
+	print(f"{'scenario':<12} {'payload KiB':>12} {'server CPU ms':>14} {'saved ms':>9} {'p50 ms':>8}")
+	for row in results["results"]:
+		saved = baseline["server_cpu_ms"] - row["server_cpu_ms"]
+		print(f"{row['scenario']:<12} {row['payload_bytes'] / 1024:>12.1f} {row['server_cpu_ms']:>14.2f} {saved:>9.2f} {row['p50_ms']:>8.2f}")
+	print(f"{'forward':<12} {'':>12} {results['forward_cpu_ms']:>14.2f}")
+
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as fp:
+			json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,139 @@
+"""Microbenchmark: bytes and serialization time per `/predict` response.
+
+Compares three ways of producing the same prediction:
+
+  legacy   top-k dicts embedding each class's metadata, encoded by FastAPI's
+           `JSONResponse` (what `/predict` did before responses.py)
+  full     the same document assembled from `ResponseTable`'s pre-serialized
+           per-class fragments (must be byte-identical to legacy)
+  compact  class ids and scores only, plus the `/metadata` ETag
+
+Without `--class-map`, a synthetic 38-class map with treatment/remedy text
+of PlantVillage-like size is used.
+
+Usage (from the `ml/` directory):
+  python -m benchmarks.response_bench --class-map models/classes.json --iterations 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import torch
+from fastapi.responses import JSONResponse
+
+from benchmarks.suite import measure, service
+
+
+FIELDS = {"crop_type": "tomato", "model": "plant_disease_model.pt", "model_path": "/srv/models/plant_disease_model.pt", "device": "cpu", "source": "ml-service"}
+
+
+def synthetic_class_map(num_classes: int = 38) -> List[Dict[str, Any]]:
+	sentence = "Remove infected leaves, avoid overhead irrigation and rotate crops for two seasons. "
+	return [
+		{
+			"label": f"Crop___Disease_{idx}",
+			"common_name": f"Disease {idx}",
+			"scientific_name": f"Pathogenus species{idx}",
+			"description": sentence * 6,
+			"treatment": [sentence * 2 for _ in range(4)],
+			"organic_remedies": [sentence for _ in range(3)],
+			"prevention": [sentence for _ in range(4)],
+		}
+		for idx in range(num_classes)
+	]
+
+
+def legacy_prediction(logits: torch.Tensor, class_metadata: List[Dict[str, Any]]) -> Dict[str, Any]:
+	"""The pre-responses.py `_format_prediction`."""
+	probs = torch.softmax(logits, dim=1)
+	top_scores, top_indices = torch.topk(probs, k=min(3, probs.shape[1]))
+
+	def _pack(idx: int, score: float) -> Dict[str, Any]:
+		meta = class_metadata[idx] if idx < len(class_metadata) else {"label": f"class_{idx}"}
+		return {
+			"label": meta.get("label", f"class_{idx}"),
+			"score": float(score),
+			"common_name": meta.get("common_name"),
+			"scientific_name": meta.get("scientific_name"),
+			"metadata": meta,
+		}
+
+	top_k = [_pack(int(idx), float(score)) for score, idx in zip(top_scores[0], top_indices[0])]
+	primary = top_k[0]
+	return {
+		"disease": primary["label"],
+		"confidence": primary["score"],
+		"common_name": primary.get("common_name"),
+		"scientific_name": primary.get("scientific_name"),
+		"top_k": top_k,
+	}
+
+
+def run(app: Any, class_metadata: List[Dict[str, Any]], iterations: int) -> Dict[str, Any]:
+	from responses import ResponseTable
+
+	class_metadata = [app._shape_metadata(item, idx) for idx, item in enumerate(class_metadata)]
+	class_names = [meta["label"] for meta in class_metadata]
+	table = ResponseTable(class_metadata, class_names, "mobilenet_v2")
+	logits = torch.randn(1, len(class_metadata))
+	top_k = app._top_k(logits)
+
+	def legacy() -> bytes:
+		prediction = legacy_prediction(logits, class_metadata)
+		prediction.update(FIELDS)
+		return JSONResponse(prediction).body
+
+	variants: Dict[str, Callable[[], bytes]] = {
+		"legacy": legacy,
+		"full": lambda: table.full(app._top_k(logits), fields=FIELDS),
+		"compact": lambda: table.compact(app._top_k(logits), fields={"crop_type": FIELDS["crop_type"], "model": FIELDS["model"]}),
+	}
+	if variants["full"]() != legacy():
+		raise AssertionError("pre-serialized response differs from the legacy JSONResponse body")
+	if table.full(top_k, fields=FIELDS) != JSONResponse({**legacy_prediction(logits, class_metadata), **FIELDS}).body:
+		raise AssertionError("cached top-k renders differently")
+
+	rows = []
+	for name, fn in variants.items():
+		stats = measure(fn, warmup=100, iterations=iterations)
+		rows.append({"variant": name, "bytes": len(fn()), **stats})
+	return {"num_classes": len(class_metadata), "metadata_bytes": len(table.metadata_body), "results": rows}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--class-map", type=Path, default=None, help="classes.json to take the metadata from")
+	parser.add_argument("--iterations", type=int, default=5000)
+	parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+	args = parser.parse_args()
+
+	if args.class_map:
+		with args.class_map.open("r", encoding="utf-8") as fp:
+			data = json.load(fp)
+		class_metadata = list(data.values()) if isinstance(data, dict) else data
+	else:
+		class_metadata = synthetic_class_map()
+	if not class_metadata:
+		sys.exit("The class map is empty")
+
+	with tempfile.TemporaryDirectory() as scratch, service(Path(scratch)) as app:
+		results = run(app, class_metadata, args.iterations)
+	legacy = results["results"][0]
+	print(f"{results['num_classes']} classes, /metadata body {results['metadata_bytes']} bytes")
+	print(f"{'variant':<10} {'bytes':>8} {'p50 us':>9} {'p99 us':>9} {'vs legacy':>10}")
+	for row in results["results"]:
+		print(f"{row['variant']:<10} {row['bytes']:>8} {row['p50_ms'] * 1000:>9.1f} {row['p99_ms'] * 1000:>9.1f} {legacy['p50_ms'] / row['p50_ms']:>9.1f}x")
+
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as fp:
+			json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,215 @@
+"""Reproducible benchmark suite for the inference service.
+
+Every measurement goes through the functions the service itself uses
+(`_prepare_image`, the registry's active model, `_top_k` and its response table) and, for the
+end-to-end case, through the FastAPI app via `TestClient`. Randomly initialised
+artefacts are generated in a scratch directory for each model variant, so the
+suite needs no trained model and results only depend on code and hardware.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+@dataclass
+class SweepConfig:
+	batch_sizes: List[int] = field(default_factory=lambda: [1, 8, 32])
+	threads: List[int] = field(default_factory=lambda: sorted({1, os.cpu_count() or 1}))
+	archs: List[str] = field(default_factory=lambda: ["mobilenet_v2", "improved_cnn"])
+	formats: List[str] = field(default_factory=lambda: ["state_dict", "torchscript"])
+	image_sizes: List[Tuple[int, int]] = field(default_factory=lambda: [(640, 480), (1920, 1080), (4000, 3000)])
+	num_classes: int = 38
+	warmup: int = 3
+	iterations: int = 20
+
+	@classmethod
+	def quick(cls) -> "SweepConfig":
+		return cls(batch_sizes=[1, 8], threads=[1], archs=["mobilenet_v2"], image_sizes=[(640, 480), (4000, 3000)], warmup=2, iterations=5)
+
+
+def _summarize(samples: List[float], items: int = 1) -> Dict[str, float]:
+	ordered = sorted(samples)
+	p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+	mean = statistics.mean(ordered)
+	return {
+		"p50_ms": statistics.median(ordered) * 1000.0,
+		"p99_ms": p99 * 1000.0,
+		"mean_ms": mean * 1000.0,
+		"items_per_s": items / mean if mean > 0 else 0.0,
+	}
+
+
+def measure(fn: Callable[[], Any], warmup: int, iterations: int, items: int = 1) -> Dict[str, float]:
+	for _ in range(warmup):
+		fn()
+	samples = []
+	for _ in range(iterations):
+		started = time.perf_counter()
+		fn()
+		samples.append(time.perf_counter() - started)
+	return _summarize(samples, items)
+
+
+def synthetic_jpeg(size: Tuple[int, int], seed: int = 0) -> bytes:
+	width, height = size
+	rng = np.random.default_rng(seed)
+	yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+	base = 127 + 90 * np.sin(xx / 97.0)[..., None] * np.cos(yy / 131.0)[..., None]
+	pixels = np.clip(base + rng.normal(0, 8, size=(height, width, 3)), 0, 255).astype(np.uint8)
+	buffer = io.BytesIO()
+	Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+	return buffer.getvalue()
+
+
+def _make_artefact(directory: Path, arch: str, fmt: str, num_classes: int) -> Path:
+	from torchvision import models
+
+	if arch == "mobilenet_v2":
+		net = models.mobilenet_v2(weights=None)
+		net.classifier[1] = torch.nn.Linear(net.classifier[1].in_features, num_classes)
+	else:
+		from routes.predict import ImprovedCNN  # type: ignore
+
+		net = ImprovedCNN(num_classes=num_classes)
+	net.eval()
+
+	if fmt == "torchscript":
+		path = directory / f"{arch}.pt"
+		torch.jit.script(net).save(str(path))
+	else:
+		path = directory / f"{arch}.pth"
+		torch.save(net.state_dict(), path)
+	return path
+
+
+@contextmanager
+def service(scratch: Path) -> Iterator[Any]:
+	"""Import `app` against a scratch model directory with caching disabled."""
+	placeholder = _make_artefact(scratch, "mobilenet_v2", "state_dict", 2)
+	os.environ.update(
+		{
+			"MODEL_DIR": str(scratch),
+			"MODEL_PATH": str(placeholder),
+			"CLASS_MAP_PATH": str(scratch / "missing-classes.json"),
+			"PREDICTION_CACHE": "false",
+			"MODEL_WATCH_INTERVAL": "0",
+		}
+	)
+	ml_dir = str(Path(__file__).resolve().parent.parent)
+	if ml_dir not in sys.path:
+		sys.path.insert(0, ml_dir)
+	import app  # type: ignore
+
+	app._import_runtime()
+	yield app
+
+
+def _use_variant(app: Any, path: Path, arch: str, num_classes: int) -> None:
+	app.MODEL_PATH = path
+	app.MODEL_ARCH = arch
+	os.environ["MODEL_NUM_CLASSES"] = str(num_classes)
+	app._load_model()
+
+
+def run_suite(config: SweepConfig) -> Dict[str, Any]:
+	from fastapi.testclient import TestClient
+
+	results: List[Dict[str, Any]] = []
+	images = {size: synthetic_jpeg(size, seed=index) for index, size in enumerate(config.image_sizes)}
+	original_threads = torch.get_num_threads()
+
+	with tempfile.TemporaryDirectory() as tmp, service(Path(tmp)) as app:
+		scratch = Path(tmp)
+		for threads in config.threads:
+			torch.set_num_threads(threads)
+
+			for size, payload in images.items():
+				label = f"{size[0]}x{size[1]}"
+				stats = measure(lambda: app._prepare_image(payload, "benchmark"), config.warmup, config.iterations)
+				results.append({"name": f"prepare_image/{label}/t{threads}", "stage": "prepare_image", "image_size": label, "threads": threads, **stats})
+
+			for arch in config.archs:
+				for fmt in config.formats:
+					path = _make_artefact(scratch, arch, fmt, config.num_classes)
+					_use_variant(app, path, arch, config.num_classes)
+					entry = app.registry.get()
+					variant = f"{arch}/{fmt}"
+
+					for batch_size in config.batch_sizes:
+						batch = torch.randn(batch_size, 3, 224, 224)
+
+						def forward() -> None:
+							with torch.no_grad():
+								entry.model(batch)
+
+						stats = measure(forward, config.warmup, config.iterations, items=batch_size)
+						results.append({"name": f"forward/{variant}/bs{batch_size}/t{threads}", "stage": "forward", "variant": variant, "batch_size": batch_size, "threads": threads, **stats})
+
+					logits = torch.randn(1, config.num_classes)
+					fields = app._response_fields("general", entry)
+					stats = measure(lambda: entry.responses.full(app._top_k(logits), fields=fields), config.warmup, config.iterations * 5)
+					results.append({"name": f"format_prediction/{variant}/t{threads}", "stage": "format_prediction", "variant": variant, "threads": threads, **stats})
+
+					with TestClient(app.app) as client:
+						for size, payload in images.items():
+							label = f"{size[0]}x{size[1]}"
+
+							def request() -> None:
+								response = client.post("/predict", files={"image": ("leaf.jpg", payload, "image/jpeg")})
+								response.raise_for_status()
+
+							stats = measure(request, config.warmup, config.iterations)
+							results.append({"name": f"end_to_end/{variant}/{label}/t{threads}", "stage": "end_to_end", "variant": variant, "image_size": label, "threads": threads, **stats})
+
+	torch.set_num_threads(original_threads)
+	return {"meta": environment(), "config": config.__dict__, "results": results}
+
+
+def environment() -> Dict[str, Any]:
+	import torchvision
+
+	return {
+		"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"processor": platform.processor() or platform.machine(),
+		"cpu_count": os.cpu_count(),
+		"torch": torch.__version__,
+		"torchvision": torchvision.__version__,
+	}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+	"""Pair results by name and flag p50 latencies that grew by more than `tolerance`."""
+	previous = {row["name"]: row for row in baseline.get("results", [])}
+	rows = []
+	for row in current.get("results", []):
+		before = previous.get(row["name"])
+		if before is None:
+			continue
+		ratio = row["p50_ms"] / before["p50_ms"] if before["p50_ms"] else float("inf")
+		rows.append(
+			{
+				"name": row["name"],
+				"baseline_p50_ms": before["p50_ms"],
+				"current_p50_ms": row["p50_ms"],
+				"ratio": ratio,
+				"regression": ratio > 1.0 + tolerance,
+			}
+		)
+	return rows
@@ -0,0 +1,149 @@
+"""Accuracy and latency of test-time augmentation (TTA) on a validation set.
+
+Every image of an ImageFolder-style `--val-dir` (one folder per class, sorted
+into training's class order) goes through the service's own preprocessing and
+model twice: once as the standard single view, once as all MAX_TTA_VIEWS views.
+Each policy is then scored from those logits:
+
+  off          the single view
+  always@N     the mean logits of the first N views
+  gated@N<t    the single view, escalated to always@N when its top-1 score is below t
+
+Latency is measured on the serving functions (`_prepare_image` /
+`_prepare_views` plus a forward pass, without micro-batching) over the first
+`--latency-images` images. A gated policy's mean latency is the single-view
+latency plus its escalation rate times the cost of the N - 1 extra views.
+
+Usage (from the `ml/` directory):
+  python -m benchmarks.tta_bench --model models/best_model.pth --val-dir data/valid
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+import torch
+
+from benchmarks.suite import _make_artefact, _use_variant, measure, service
+
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def load_samples(val_dir: Path, limit: int | None = None) -> Tuple[List[str], List[Tuple[bytes, int]]]:
+	classes = sorted(path.name for path in val_dir.iterdir() if path.is_dir())
+	samples = [
+		(path.read_bytes(), index)
+		for index, name in enumerate(classes)
+		for path in sorted((val_dir / name).iterdir())
+		if path.suffix.lower() in IMAGE_SUFFIXES
+	]
+	return classes, samples[:limit] if limit else samples
+
+
+def collect_logits(app: Any, model: Any, samples: List[Tuple[bytes, int]], max_views: int) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+	"""(single-view logits [N, C], all-view logits [N, V, C], targets [N])."""
+	single, views = [], []
+	with torch.no_grad():
+		for payload, _ in samples:
+			single.append(model(app._prepare_image(payload, "tta-bench")).float().cpu()[0])
+			views.append(model(app._prepare_views(payload, max_views, "tta-bench")).float().cpu())
+	targets = torch.tensor([target for _, target in samples])
+	return torch.stack(single), torch.stack(views), targets
+
+
+def score_policies(single: torch.Tensor, views: torch.Tensor, targets: torch.Tensor, view_counts: Sequence[int], thresholds: Sequence[float]) -> List[Dict[str, Any]]:
+	confidence = torch.softmax(single, dim=1).max(dim=1).values
+	rows = [{"policy": "off", "views": 1, "threshold": None, "escalated": 0.0, "accuracy": (single.argmax(1) == targets).float().mean().item()}]
+	for count in view_counts:
+		# What the service averages: the standard view's logits plus views 1..count-1.
+		averaged = torch.cat([single.unsqueeze(1), views[:, 1:count]], dim=1).mean(dim=1)
+		rows.append({"policy": f"always@{count}", "views": count, "threshold": None, "escalated": 1.0, "accuracy": (averaged.argmax(1) == targets).float().mean().item()})
+		for threshold in thresholds:
+			escalate = confidence < threshold
+			predicted = torch.where(escalate, averaged.argmax(1), single.argmax(1))
+			rows.append(
+				{
+					"policy": f"gated@{count}<{threshold:g}",
+					"views": count,
+					"threshold": threshold,
+					"escalated": escalate.float().mean().item(),
+					"accuracy": (predicted == targets).float().mean().item(),
+				}
+			)
+	return rows
+
+
+def measure_latency(app: Any, model: Any, payloads: List[bytes], view_counts: Sequence[int], iterations: int) -> Dict[str, Any]:
+	"""p50 ms of the single view, of `count` views, and of a gated escalation (count - 1 views)."""
+	cycle = itertools.cycle(payloads)
+
+	def timed(fn: Any) -> float:
+		with torch.no_grad():
+			return measure(lambda: fn(next(cycle)), warmup=min(5, iterations), iterations=iterations)["p50_ms"]
+
+	latency: Dict[str, Any] = {"single_ms": timed(lambda payload: model(app._prepare_image(payload, "tta-bench")))}
+	for count in view_counts:
+		latency[f"always@{count}_ms"] = timed(lambda payload: model(app._prepare_views(payload, count, "tta-bench")))
+		latency[f"escalation@{count}_ms"] = timed(lambda payload: model(app._prepare_views(payload, count, "tta-bench", skip=1)))
+	return latency
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--val-dir", type=Path, required=True, help="ImageFolder-style validation set")
+	parser.add_argument("--model", type=Path, default=None, help="Model artefact (.pt/.pth); default: randomly initialised, latency only")
+	parser.add_argument("--arch", default="mobilenet_v2", choices=["mobilenet_v2", "improved_cnn"])
+	parser.add_argument("--views", default="2,4,6,12", help="Comma separated TTA view counts")
+	parser.add_argument("--thresholds", default="0.5,0.6,0.7,0.8,0.9", help="Comma separated gating thresholds")
+	parser.add_argument("--limit", type=int, default=None, help="Score at most this many images")
+	parser.add_argument("--latency-images", type=int, default=20)
+	parser.add_argument("--iterations", type=int, default=50)
+	parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+	args = parser.parse_args()
+
+	view_counts = [int(value) for value in args.views.split(",") if value.strip()]
+	thresholds = [float(value) for value in args.thresholds.split(",") if value.strip()]
+	classes, samples = load_samples(args.val_dir, args.limit)
+	if not samples:
+		sys.exit(f"No images found under {args.val_dir}")
+
+	with tempfile.TemporaryDirectory() as scratch, service(Path(scratch)) as app:
+		model_path = args.model or _make_artefact(Path(scratch), args.arch, "state_dict", len(classes))
+		_use_variant(app, model_path, args.arch, len(classes))
+		model = app.registry.get().model
+		max_views = max(view_counts)
+		single, views, targets = collect_logits(app, model, samples, max_views)
+		rows = score_policies(single, views, targets, view_counts, thresholds)
+		latency = measure_latency(app, model, [payload for payload, _ in samples[:args.latency_images]], view_counts, args.iterations)
+
+	for row in rows:
+		if row["policy"] == "off":
+			row["latency_ms"] = latency["single_ms"]
+		elif row["threshold"] is None:
+			row["latency_ms"] = latency[f"always@{row['views']}_ms"]
+		else:
+			row["latency_ms"] = latency["single_ms"] + row["escalated"] * latency[f"escalation@{row['views']}_ms"]
+
+	baseline = rows[0]
+	print(f"{len(samples)} images, {len(classes)} classes, model {args.model or 'random init (accuracy is meaningless)'}")
+	print(f"{'policy':<16} {'accuracy':>9} {'vs off':>8} {'escalated':>10} {'ms/image':>9} {'vs off':>7}")
+	for row in rows:
+		print(
+			f"{row['policy']:<16} {row['accuracy']:>9.2%} {(row['accuracy'] - baseline['accuracy']) * 100:>+7.2f}p "
+			f"{row['escalated']:>10.1%} {row['latency_ms']:>9.2f} {row['latency_ms'] / baseline['latency_ms']:>6.2f}x"
+		)
+
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as fp:
+			json.dump({"images": len(samples), "classes": classes, "latency": latency, "results": rows}, fp, indent=2)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,276 @@
+"""Memory profile of concurrent, slow `/predict` uploads.
+
+Starts the service under uvicorn in a subprocess, with a randomly initialised
+model, and sends bursts of concurrent multipart uploads. The body is sent
+chunked at `--rate` bytes/s per client, to mimic phones on slow links. The
+server's VmRSS and RssAnon are sampled from /proc every 10 ms, and each
+scenario reports its peak growth over the idle baseline, the status codes and
+the median latency:
+
+  accepted  a large camera JPEG (`--image-mp` megapixels, noisy, so it
+            compresses poorly)
+  oversize  the same JPEG padded past MAX_UPLOAD_BYTES
+  bomb      a PNG of a few hundred KB that decodes to `--bomb-mp` megapixels
+  zip_bomb  a zip of well under a MB holding a `--zip-bomb-mb` MB zero-filled
+            `bomb.jpg`, sent as the `archive` of `/predict/batch`
+
+Pass `--ml-dir` to profile another checkout (e.g. a `git worktree` of the
+previous release) for a before/after comparison. Linux only, because of /proc.
+
+Usage (from the `ml/` directory):
+  python -m benchmarks.upload_bench --concurrency 16 --rate 2000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from benchmarks.suite import _make_artefact
+
+
+BOUNDARY = "krishi-mitra-upload-bench"
+
+
+def camera_jpeg(megapixels: float, seed: int = 0) -> bytes:
+	width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+	height = int(width * 3 / 4)
+	rng = np.random.default_rng(seed)
+	pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+	buffer = io.BytesIO()
+	Image.fromarray(pixels).save(buffer, format="JPEG", quality=92)
+	return buffer.getvalue()
+
+
+def png_bomb(megapixels: float) -> bytes:
+	"""Valid all-black grayscale PNG; the zero rows compress roughly 1000:1."""
+	side = int((megapixels * 1e6) ** 0.5)
+
+	def chunk(kind: bytes, data: bytes) -> bytes:
+		return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+	compressor = zlib.compressobj(9)
+	row = b"\0" * (side + 1)  # filter byte + pixels
+	idat = b"".join(compressor.compress(row) for _ in range(side)) + compressor.flush()
+	header = struct.pack(">IIBBBBB", side, side, 8, 0, 0, 0, 0)
+	return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", idat) + chunk(b"IEND", b"")
+
+
+def zip_bomb(megabytes: int) -> bytes:
+	"""Zip whose single image entry inflates to `megabytes` MB of zeros (about 1000:1)."""
+	buffer = io.BytesIO()
+	zeros = b"\0" * (1024 * 1024)
+	with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+		with archive.open("bomb.jpg", "w", force_zip64=True) as entry:
+			for _ in range(megabytes):
+				entry.write(zeros)
+	return buffer.getvalue()
+
+
+class RssSampler:
+	def __init__(self, pid: int, interval: float = 0.01) -> None:
+		self.pid = pid
+		self.interval = interval
+		self.peak_rss = 0
+		self.peak_anon = 0
+		self._stop = threading.Event()
+		self._thread: threading.Thread | None = None
+
+	def read(self) -> Dict[str, int]:
+		values = {}
+		with open(f"/proc/{self.pid}/status", encoding="ascii") as fp:
+			for line in fp:
+				if line.startswith(("VmRSS:", "RssAnon:")):
+					key, value = line.split(":")
+					values[key] = int(value.split()[0]) * 1024
+		return values
+
+	def _run(self) -> None:
+		while not self._stop.is_set():
+			try:
+				values = self.read()
+			except OSError:
+				return
+			self.peak_rss = max(self.peak_rss, values.get("VmRSS", 0))
+			self.peak_anon = max(self.peak_anon, values.get("RssAnon", 0))
+			time.sleep(self.interval)
+
+	def __enter__(self) -> "RssSampler":
+		self.peak_rss = self.peak_anon = 0
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+		return self
+
+	def __exit__(self, *exc: Any) -> None:
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+
+
+# Scenarios posted as a `/predict/batch` archive instead of a `/predict` image.
+ARCHIVE_SCENARIOS = {"zip_bomb"}
+
+
+async def _body(payload: bytes, rate: float, field: str = "image", chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+	filename, content_type = ("survey.zip", "application/zip") if field == "archive" else ("leaf.jpg", "image/jpeg")
+	yield (
+		f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="crop_type"\r\n\r\ntomato\r\n'
+		f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+		f"Content-Type: {content_type}\r\n\r\n"
+	).encode("ascii")
+	for offset in range(0, len(payload), chunk_size):
+		yield payload[offset:offset + chunk_size]
+		if rate > 0:
+			await asyncio.sleep(chunk_size / rate)
+	yield f"\r\n--{BOUNDARY}--\r\n".encode("ascii")
+
+
+async def _upload(client: httpx.AsyncClient, payload: bytes, rate: float, archive: bool = False) -> Dict[str, Any]:
+	started = time.perf_counter()
+	status: int | str
+	try:
+		response = await client.post(
+			"/predict/batch" if archive else "/predict",
+			content=_body(payload, rate, "archive" if archive else "image"),
+			headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+		)
+		status = response.status_code
+		if archive and b'"error"' in response.content:
+			# `/predict/batch` reports rejected entries inline in a 200 response.
+			status = f"{status}+error"
+	except httpx.HTTPError:
+		# The server may answer 413 and close while the body is still being sent.
+		status = -1
+	return {"status": status, "seconds": time.perf_counter() - started}
+
+
+async def _burst(base_url: str, payload: bytes, concurrency: int, rate: float, archive: bool = False) -> List[Dict[str, Any]]:
+	async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+		return await asyncio.gather(*(_upload(client, payload, rate, archive) for _ in range(concurrency)))
+
+
+def _free_port() -> int:
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		return sock.getsockname()[1]
+
+
+def run(ml_dir: Path, scenarios: Dict[str, bytes], concurrency: Dict[str, int], rate: float) -> Dict[str, Any]:
+	with tempfile.TemporaryDirectory() as scratch:
+		model_path = _make_artefact(Path(scratch), "mobilenet_v2", "torchscript", 38)
+		port = _free_port()
+		env = {
+			**os.environ,
+			"MODEL_DIR": scratch,
+			"MODEL_PATH": str(model_path),
+			"CLASS_MAP_PATH": str(Path(scratch) / "missing-classes.json"),
+			"PREDICTION_CACHE": "false",
+			"MODEL_WATCH_INTERVAL": "0",
+		}
+		server = subprocess.Popen(
+			[sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+			cwd=ml_dir,
+			env=env,
+		)
+		base_url = f"http://127.0.0.1:{port}"
+		try:
+			deadline = time.time() + 120
+			while True:
+				try:
+					if httpx.get(f"{base_url}/health", timeout=1).json().get("status") == "ok":
+						break
+				except httpx.HTTPError:
+					pass
+				if time.time() > deadline or server.poll() is not None:
+					raise RuntimeError("service did not start")
+				time.sleep(0.2)
+			# One request first, so lazy allocations are in the baseline.
+			asyncio.run(_burst(base_url, camera_jpeg(1), 1, 0))
+
+			sampler = RssSampler(server.pid)
+			rows = []
+			for name, payload in scenarios.items():
+				time.sleep(0.5)
+				baseline = sampler.read()
+				with sampler:
+					results = asyncio.run(_burst(base_url, payload, concurrency[name], rate, name in ARCHIVE_SCENARIOS))
+				statuses: Dict[str, int] = {}
+				for result in results:
+					statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+				rows.append(
+					{
+						"scenario": name,
+						"payload_bytes": len(payload),
+						"concurrency": concurrency[name],
+						"statuses": statuses,
+						"p50_seconds": statistics.median(result["seconds"] for result in results),
+						"baseline_rss": baseline["VmRSS"],
+						"peak_rss_growth": sampler.peak_rss - baseline["VmRSS"],
+						"peak_anon_growth": sampler.peak_anon - baseline.get("RssAnon", 0),
+					}
+				)
+		finally:
+			server.terminate()
+			server.wait(timeout=30)
+	return {"ml_dir": str(ml_dir), "rate_bytes_per_s": rate, "results": rows}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--ml-dir", type=Path, default=Path(__file__).resolve().parent.parent)
+	parser.add_argument("--concurrency", type=int, default=16)
+	parser.add_argument("--bomb-concurrency", type=int, default=2, help="Kept low: an unprotected server decodes every bomb")
+	parser.add_argument("--rate", type=float, default=2_000_000, help="Upload bytes/s per client (0 = as fast as possible)")
+	parser.add_argument("--image-mp", type=float, default=12.0)
+	parser.add_argument("--oversize-bytes", type=int, default=24 * 1024 * 1024)
+	parser.add_argument("--bomb-mp", type=float, default=144.0)
+	parser.add_argument("--zip-bomb-mb", type=int, default=600)
+	parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+	args = parser.parse_args()
+
+	photo = camera_jpeg(args.image_mp)
+	scenarios = {
+		"accepted": photo,
+		"oversize": photo + b"\0" * max(0, args.oversize_bytes - len(photo)),
+		"bomb": png_bomb(args.bomb_mp),
+		"zip_bomb": zip_bomb(args.zip_bomb_mb),
+	}
+	concurrency = {"accepted": args.concurrency, "oversize": args.concurrency, "bomb": args.bomb_concurrency, "zip_bomb": args.bomb_concurrency}
+	results = run(args.ml_dir, scenarios, concurrency, args.rate)
+
+	mib = 1024 * 1024
+	print(f"{'scenario':<10} {'payload MiB':>12} {'clients':>8} {'statuses':<20} {'p50 s':>7} {'peak RSS +MiB':>14} {'peak anon +MiB':>15}")
+	for row in results["results"]:
+		statuses = ",".join(f"{code}x{count}" for code, count in sorted(row["statuses"].items()))
+		print(
+			f"{row['scenario']:<10} {row['payload_bytes'] / mib:>12.1f} {row['concurrency']:>8} {statuses:<20} "
+			f"{row['p50_seconds']:>7.2f} {row['peak_rss_growth'] / mib:>14.1f} {row['peak_anon_growth'] / mib:>15.1f}"
+		)
+
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as fp:
+			json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+	main()
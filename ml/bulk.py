@@ -0,0 +1,112 @@
+"""Lazy readers for bulk `/predict/batch` uploads.
+
+Uploads arrive either as a multipart list of images or as a single zip/tar
+archive. Both are exposed as an iterator of `(filename, payload)` pairs that
+reads one entry at a time, so memory use is bounded by the internal batch size
+rather than by the size of the survey being uploaded. Entries that cannot be
+read are yielded with an `Exception` payload so the caller can report them
+inline.
+
+Each entry is copied in chunks into an `ImageSink` from `make_sink`, the same
+bounded collector `/predict` streams into (see uploads.py): its byte limit
+applies while the entry is read, and its header sniffing stops a
+decompression bomb after the first chunk. An entry whose declared size
+(multipart part size, `ZipInfo.file_size`, `TarInfo.size`) is already over the
+limit is refused unread. Refused entries are yielded with an `UploadRejected`
+payload.
+"""
+
+from __future__ import annotations
+
+import itertools
+import tarfile
+import zipfile
+from pathlib import PurePosixPath
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Tuple, TypeVar, Union
+
+from starlette.datastructures import UploadFile
+
+from uploads import ImageBuffer, ImageSink, UploadRejected
+
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+Entry = Tuple[str, Union[ImageBuffer, Exception]]
+SinkFactory = Callable[[], ImageSink]
+T = TypeVar("T")
+
+
+def _is_image_name(name: str) -> bool:
+	path = PurePosixPath(name)
+	if any(part.startswith(".") or part == "__MACOSX" for part in path.parts):
+		return False
+	return path.suffix.lower() in IMAGE_SUFFIXES
+
+
+def _read_entry(fileobj: BinaryIO, declared: int | None, make_sink: SinkFactory, chunk_size: int = 64 * 1024) -> ImageBuffer:
+	sink = make_sink()
+	try:
+		if sink.max_bytes and declared is not None and declared > sink.max_bytes:
+			raise UploadRejected(413, f"Image is larger than {sink.max_bytes} bytes.")
+		# The sink raises as soon as the bytes read cross its limit, whatever the header claimed.
+		for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+			sink.write(memoryview(chunk))
+		return sink.finish()
+	except BaseException:
+		sink.close()
+		raise
+
+
+def iter_uploads(uploads: Iterable[UploadFile], make_sink: SinkFactory) -> Iterator[Entry]:
+	for upload in uploads:
+		name = upload.filename or "upload"
+		try:
+			upload.file.seek(0)
+			yield name, _read_entry(upload.file, getattr(upload, "size", None), make_sink)
+		except Exception as exc:  # pylint: disable=broad-except
+			yield name, exc
+
+
+def _iter_zip(archive: zipfile.ZipFile, make_sink: SinkFactory) -> Iterator[Entry]:
+	with archive:
+		for info in archive.infolist():
+			if info.is_dir() or not _is_image_name(info.filename):
+				continue
+			try:
+				with archive.open(info) as entry:
+					yield info.filename, _read_entry(entry, info.file_size, make_sink)
+			except Exception as exc:  # pylint: disable=broad-except
+				yield info.filename, exc
+
+
+def _iter_tar(archive: tarfile.TarFile, make_sink: SinkFactory) -> Iterator[Entry]:
+	with archive:
+		for member in archive:
+			if not member.isfile() or not _is_image_name(member.name):
+				continue
+			try:
+				extracted = archive.extractfile(member)
+				yield member.name, _read_entry(extracted, member.size, make_sink) if extracted is not None else b""
+			except Exception as exc:  # pylint: disable=broad-except
+				yield member.name, exc
+
+
+def iter_archive(fileobj: BinaryIO, make_sink: SinkFactory) -> Iterator[Entry]:
+	"""Open a zip or tar archive eagerly (so bad archives fail up front) and iterate it lazily."""
+	fileobj.seek(0)
+	if zipfile.is_zipfile(fileobj):
+		fileobj.seek(0)
+		return _iter_zip(zipfile.ZipFile(fileobj), make_sink)
+
+	fileobj.seek(0)
+	# Stream mode ("r|*") reads members strictly in order without indexing the whole archive.
+	return _iter_tar(tarfile.open(fileobj=fileobj, mode="r|*"), make_sink)
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+	iterator = iter(iterable)
+	while True:
+		chunk = list(itertools.islice(iterator, size))
+		if not chunk:
+			return
+		yield chunk
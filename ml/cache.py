@@ -0,0 +1,169 @@
+"""Content-addressed cache for `/predict` results.
+
+Predictions are keyed by a SHA-256 of the raw upload bytes salted with the
+identity (artefact path and mtime) of the model that answered, so a retrained
+or hot-swapped model never serves stale answers. Entries hold only the top-k
+class ids and scores (`{"top_k": [[class_id, score], ...]}`); full and compact
+responses are both rendered from them, so cached responses stay byte-for-byte
+compatible with fresh ones.
+
+Two backends are provided: an in-process LRU with TTL and a memory budget, and
+a Redis-compatible backend for sharing results across replicas.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Protocol, Tuple
+
+
+# Bumped whenever the stored payload changes shape, so replicas sharing a Redis
+# backend during a rollout never read each other's entries.
+ENTRY_FORMAT = b"top_k:v2\0"
+
+
+class CacheBackend(Protocol):
+	def get(self, key: str) -> str | None:
+		...
+
+	def set(self, key: str, payload: str) -> None:
+		...
+
+	def stats(self) -> Dict[str, Any]:
+		...
+
+
+class MemoryCacheBackend:
+	def __init__(self, ttl_seconds: float = 3600.0, max_bytes: int = 64 * 1024 * 1024) -> None:
+		self.ttl = ttl_seconds
+		self.max_bytes = max_bytes
+		self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+		self._bytes = 0
+		self._evictions = 0
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def _size(key: str, payload: str) -> int:
+		return len(key) + len(payload)
+
+	def _drop(self, key: str) -> None:
+		_, payload = self._entries.pop(key)
+		self._bytes -= self._size(key, payload)
+
+	def get(self, key: str) -> str | None:
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return None
+			expires_at, payload = entry
+			if self.ttl > 0 and expires_at < time.monotonic():
+				self._drop(key)
+				return None
+			self._entries.move_to_end(key)
+			return payload
+
+	def set(self, key: str, payload: str) -> None:
+		size = self._size(key, payload)
+		if size > self.max_bytes:
+			return
+
+		with self._lock:
+			if key in self._entries:
+				self._drop(key)
+			self._entries[key] = (time.monotonic() + self.ttl, payload)
+			self._bytes += size
+			while self._bytes > self.max_bytes:
+				self._drop(next(iter(self._entries)))
+				self._evictions += 1
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"backend": "memory",
+				"entries": len(self._entries),
+				"bytes": self._bytes,
+				"max_bytes": self.max_bytes,
+				"ttl_seconds": self.ttl,
+				"evictions": self._evictions,
+			}
+
+
+class RedisCacheBackend:
+	def __init__(self, url: str, ttl_seconds: float = 3600.0, prefix: str = "krishi-mitra:predict:") -> None:
+		try:
+			import redis  # type: ignore
+		except ImportError as exc:
+			raise RuntimeError("PREDICTION_CACHE_URL requires the `redis` package (pip install redis).") from exc
+
+		self.ttl = ttl_seconds
+		self.prefix = prefix
+		self._client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+		self._errors = 0
+
+	def get(self, key: str) -> str | None:
+		try:
+			payload = self._client.get(self.prefix + key)
+		except Exception:  # pylint: disable=broad-except
+			# A shared cache outage must never fail a prediction.
+			self._errors += 1
+			return None
+		return payload.decode("utf-8") if payload is not None else None
+
+	def set(self, key: str, payload: str) -> None:
+		try:
+			self._client.set(self.prefix + key, payload, ex=int(self.ttl) if self.ttl > 0 else None)
+		except Exception:  # pylint: disable=broad-except
+			self._errors += 1
+
+	def stats(self) -> Dict[str, Any]:
+		return {"backend": "redis", "ttl_seconds": self.ttl, "errors": self._errors}
+
+
+def model_identity(model_path: Path) -> str:
+	try:
+		mtime = model_path.stat().st_mtime_ns
+	except OSError:
+		mtime = 0
+	return f"{model_path.resolve()}:{mtime}"
+
+
+class PredictionCache:
+	def __init__(self, backend: CacheBackend) -> None:
+		self.backend = backend
+		self._hits = 0
+		self._misses = 0
+		self._lock = threading.Lock()
+
+	def key(self, identity: str, image_bytes: bytes) -> str:
+		digest = hashlib.sha256(ENTRY_FORMAT)
+		digest.update(identity.encode("utf-8"))
+		digest.update(b"\0")
+		digest.update(image_bytes)
+		return digest.hexdigest()
+
+	def get(self, key: str) -> Dict[str, Any] | None:
+		payload = self.backend.get(key)
+		with self._lock:
+			if payload is None:
+				self._misses += 1
+				return None
+			self._hits += 1
+		return json.loads(payload)
+
+	def set(self, key: str, prediction: Dict[str, Any]) -> None:
+		self.backend.set(key, json.dumps(prediction, separators=(",", ":")))
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			lookups = self._hits + self._misses
+			return {
+				"hits": self._hits,
+				"misses": self._misses,
+				"hit_rate": (self._hits / lookups) if lookups else 0.0,
+				**self.backend.stats(),
+			}
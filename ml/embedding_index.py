@@ -0,0 +1,356 @@
+"""On-disk approximate nearest-neighbour index over image embeddings.
+
+`/similar` embeds a photo with the serving model (the pooled features in front of
+the classifier, see `embedding_head`) and looks up previously validated cases
+that look alike. `EmbeddingIndex` is an IVF index with scalar quantization,
+built with numpy alone:
+
+  - embeddings are centred and projected by PCA to `dim` dimensions (128 by
+    default, from MobileNetV2's 1280), then L2-normalised, so a dot product is
+    a cosine similarity;
+  - each vector is stored as int8 with a per-dimension scale (`dim` bytes per
+    vector: ~128 MB for a million cases);
+  - spherical k-means splits the space into `nlist` lists. A query scores the
+    list centroids, scans only the `nprobe` closest lists and dequantizes on
+    the fly (one int8 -> float32 matmul per list).
+
+All arrays are memory-mapped from the index directory, so opening an index is
+instant and only the probed lists are paged in:
+
+    index.json      format, dimensions, classes, row counts
+    model.npz       PCA mean/components, quantization scales, centroids
+    main.vec        int8 (rows, dim), sorted by list
+    main.offsets.npy int64 (nlist + 1), start row of every list
+    main.meta       (label int32, key int64) per row
+    delta.*         rows added since the last `compact()`, in insertion order
+    keys.txt/.idx   case keys (e.g. image paths), one per line, and their offsets
+
+`add()` appends to the delta segment, which every query scans in full, and then
+rewrites index.json; readers only trust the row counts in index.json, so a
+crash mid-append leaves the index consistent. `compact()` merges the delta into
+the list-sorted main segment; `add()` triggers it once the delta outgrows
+`compact_rows`.
+Only one process should insert into an index; others call `refresh()` to see
+its rows.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+FORMAT = 1
+META_DTYPE = np.dtype([("label", "<i4"), ("key", "<i8")])
+
+
+@dataclass
+class Neighbor:
+	score: float
+	label: int
+	key: str
+
+
+def embedding_head(model: Any) -> Callable[[Any], Tuple[Any, Any]] | None:
+	"""`inputs -> (logits, embedding)` for models that expose their penultimate features, else None.
+
+	Covers torchvision's MobileNetV2 (eager or TorchScript: `features` then pooled
+	`classifier`) and `ImprovedCNN.embed`. Frozen, quantized and ONNX graphs have
+	no submodules left to split.
+	"""
+	import torch
+
+	if hasattr(model, "features") and hasattr(model, "classifier"):
+
+		def forward(inputs: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+			pooled = torch.flatten(torch.nn.functional.adaptive_avg_pool2d(model.features(inputs), 1), 1)
+			return model.classifier(pooled), pooled
+
+		return forward
+
+	if hasattr(model, "embed") and hasattr(model, "fc3"):
+
+		def forward(inputs: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+			embedding = model.embed(inputs)
+			return model.fc3(embedding), embedding
+
+		return forward
+	return None
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+	norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+	return vectors / np.maximum(norms, 1e-12)
+
+
+def _spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int, rng: np.random.Generator, chunk: int = 65536) -> np.ndarray:
+	centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+	for _ in range(iterations):
+		sums = np.zeros_like(centroids, dtype=np.float64)
+		counts = np.zeros(nlist, dtype=np.int64)
+		for start in range(0, len(vectors), chunk):
+			block = vectors[start:start + chunk]
+			assign = (block @ centroids.T).argmax(1)
+			np.add.at(sums, assign, block)
+			counts += np.bincount(assign, minlength=nlist)
+		empty = counts == 0
+		if empty.any():
+			# Re-seed empty lists on random points rather than letting them die.
+			sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+		centroids = _normalize(sums.astype(np.float32))
+	return centroids
+
+
+def _write_json(path: Path, payload: Dict[str, Any]) -> None:
+	temporary = path.with_suffix(".tmp")
+	with temporary.open("w", encoding="utf-8") as fp:
+		json.dump(payload, fp, indent=2)
+		fp.flush()
+		os.fsync(fp.fileno())
+	os.replace(temporary, path)
+
+
+def _memmap(path: Path, dtype: Any, rows: int, width: int | None = None) -> np.ndarray:
+	shape = (rows,) if width is None else (rows, width)
+	if rows == 0:
+		return np.zeros(shape, dtype=dtype)
+	return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class EmbeddingIndex:
+	def __init__(self, path: Path, compact_rows: int = 20_000) -> None:
+		self.path = Path(path)
+		self.compact_rows = compact_rows
+		self._lock = threading.Lock()
+		self._mtime = (self.path / "index.json").stat().st_mtime_ns
+		self.meta = json.loads((self.path / "index.json").read_text(encoding="utf-8"))
+		if self.meta.get("format") != FORMAT:
+			raise ValueError(f"Unsupported index format {self.meta.get('format')} in {self.path}")
+		model = np.load(self.path / "model.npz")
+		self.mean = model["mean"]
+		self.components = model["components"]
+		self.scale = model["scale"]
+		self.centroids = model["centroids"]
+		self.classes: List[str] = self.meta.get("classes", [])
+		self._open_segments()
+
+	# Building ----------------------------------------------------------------
+
+	@classmethod
+	def train(
+		cls,
+		path: Path,
+		sample: np.ndarray,
+		dim: int = 128,
+		nlist: int | None = None,
+		classes: Sequence[str] = (),
+		model: str | None = None,
+		iterations: int = 20,
+		seed: int = 0,
+	) -> "EmbeddingIndex":
+		"""Fit PCA, quantization scales and list centroids on `sample` and create an empty index at `path`."""
+		path = Path(path)
+		path.mkdir(parents=True, exist_ok=True)
+		rng = np.random.default_rng(seed)
+		sample = np.asarray(sample, dtype=np.float32)
+		count, input_dim = sample.shape
+		dim = max(1, min(dim, input_dim, count))
+
+		mean = sample.mean(0)
+		centred = sample - mean
+		_, eigenvectors = np.linalg.eigh(centred.T.astype(np.float64) @ centred / max(1, count - 1))
+		components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :dim], dtype=np.float32)
+		reduced = _normalize(centred @ components)
+
+		scale = np.maximum(np.abs(reduced).max(0), 1e-6) / 127.0
+		nlist = nlist or int(np.clip(4 * np.sqrt(count), 1, 65536))
+		nlist = max(1, min(nlist, count))
+		centroids = _spherical_kmeans(reduced, nlist, iterations, rng)
+
+		np.savez(path / "model.npz", mean=mean, components=components, scale=scale.astype(np.float32), centroids=centroids)
+		for name in ("main.vec", "main.meta", "delta.vec", "delta.meta", "delta.list", "keys.txt", "keys.idx"):
+			(path / name).write_bytes(b"")
+		np.save(path / "main.offsets.npy", np.zeros(nlist + 1, dtype=np.int64))
+		_write_json(
+			path / "index.json",
+			{"format": FORMAT, "input_dim": input_dim, "dim": dim, "nlist": nlist, "classes": list(classes), "model": model, "main_rows": 0, "delta_rows": 0, "keys": 0, "keys_bytes": 0},
+		)
+		return cls(path)
+
+	def _open_segments(self) -> None:
+		dim, meta = self.meta["dim"], self.meta
+		self.offsets = np.load(self.path / "main.offsets.npy")
+		self.main_vec = _memmap(self.path / "main.vec", np.int8, meta["main_rows"], dim)
+		self.main_meta = _memmap(self.path / "main.meta", META_DTYPE, meta["main_rows"])
+		self.delta_vec = _memmap(self.path / "delta.vec", np.int8, meta["delta_rows"], dim)
+		self.delta_meta = _memmap(self.path / "delta.meta", META_DTYPE, meta["delta_rows"])
+		self.key_offsets = _memmap(self.path / "keys.idx", np.uint64, meta["keys"])
+		self.key_text = _memmap(self.path / "keys.txt", np.uint8, meta["keys_bytes"])
+
+	def refresh(self) -> bool:
+		"""Pick up rows another process appended or compacted since this one last looked."""
+		try:
+			mtime = (self.path / "index.json").stat().st_mtime_ns
+			if mtime == self._mtime:
+				return False
+			meta = json.loads((self.path / "index.json").read_text(encoding="utf-8"))
+		except (OSError, ValueError):
+			return False
+		with self._lock:
+			self.meta, self._mtime = meta, mtime
+			self._open_segments()
+		return True
+
+	def __len__(self) -> int:
+		return self.meta["main_rows"] + self.meta["delta_rows"]
+
+	def project(self, embeddings: np.ndarray) -> np.ndarray:
+		"""PCA-reduced, L2-normalised float32 vectors (what the index compares)."""
+		return _normalize((np.asarray(embeddings, dtype=np.float32) - self.mean) @ self.components)
+
+	def _quantize(self, reduced: np.ndarray) -> np.ndarray:
+		return np.clip(np.rint(reduced / self.scale), -127, 127).astype(np.int8)
+
+	# Inserts -----------------------------------------------------------------
+
+	def _truncate_to(self, name: str, size: int) -> None:
+		# Drops bytes a crashed append left past the committed row count.
+		with open(self.path / name, "r+b") as fp:
+			fp.truncate(size)
+
+	def add(self, embeddings: np.ndarray, labels: Sequence[int], keys: Sequence[str]) -> None:
+		"""Append cases to the delta segment (and compact once it outgrows `compact_rows`)."""
+		if len(embeddings) != len(labels) or len(labels) != len(keys):
+			raise ValueError("embeddings, labels and keys must have the same length")
+		if not len(keys):
+			return
+		reduced = self.project(embeddings)
+		vectors = self._quantize(reduced)
+		lists = (reduced @ self.centroids.T).argmax(1).astype(np.int32)
+
+		with self._lock:
+			meta = dict(self.meta)
+			dim, rows, key_count, text_size = meta["dim"], meta["delta_rows"], meta["keys"], meta["keys_bytes"]
+			encoded = [key.replace("\n", " ").encode("utf-8") + b"\n" for key in keys]
+			starts = text_size + np.concatenate([[0], np.cumsum([len(line) for line in encoded])[:-1]]).astype(np.uint64)
+
+			records = np.empty(len(keys), dtype=META_DTYPE)
+			records["label"] = np.asarray(labels, dtype=np.int32)
+			records["key"] = np.arange(key_count, key_count + len(keys), dtype=np.int64)
+			for name, size, payload in (
+				("delta.vec", rows * dim, vectors.tobytes()),
+				("delta.meta", rows * META_DTYPE.itemsize, records.tobytes()),
+				("delta.list", rows * 4, lists.tobytes()),
+				("keys.txt", text_size, b"".join(encoded)),
+				("keys.idx", key_count * 8, starts.tobytes()),
+			):
+				self._truncate_to(name, size)
+				with open(self.path / name, "ab") as fp:
+					fp.write(payload)
+					fp.flush()
+					os.fsync(fp.fileno())
+
+			meta["delta_rows"] = rows + len(keys)
+			meta["keys"] = key_count + len(keys)
+			meta["keys_bytes"] = text_size + sum(len(line) for line in encoded)
+			_write_json(self.path / "index.json", meta)
+			self.meta, self._mtime = meta, (self.path / "index.json").stat().st_mtime_ns
+			self._open_segments()
+			if meta["delta_rows"] >= self.compact_rows:
+				self._compact()
+
+	def compact(self) -> None:
+		with self._lock:
+			self._compact()
+
+	def _compact(self, chunk: int = 262144) -> None:
+		"""Merge the delta segment into the list-sorted main segment."""
+		meta = dict(self.meta)
+		main_rows, delta_rows, dim, nlist = meta["main_rows"], meta["delta_rows"], meta["dim"], meta["nlist"]
+		if delta_rows == 0:
+			return
+		main_lists = np.repeat(np.arange(nlist, dtype=np.int32), np.diff(self.offsets))
+		delta_lists = _memmap(self.path / "delta.list", np.int32, delta_rows)
+		# Stable, so every list keeps main rows first and then delta rows in insertion order.
+		order = np.argsort(np.concatenate([main_lists, delta_lists]), kind="stable")
+		counts = np.bincount(np.concatenate([main_lists, delta_lists]), minlength=nlist)
+
+		total = main_rows + delta_rows
+		new_vec = np.memmap(self.path / "main.vec.tmp", dtype=np.int8, mode="w+", shape=(total, dim))
+		new_meta = np.memmap(self.path / "main.meta.tmp", dtype=META_DTYPE, mode="w+", shape=(total,))
+		for start in range(0, total, chunk):
+			rows = order[start:start + chunk]
+			from_main = rows < main_rows
+			new_vec[start:start + len(rows)][from_main] = self.main_vec[rows[from_main]]
+			new_vec[start:start + len(rows)][~from_main] = self.delta_vec[rows[~from_main] - main_rows]
+			new_meta[start:start + len(rows)][from_main] = self.main_meta[rows[from_main]]
+			new_meta[start:start + len(rows)][~from_main] = self.delta_meta[rows[~from_main] - main_rows]
+		new_vec.flush()
+		new_meta.flush()
+		del new_vec, new_meta
+
+		offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+		np.save(self.path / "main.offsets.tmp.npy", offsets)
+		os.replace(self.path / "main.vec.tmp", self.path / "main.vec")
+		os.replace(self.path / "main.meta.tmp", self.path / "main.meta")
+		os.replace(self.path / "main.offsets.tmp.npy", self.path / "main.offsets.npy")
+		meta["main_rows"], meta["delta_rows"] = total, 0
+		_write_json(self.path / "index.json", meta)
+		for name in ("delta.vec", "delta.meta", "delta.list"):
+			# Replaced rather than truncated: a concurrent search may still map the old delta.
+			(self.path / f"{name}.tmp").write_bytes(b"")
+			os.replace(self.path / f"{name}.tmp", self.path / name)
+		self.meta, self._mtime = meta, (self.path / "index.json").stat().st_mtime_ns
+		self._open_segments()
+
+	# Queries -----------------------------------------------------------------
+
+	def key(self, key: int) -> str:
+		start = int(self.key_offsets[key])
+		end = int(self.key_offsets[key + 1]) if key + 1 < len(self.key_offsets) else len(self.key_text)
+		return bytes(self.key_text[start:end - 1]).decode("utf-8")
+
+	def search(self, embeddings: np.ndarray, k: int = 5, nprobe: int = 16) -> List[List[Neighbor]]:
+		"""The `k` most similar cases (approximate cosine similarity) for each embedding."""
+		queries = self.project(np.atleast_2d(embeddings))
+		# One consistent snapshot of the segments, even if an add() swaps them meanwhile.
+		offsets, main_vec, main_meta, delta_vec, delta_meta = self.offsets, self.main_vec, self.main_meta, self.delta_vec, self.delta_meta
+		nprobe = max(1, min(nprobe, len(self.centroids)))
+		results = []
+		for query in queries:
+			weighted = (query * self.scale).astype(np.float32)
+			probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+			blocks = [(int(offsets[lst]), int(offsets[lst + 1])) for lst in probe if offsets[lst + 1] > offsets[lst]]
+			scores = [main_vec[start:end].astype(np.float32) @ weighted for start, end in blocks]
+			metas = [main_meta[start:end] for start, end in blocks]
+			if len(delta_vec):
+				scores.append(delta_vec.astype(np.float32) @ weighted)
+				metas.append(delta_meta)
+			if not scores:
+				results.append([])
+				continue
+			all_scores = np.concatenate(scores)
+			all_meta = np.concatenate(metas)
+			top = min(k, len(all_scores))
+			best = np.argpartition(-all_scores, top - 1)[:top]
+			best = best[np.argsort(-all_scores[best])]
+			results.append([Neighbor(float(all_scores[row]), int(all_meta[row]["label"]), self.key(int(all_meta[row]["key"]))) for row in best])
+		return results
+
+	def describe(self) -> Dict[str, Any]:
+		return {
+			"path": str(self.path),
+			"rows": len(self),
+			"main_rows": self.meta["main_rows"],
+			"delta_rows": self.meta["delta_rows"],
+			"dim": self.meta["dim"],
+			"input_dim": self.meta["input_dim"],
+			"nlist": self.meta["nlist"],
+			"model": self.meta.get("model"),
+		}
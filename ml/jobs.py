@@ -0,0 +1,313 @@
+"""Asynchronous inference jobs for callers that should not hold a connection open.
+
+`POST /jobs` stores the upload, answers 202 with a job id and runs the
+prediction in the background; `GET /jobs/{id}` returns the job's status and,
+once it is done, the same body `/predict` would have answered with. `?wait=N`
+long-polls for up to N seconds.
+
+`JobQueue` is bounded by queued job count and queued payload bytes; beyond
+either it raises `QueueFull` so the API can answer 503 with a Retry-After hint.
+Queued `interactive` jobs always start before `bulk` ones, FIFO within a
+priority. Every job expires `ttl` seconds after submission: a job still queued
+by then is dropped without running (its caller has given up), and finished
+results are purged.
+
+With a `store_path` the queue is backed by SQLite (WAL mode): payloads are kept
+in the database instead of memory, and jobs that were queued or running when
+the service stopped are queued again on the next start. SQLite calls run on
+worker threads, off the event loop.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+PRIORITIES = ("interactive", "bulk")
+FINISHED = ("done", "failed", "expired")
+
+
+class QueueFull(RuntimeError):
+	def __init__(self, retry_after: int) -> None:
+		super().__init__("Job queue is full")
+		self.retry_after = retry_after
+
+
+@dataclass
+class Job:
+	id: str
+	priority: str
+	crop_type: str
+	options: Dict[str, Any]
+	size: int
+	created: float
+	expires: float
+	status: str = "queued"
+	payload: Any = None
+	result: bytes | None = None
+	error: str | None = None
+	started: float | None = None
+	finished: float | None = None
+	done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+	@property
+	def wait_seconds(self) -> float | None:
+		return None if self.started is None else self.started - self.created
+
+	@property
+	def run_seconds(self) -> float | None:
+		return None if self.started is None or self.finished is None else self.finished - self.started
+
+	def describe(self) -> Dict[str, Any]:
+		return {
+			"job_id": self.id,
+			"status": self.status,
+			"priority": self.priority,
+			"crop_type": self.crop_type,
+			"created_at": self.created,
+			"expires_at": self.expires,
+			"queue_seconds": self.wait_seconds,
+			"run_seconds": self.run_seconds,
+			"error": self.error,
+		}
+
+
+class SQLiteJobStore:
+	_SCHEMA = """
+		CREATE TABLE IF NOT EXISTS jobs (
+			id TEXT PRIMARY KEY,
+			priority TEXT NOT NULL,
+			crop_type TEXT NOT NULL,
+			options TEXT NOT NULL,
+			size INTEGER NOT NULL,
+			created REAL NOT NULL,
+			expires REAL NOT NULL,
+			status TEXT NOT NULL,
+			payload BLOB,
+			result BLOB,
+			error TEXT,
+			started REAL,
+			finished REAL
+		)
+	"""
+
+	def __init__(self, path: Path) -> None:
+		path.parent.mkdir(parents=True, exist_ok=True)
+		self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute("PRAGMA synchronous=NORMAL")
+		self._conn.execute(self._SCHEMA)
+		self._lock = threading.Lock()
+
+	def insert(self, job: Job, payload: Any) -> None:
+		with self._lock:
+			self._conn.execute(
+				"INSERT INTO jobs (id, priority, crop_type, options, size, created, expires, status, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+				(job.id, job.priority, job.crop_type, json.dumps(job.options), job.size, job.created, job.expires, job.status, memoryview(payload)),
+			)
+
+	def payload(self, job_id: str) -> bytes | None:
+		with self._lock:
+			row = self._conn.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+		return row[0] if row else None
+
+	def update(self, job: Job) -> None:
+		# Finished jobs drop their payload; only the result is kept until expiry.
+		with self._lock:
+			self._conn.execute(
+				"UPDATE jobs SET status = ?, result = ?, error = ?, started = ?, finished = ?, payload = CASE WHEN ? THEN NULL ELSE payload END WHERE id = ?",
+				(job.status, job.result, job.error, job.started, job.finished, job.status in FINISHED, job.id),
+			)
+
+	def load(self, now: float) -> List[Job]:
+		with self._lock:
+			rows = self._conn.execute(
+				"SELECT id, priority, crop_type, options, size, created, expires, status, result, error, started, finished FROM jobs WHERE expires > ? ORDER BY created",
+				(now,),
+			).fetchall()
+		jobs = []
+		for job_id, priority, crop_type, options, size, created, expires, status, result, error, started, finished in rows:
+			if status == "running":
+				# Interrupted by the restart: run it again from the start.
+				status, started = "queued", None
+			jobs.append(Job(job_id, priority, crop_type, json.loads(options), size, created, expires, status, None, result, error, started, finished))
+		return jobs
+
+	def delete_expired(self, now: float) -> int:
+		with self._lock:
+			return self._conn.execute("DELETE FROM jobs WHERE expires <= ?", (now,)).rowcount
+
+	def close(self) -> None:
+		with self._lock:
+			self._conn.close()
+
+
+class JobQueue:
+	def __init__(
+		self,
+		max_jobs: int = 256,
+		max_bytes: int = 256 * 1024 * 1024,
+		ttl: float = 600.0,
+		store_path: Path | None = None,
+		retry_after: int = 1,
+		sweep_interval: float = 30.0,
+		on_finish: Callable[[Job], None] | None = None,
+	) -> None:
+		self.max_jobs = max_jobs
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.retry_after = retry_after
+		self.sweep_interval = sweep_interval
+		self.on_finish = on_finish
+		self.store = SQLiteJobStore(store_path) if store_path is not None else None
+		self._jobs: Dict[str, Job] = {}
+		self._heap: List[Tuple[int, int, str]] = []
+		self._seq = itertools.count()
+		self._queued = {priority: 0 for priority in PRIORITIES}
+		self._queued_bytes = 0
+		self._running = 0
+		self._completed = 0
+		self._available: asyncio.Condition | None = None
+		self._tasks: List[asyncio.Task] = []
+
+	def queue_depth(self, priority: str | None = None) -> int:
+		return self._queued[priority] if priority is not None else sum(self._queued.values())
+
+	def _push(self, job: Job) -> None:
+		heapq.heappush(self._heap, (PRIORITIES.index(job.priority), next(self._seq), job.id))
+		self._queued[job.priority] += 1
+		self._queued_bytes += job.size
+
+	async def start(self, handler: Callable[[Job, Any], Awaitable[bytes]], workers: int) -> None:
+		"""Restore persisted jobs and start `workers` tasks on the running loop; `handler(job, payload)` returns the result body."""
+		self._available = asyncio.Condition()
+		if self.store is not None:
+			for job in await asyncio.to_thread(self.store.load, time.time()):
+				self._jobs[job.id] = job
+				if job.status == "queued":
+					self._push(job)
+				else:
+					job.done.set()
+			if self._heap:
+				print(f"♻️ Restored {len(self._heap)} queued job(s) from the job store")
+		self._tasks = [asyncio.create_task(self._work(handler), name=f"job-worker-{index}") for index in range(workers)]
+		self._tasks.append(asyncio.create_task(self._sweep(), name="job-sweeper"))
+
+	async def stop(self) -> None:
+		for task in self._tasks:
+			task.cancel()
+		await asyncio.gather(*self._tasks, return_exceptions=True)
+		self._tasks = []
+		if self.store is not None:
+			self.store.close()
+
+	async def submit(self, payload: Any, priority: str, crop_type: str, options: Dict[str, Any]) -> Job:
+		if priority not in PRIORITIES:
+			raise ValueError(f"Unsupported priority '{priority}'. Supported options: {', '.join(PRIORITIES)}")
+		assert self._available is not None, "JobQueue.start() has not been called"
+		size = len(payload)
+		if self.queue_depth() >= self.max_jobs or self._queued_bytes + size > self.max_bytes:
+			raise QueueFull(self.retry_after)
+
+		now = time.time()
+		job = Job(uuid.uuid4().hex, priority, crop_type, options, size, now, now + self.ttl)
+		if self.store is not None:
+			await asyncio.to_thread(self.store.insert, job, payload)
+		else:
+			job.payload = payload
+		async with self._available:
+			self._jobs[job.id] = job
+			self._push(job)
+			self._available.notify()
+		return job
+
+	def get(self, job_id: str) -> Job | None:
+		job = self._jobs.get(job_id)
+		if job is None or (job.expires <= time.time() and job.status in FINISHED):
+			return None
+		return job
+
+	async def wait(self, job: Job, timeout: float) -> Job:
+		if timeout > 0 and not job.done.is_set():
+			try:
+				await asyncio.wait_for(job.done.wait(), timeout)
+			except asyncio.TimeoutError:
+				pass
+		return job
+
+	async def _next(self) -> Job:
+		assert self._available is not None
+		async with self._available:
+			await self._available.wait_for(lambda: bool(self._heap))
+			_, _, job_id = heapq.heappop(self._heap)
+		job = self._jobs[job_id]
+		self._queued[job.priority] -= 1
+		self._queued_bytes -= job.size
+		return job
+
+	async def _finish(self, job: Job, status: str, result: bytes | None = None, error: str | None = None) -> None:
+		job.status, job.result, job.error, job.finished = status, result, error, time.time()
+		job.payload = None
+		if self.store is not None:
+			await asyncio.to_thread(self.store.update, job)
+		job.done.set()
+		self._completed += 1
+		if self.on_finish is not None:
+			self.on_finish(job)
+
+	async def _work(self, handler: Callable[[Job, Any], Awaitable[bytes]]) -> None:
+		while True:
+			job = await self._next()
+			if job.expires <= time.time():
+				await self._finish(job, "expired", error="Job expired before a worker picked it up.")
+				continue
+
+			job.status, job.started = "running", time.time()
+			self._running += 1
+			try:
+				if self.store is not None:
+					await asyncio.to_thread(self.store.update, job)
+					payload = await asyncio.to_thread(self.store.payload, job.id)
+				else:
+					payload = job.payload
+				result = await handler(job, payload)
+			except asyncio.CancelledError:
+				raise
+			except Exception as exc:  # pylint: disable=broad-except
+				await self._finish(job, "failed", error=str(getattr(exc, "detail", exc)))
+			else:
+				await self._finish(job, "done", result=result)
+			finally:
+				self._running -= 1
+
+	async def _sweep(self) -> None:
+		while True:
+			await asyncio.sleep(self.sweep_interval)
+			now = time.time()
+			for job_id in [job.id for job in self._jobs.values() if job.expires <= now and job.status in FINISHED]:
+				del self._jobs[job_id]
+			if self.store is not None:
+				await asyncio.to_thread(self.store.delete_expired, now)
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"queued": dict(self._queued),
+			"queued_bytes": self._queued_bytes,
+			"running": self._running,
+			"completed": self._completed,
+			"retained": len(self._jobs),
+			"max_jobs": self.max_jobs,
+			"max_bytes": self.max_bytes,
+			"ttl_seconds": self.ttl,
+			"durable": self.store is not None,
+		}
@@ -0,0 +1,153 @@
+"""Fast image preprocessing for the inference service.
+
+`FastPreprocessor` reproduces `Resize((224, 224)) -> ToTensor -> Normalize`
+with two shortcuts:
+
+  - JPEGs are decoded in draft mode, letting libjpeg downscale by 1/2, 1/4 or
+    1/8 during the DCT. The draft target is kept at `draft_factor` times the
+    output size so the final bilinear resize still has real pixels to filter.
+  - uint8 -> normalized float32 is a single fused `addcmul` written straight
+    into a caller-supplied (preallocated) tensor, instead of ToTensor's divide
+    followed by Normalize's subtract and divide.
+
+For non-JPEG inputs the output matches the torchvision pipeline up to float
+rounding; for JPEGs the draft decode introduces a small, bounded difference
+(see `benchmarks/preprocess_bench.py`).
+
+`tta_views` and `crop_box` describe the test-time augmentation views: the
+standard full-frame resize, then central and corner crops, each followed by its
+horizontal mirror. Crops keep 87.5% of each side (224 of 256), inside the
+0.8-1.0 area range of training's RandomResizedCrop; mirrors match its
+RandomHorizontalFlip.
+"""
+
+from __future__ import annotations
+
+import io
+import warnings
+from typing import Any, List, Sequence, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+# bytes, bytearray, memoryview, mmap: anything exposing the buffer protocol.
+Buffer = Any
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+TTA_CROPS = ("full", "center", "top_left", "top_right", "bottom_left", "bottom_right")
+MAX_TTA_VIEWS = 2 * len(TTA_CROPS)
+TTA_CROP_FRACTION = 0.875
+
+# `to_tensor` only ever reads the decoded pixels, so wrapping Pillow's read-only
+# buffer without a defensive copy is safe.
+warnings.filterwarnings("ignore", message="The given NumPy array is not writable", category=UserWarning, module=__name__)
+
+
+class BufferReader(io.RawIOBase):
+	"""Seekable read-only file over any bytes-like buffer.
+
+	`io.BytesIO` shares the memory of a `bytes` object but copies every other
+	buffer up front; this hands the decoder slices of the upload buffer instead.
+	"""
+
+	def __init__(self, buffer: Buffer) -> None:
+		super().__init__()
+		self._view = memoryview(buffer).cast("B")
+		self._pos = 0
+
+	def readable(self) -> bool:
+		return True
+
+	def seekable(self) -> bool:
+		return True
+
+	def tell(self) -> int:
+		return self._pos
+
+	def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+		base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+		self._pos = max(0, base + offset)
+		return self._pos
+
+	def read(self, size: int = -1) -> bytes:
+		end = len(self._view) if size is None or size < 0 else min(len(self._view), self._pos + size)
+		data = self._view[self._pos:end].tobytes()
+		self._pos = max(self._pos, end)
+		return data
+
+	def readinto(self, buffer: bytearray | memoryview) -> int:  # type: ignore[override]
+		data = self.read(len(buffer))
+		buffer[:len(data)] = data
+		return len(data)
+
+
+def open_image(image_bytes: Buffer) -> Image.Image:
+	return Image.open(io.BytesIO(image_bytes) if isinstance(image_bytes, bytes) else BufferReader(image_bytes))
+
+
+def tta_views(count: int) -> List[Tuple[str, bool]]:
+	"""The first `count` (crop, mirrored) views, in TTA_CROPS order with each mirror right after its crop."""
+	if not 1 <= count <= MAX_TTA_VIEWS:
+		raise ValueError(f"TTA view count must be between 1 and {MAX_TTA_VIEWS}, got {count}")
+	return [(crop, mirrored) for crop in TTA_CROPS for mirrored in (False, True)][:count]
+
+
+def crop_box(crop: str, width: int, height: int, fraction: float = TTA_CROP_FRACTION) -> Tuple[float, float, float, float] | None:
+	"""Source region of `crop` as a PIL (left, upper, right, lower) box; None for the full frame."""
+	if crop == "full":
+		return None
+	crop_width, crop_height = width * fraction, height * fraction
+	if crop == "center":
+		left, upper = (width - crop_width) / 2, (height - crop_height) / 2
+	else:
+		vertical, horizontal = crop.split("_")
+		left = 0.0 if horizontal == "left" else width - crop_width
+		upper = 0.0 if vertical == "top" else height - crop_height
+	return left, upper, left + crop_width, upper + crop_height
+
+
+class FastPreprocessor:
+	def __init__(
+		self,
+		size: Tuple[int, int] = (224, 224),
+		mean: Sequence[float] = IMAGENET_MEAN,
+		std: Sequence[float] = IMAGENET_STD,
+		draft_factor: int = 2,
+	) -> None:
+		self.size = size
+		self.draft_size = (size[0] * draft_factor, size[1] * draft_factor)
+		std_tensor = torch.tensor(std, dtype=torch.float32).view(3, 1, 1)
+		mean_tensor = torch.tensor(mean, dtype=torch.float32).view(3, 1, 1)
+		# (x / 255 - mean) / std == x * scale + bias
+		self._scale = 1.0 / (255.0 * std_tensor)
+		self._bias = -mean_tensor / std_tensor
+
+	def decode(self, image_bytes: Buffer, resize: bool = True) -> Image.Image:
+		"""RGB image at the output size; `resize=False` stops after the draft decode (for cropping first)."""
+		pil_image = open_image(image_bytes)
+		if pil_image.format == "JPEG":
+			pil_image.draft("RGB", self.draft_size)
+		pil_image = pil_image.convert("RGB")
+		if not resize:
+			return pil_image
+		# PIL sizes are (width, height); torchvision's Resize takes (height, width).
+		target = (self.size[1], self.size[0])
+		if pil_image.size != target:
+			pil_image = pil_image.resize(target, Image.BILINEAR)
+		return pil_image
+
+	def to_tensor(self, pil_image: Image.Image, out: torch.Tensor | None = None) -> torch.Tensor:
+		return self.normalize(torch.from_numpy(np.asarray(pil_image, dtype=np.uint8)).permute(2, 0, 1), out=out)
+
+	def normalize(self, pixels: torch.Tensor, out: torch.Tensor | None = None) -> torch.Tensor:
+		"""uint8 (..., 3, H, W) pixels, any strides, to normalized float32 in `out` (contiguous by default)."""
+		if out is None:
+			out = torch.empty(pixels.shape, dtype=torch.float32)
+		return torch.addcmul(self._bias, pixels, self._scale, out=out)
+
+	def __call__(self, image_bytes: Buffer, out: torch.Tensor | None = None) -> torch.Tensor:
+		return self.to_tensor(self.decode(image_bytes), out=out)
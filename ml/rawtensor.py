@@ -0,0 +1,84 @@
+"""Wire format of `/predict/raw`: pre-resized uint8 RGB pixels.
+
+Clients that already resize on the device (the Android app) send the pixels
+instead of re-encoding them as a JPEG; the service skips the decode and resize
+and only normalizes them. One body holds a small header and the pixels of one
+or more images, all integers little endian:
+
+	offset   size  field
+	0        4     magic b"KMRT"
+	4        2     count: images in the body (1 or more)
+	6        2     height
+	8        2     width
+	10       2     channels, always 3 (RGB)
+	12       2     length L of the model version that follows
+	14       L     model version, UTF-8: the artefact file name listed by
+	               `/admin/models` (and ending `/health`'s model_path), or
+	               empty to accept whatever is served
+	14 + L   ...   count x height x width x channels uint8 pixels, row-major HWC
+
+Height and width must be the model's input size (MODEL_INPUT_SIZE). A named
+model version that is not the one being served is rejected, so clients notice
+a model change that their on-device resize may need to follow.
+"""
+
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+from typing import Any
+
+
+MAGIC = b"KMRT"
+_FIXED = struct.Struct("<4sHHHHH")
+MEDIA_TYPE = "application/vnd.krishi-mitra.raw-rgb"
+
+
+class RawTensorError(ValueError):
+	pass
+
+
+@dataclass(frozen=True)
+class RawHeader:
+	count: int
+	height: int
+	width: int
+	channels: int
+	model_version: str
+	# Bytes before the first pixel.
+	size: int
+
+	@property
+	def pixel_bytes(self) -> int:
+		return self.count * self.height * self.width * self.channels
+
+
+def parse_header(body: Any) -> RawHeader:
+	"""Header of a `/predict/raw` body (anything exposing the buffer protocol); checks the body length too."""
+	view = memoryview(body).cast("B")
+	if len(view) < _FIXED.size:
+		raise RawTensorError(f"Body is shorter than the {_FIXED.size}-byte header.")
+	magic, count, height, width, channels, version_length = _FIXED.unpack_from(view)
+	if magic != MAGIC:
+		raise RawTensorError(f"Body does not start with {MAGIC!r}.")
+	if count < 1 or height < 1 or width < 1:
+		raise RawTensorError("Count, height and width must all be positive.")
+	if channels != 3:
+		raise RawTensorError(f"Expected 3 (RGB) channels, got {channels}.")
+	size = _FIXED.size + version_length
+	try:
+		model_version = bytes(view[_FIXED.size:size]).decode("utf-8")
+	except UnicodeDecodeError as exc:
+		raise RawTensorError("Model version is not valid UTF-8.") from exc
+	header = RawHeader(count, height, width, channels, model_version, size)
+	if len(view) != size + header.pixel_bytes:
+		raise RawTensorError(f"Expected {size + header.pixel_bytes} bytes for {count} {height}x{width} image(s), got {len(view)}.")
+	return header
+
+
+def encode(pixels: Any, model_version: str = "") -> bytes:
+	"""Body for `pixels`, a C-contiguous uint8 (H, W, 3) or (N, H, W, 3) array (e.g. numpy)."""
+	shape = tuple(pixels.shape)
+	count, (height, width, channels) = (1, shape) if len(shape) == 3 else (shape[0], shape[1:])
+	version = model_version.encode("utf-8")
+	return _FIXED.pack(MAGIC, count, height, width, channels, len(version)) + version + memoryview(pixels).cast("B").tobytes()
@@ -0,0 +1,307 @@
+"""Named model slots with background hot reload for the inference service.
+
+A slot is either the default model (`MODEL_PATH`, or the preferred artefact in
+`MODEL_DIR`) or a per-crop model kept in a `MODEL_DIR/<crop_type>/` subdirectory
+next to its own optional `classes.json`. Crop slots are named by their
+directory in lower case (requests lowercase `crop_type` the same way), so
+`MODEL_DIR/Tomato/` serves `crop_type=tomato`. Every .pt/.pth/.onnx file in a
+slot's directory is one of its versions.
+
+`ModelRegistry.poll()` runs every `watch_interval` seconds on a daemon thread.
+It compares each slot's wanted artefact (a pinned version, otherwise the
+preferred file name) against the active one by path and mtime. A new artefact
+is loaded and warmed off the request path, then swapped in with a single
+assignment. Requests hold the model they started on through `use()`, and a
+replaced model is only retired (`on_retire`) after its last request finishes.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Sequence
+
+from cache import model_identity
+
+
+DEFAULT_SLOT = "default"
+ARTEFACT_SUFFIXES = (".pt", ".pth", ".onnx")
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+	slot: str
+	path: Path
+	class_map_path: Path
+
+	@property
+	def label(self) -> str:
+		return self.path.name if self.slot == DEFAULT_SLOT else f"{self.slot}/{self.path.name}"
+
+
+@dataclass(eq=False)
+class LoadedModel:
+	spec: ModelSpec
+	identity: str
+	model: Any
+	class_metadata: List[Dict[str, Any]]
+	class_names: List[str]
+	memory_bytes: int
+	load_seconds: float = 0.0
+	warmup_seconds: float = 0.0
+	loaded_at: float = field(default_factory=time.time)
+	batcher: Any = None
+	responses: Any = None
+	embed: Any = None
+	users: int = 0
+	retired: bool = False
+
+	@property
+	def label(self) -> str:
+		return self.spec.label
+
+	def describe(self) -> Dict[str, Any]:
+		return {
+			"version": self.spec.path.name,
+			"model_path": str(self.spec.path),
+			"identity": self.identity,
+			"num_classes": len(self.class_metadata),
+			"memory_bytes": self.memory_bytes,
+			"load_seconds": round(self.load_seconds, 3),
+			"warmup_seconds": round(self.warmup_seconds, 3),
+			"loaded_at": self.loaded_at,
+			"in_flight": self.users,
+		}
+
+
+def _artefacts(directory: Path) -> List[Path]:
+	if not directory.is_dir():
+		return []
+	return sorted(path for path in directory.iterdir() if path.is_file() and path.suffix in ARTEFACT_SUFFIXES)
+
+
+class ModelRegistry:
+	def __init__(
+		self,
+		loader: Callable[[ModelSpec], LoadedModel],
+		model_dir: Path,
+		default_path: Path,
+		default_class_map: Path,
+		preferred_names: Sequence[str],
+		watch_interval: float = 0.0,
+		on_swap: Callable[[LoadedModel, LoadedModel | None], None] | None = None,
+		on_retire: Callable[[LoadedModel], None] | None = None,
+	) -> None:
+		self.loader = loader
+		self.model_dir = model_dir
+		self.default_path = default_path
+		self.default_class_map = default_class_map
+		self.preferred_names = list(preferred_names)
+		self.watch_interval = watch_interval
+		self.on_swap = on_swap
+		self.on_retire = on_retire
+
+		self._active: Dict[str, LoadedModel] = {}
+		self._pinned: Dict[str, Path] = {}
+		self._failed: Dict[str, str] = {}
+		self._lock = threading.Lock()
+		self._load_lock = threading.RLock()
+		self._stop = threading.Event()
+		self._thread: threading.Thread | None = None
+
+	# Discovery ---------------------------------------------------------------
+
+	def _crop_dirs(self) -> Dict[str, Path]:
+		# Slot name -> directory; of two names differing only in case, the first in sort order wins.
+		crops: Dict[str, Path] = {}
+		if self.model_dir.is_dir():
+			for path in sorted(self.model_dir.iterdir()):
+				if path.is_dir() and _artefacts(path):
+					crops.setdefault(path.name.lower(), path)
+		return crops
+
+	def _slot_dir(self, slot: str) -> Path:
+		if slot == DEFAULT_SLOT:
+			return self.model_dir
+		return self._crop_dirs().get(slot, self.model_dir / slot)
+
+	def slots(self) -> List[str]:
+		return [DEFAULT_SLOT, *self._crop_dirs()]
+
+	def versions(self, slot: str) -> List[Path]:
+		paths = _artefacts(self._slot_dir(slot))
+		if slot == DEFAULT_SLOT and self.default_path not in paths:
+			paths.insert(0, self.default_path)
+		return paths
+
+	def wanted(self, slot: str) -> ModelSpec | None:
+		directory = self._slot_dir(slot)
+		path = self._pinned.get(slot)
+		if path is None and slot == DEFAULT_SLOT:
+			path = self.default_path
+		if path is None:
+			candidates = [directory / name for name in self.preferred_names if (directory / name).exists()]
+			if not candidates:
+				# Otherwise the most recently written artefact wins.
+				candidates = sorted(_artefacts(directory), key=lambda item: item.stat().st_mtime_ns, reverse=True)
+			if not candidates:
+				return None
+			path = candidates[0]
+
+		class_map = self.default_class_map if slot == DEFAULT_SLOT else directory / "classes.json"
+		return ModelSpec(slot, path, class_map)
+
+	# Lookup ------------------------------------------------------------------
+
+	def get(self, slot: str | None = None) -> LoadedModel | None:
+		with self._lock:
+			return self._active.get(slot or DEFAULT_SLOT) or self._active.get(DEFAULT_SLOT)
+
+	def entries(self) -> List[LoadedModel]:
+		with self._lock:
+			return list(self._active.values())
+
+	@contextmanager
+	def use(self, slot: str | None = None) -> Iterator[LoadedModel | None]:
+		"""Pin the active model of `slot` (falling back to the default) for one request."""
+		with self._lock:
+			entry = self._active.get(slot or DEFAULT_SLOT) or self._active.get(DEFAULT_SLOT)
+			if entry is not None:
+				entry.users += 1
+		try:
+			yield entry
+		finally:
+			if entry is not None:
+				with self._lock:
+					entry.users -= 1
+					retire = entry.retired and entry.users == 0
+				if retire:
+					self._retire(entry)
+
+	# Loading -----------------------------------------------------------------
+
+	def _retire(self, entry: LoadedModel) -> None:
+		if self.on_retire is not None:
+			self.on_retire(entry)
+
+	def swap(self, entry: LoadedModel) -> LoadedModel | None:
+		with self._lock:
+			previous = self._active.get(entry.spec.slot)
+			self._active[entry.spec.slot] = entry
+			retire = False
+			if previous is not None:
+				previous.retired = True
+				retire = previous.users == 0
+		if self.on_swap is not None:
+			self.on_swap(entry, previous)
+		if retire:
+			self._retire(previous)  # type: ignore[arg-type]
+		return previous
+
+	def refresh(self, slot: str, force: bool = False, strict: bool = False) -> LoadedModel | None:
+		"""Load and swap in the wanted artefact of `slot` if it differs from the active one."""
+		with self._load_lock:
+			spec = self.wanted(slot)
+			if spec is None:
+				if strict:
+					raise FileNotFoundError(f"No model artefact found for '{slot}' in {self._slot_dir(slot)}")
+				return None
+
+			identity = model_identity(spec.path)
+			current = self._active.get(slot)
+			if not force and current is not None and current.identity == identity and current.spec == spec:
+				return current
+			if not (strict or force) and self._failed.get(slot) == identity:
+				# Retried once the file changes again (e.g. a copy that was still being written).
+				return current
+
+			try:
+				entry = self.loader(spec)
+			except Exception as exc:  # pylint: disable=broad-except
+				self._failed[slot] = identity
+				if strict:
+					raise
+				print(f"❌ Failed to load {spec.path} for '{slot}', keeping the current model: {exc}")
+				return current
+
+			self._failed.pop(slot, None)
+			self.swap(entry)
+			print(f"✅ Model '{slot}' now serving {spec.path} ({entry.memory_bytes / 2**20:.1f} MiB, loaded in {entry.load_seconds:.2f}s, warmed in {entry.warmup_seconds:.2f}s)")
+			return entry
+
+	def activate(self, slot: str, version: str | None) -> LoadedModel:
+		"""Pin `slot` to one of its versions (by file name) or, with None, go back to the preferred one."""
+		if slot not in self.slots():
+			raise KeyError(f"Unknown model slot '{slot}'")
+		with self._load_lock:
+			previous_pin = self._pinned.get(slot)
+			if version is None:
+				self._pinned.pop(slot, None)
+			else:
+				matches = [path for path in self.versions(slot) if path.name == version]
+				if not matches:
+					raise KeyError(f"Unknown version '{version}' for model slot '{slot}'")
+				self._pinned[slot] = matches[0]
+			try:
+				return self.refresh(slot, strict=True)  # type: ignore[return-value]
+			except Exception:
+				if previous_pin is None:
+					self._pinned.pop(slot, None)
+				else:
+					self._pinned[slot] = previous_pin
+				raise
+
+	def poll(self) -> None:
+		for slot in self.slots():
+			self.refresh(slot)
+
+	# Watching ----------------------------------------------------------------
+
+	def start(self) -> None:
+		if self.watch_interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+		self._thread.start()
+
+	def stop(self) -> None:
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join(timeout=5.0)
+			self._thread = None
+
+	def _watch(self) -> None:
+		while not self._stop.wait(self.watch_interval):
+			try:
+				self.poll()
+			except Exception as exc:  # pylint: disable=broad-except
+				print(f"❌ Model watcher error: {exc}")
+
+	def describe(self) -> Dict[str, Any]:
+		with self._lock:
+			active_models = dict(self._active)
+		slots = {}
+		for slot in self.slots():
+			active = active_models.get(slot)
+			pinned = self._pinned.get(slot)
+			slots[slot] = {
+				"active": active.describe() if active is not None else None,
+				"pinned": pinned.name if pinned is not None else None,
+				"versions": [
+					{
+						"version": path.name,
+						"size_bytes": path.stat().st_size if path.exists() else None,
+						"active": active is not None and active.spec.path == path,
+					}
+					for path in self.versions(slot)
+				],
+			}
+		return {
+			"model_dir": str(self.model_dir),
+			"watch_interval": self.watch_interval,
+			"total_memory_bytes": sum(entry.memory_bytes for entry in active_models.values()),
+			"slots": slots,
+		}
@@ -0,0 +1,114 @@
+"""JSON rendering for prediction and metadata responses.
+
+A full prediction embeds the metadata entry (treatments, remedies, ...) of every
+top-k class. `ResponseTable` serializes those entries once when a model is
+loaded, into per-class byte fragments. Rendering a response then only
+concatenates fragments around the freshly formatted scores, instead of walking
+the same nested dicts through a generic encoder on every request.
+
+Clients that keep a copy of `/metadata` can ask for compact responses (see
+`wants_compact`) that carry class ids and scores only:
+
+	{"class_id": 12, "confidence": 0.93, "top_k": [[12, 0.93], [4, 0.05], [7, 0.01]],
+	 "metadata_etag": "\"3f2c...\"", "crop_type": "tomato", "model": "plant_disease_model.pt"}
+
+`metadata_etag` is the `ETag` of the matching `/metadata` body, so a client
+knows when its cached class table has to be refreshed (`If-None-Match` gets a
+304 while it is current).
+
+orjson is used when it is installed; otherwise the stdlib encoder produces the
+same bytes that FastAPI's `JSONResponse` would.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any, Dict, List, Sequence
+
+from starlette.requests import Request
+
+try:
+	import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+	orjson = None  # type: ignore[assignment]
+
+
+COMPACT_MEDIA_TYPE = "application/vnd.krishi-mitra.compact+json"
+_TRUE = {"1", "true", "yes", "on"}
+
+
+def dumps(payload: Any) -> bytes:
+	if orjson is not None:
+		return orjson.dumps(payload)
+	return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _members(fields: Dict[str, Any]) -> bytes:
+	# `{"a":1,"b":2}` -> `"a":1,"b":2`, for splicing into a hand-assembled object.
+	return dumps(fields)[1:-1] if fields else b""
+
+
+def _number(score: float) -> bytes:
+	return repr(float(score)).encode("ascii")
+
+
+def wants_compact(request: Request) -> bool:
+	"""`?compact=true` or an Accept header naming COMPACT_MEDIA_TYPE selects compact responses."""
+	flag = request.query_params.get("compact")
+	if flag is not None:
+		return flag.lower() in _TRUE
+	return COMPACT_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+class ResponseTable:
+	"""Pre-serialized pieces of one model's responses, built when the model is loaded."""
+
+	def __init__(self, class_metadata: List[Dict[str, Any]], class_names: List[str], model_arch: str) -> None:
+		self.class_metadata = class_metadata
+		self.metadata_body = dumps({"classes": class_names, "metadata": class_metadata, "model_arch": model_arch})
+		self.metadata_etag = f'"{hashlib.sha256(self.metadata_body).hexdigest()[:32]}"'
+		self._fragments = [self._build(idx) for idx in range(len(class_metadata))]
+
+	def _build(self, idx: int) -> tuple:
+		meta = self.class_metadata[idx] if idx < len(self.class_metadata) else {"label": f"class_{idx}"}
+		label = dumps(meta.get("label", f"class_{idx}"))
+		names = b',"common_name":' + dumps(meta.get("common_name")) + b',"scientific_name":' + dumps(meta.get("scientific_name"))
+		# (primary label, primary names, top_k entry up to the score, top_k entry after the score)
+		return label, names, b'{"label":' + label + b',"score":', names + b',"metadata":' + dumps(meta) + b"}"
+
+	def _fragment(self, idx: int) -> tuple:
+		return self._fragments[idx] if idx < len(self._fragments) else self._build(idx)
+
+	def full(self, top_k: Sequence[Sequence[Any]], lead: Dict[str, Any] | None = None, fields: Dict[str, Any] | None = None) -> bytes:
+		"""The classic response: disease/confidence/names of the best class plus `top_k` with embedded metadata."""
+		first_idx, first_score = top_k[0]
+		label, names, _, _ = self._fragment(int(first_idx))
+		parts = [b"{"]
+		if lead:
+			parts += [_members(lead), b","]
+		parts += [b'"disease":', label, b',"confidence":', _number(first_score), names, b',"top_k":[']
+		for position, (idx, score) in enumerate(top_k):
+			_, _, head, tail = self._fragment(int(idx))
+			parts += [b"," if position else b"", head, _number(score), tail]
+		parts.append(b"]")
+		if fields:
+			parts += [b",", _members(fields)]
+		parts.append(b"}")
+		return b"".join(parts)
+
+	def compact(self, top_k: Sequence[Sequence[Any]], lead: Dict[str, Any] | None = None, fields: Dict[str, Any] | None = None) -> bytes:
+		"""Class ids and scores only, to be resolved against `/metadata` (`metadata_etag`)."""
+		return dumps(
+			{
+				**(lead or {}),
+				"class_id": int(top_k[0][0]),
+				"confidence": float(top_k[0][1]),
+				"top_k": [[int(idx), float(score)] for idx, score in top_k],
+				"metadata_etag": self.metadata_etag,
+				**(fields or {}),
+			}
+		)
+
+	def render(self, top_k: Sequence[Sequence[Any]], compact: bool, lead: Dict[str, Any] | None = None, fields: Dict[str, Any] | None = None) -> bytes:
+		return self.compact(top_k, lead, fields) if compact else self.full(top_k, lead, fields)
@@ -0,0 +1,121 @@
+"""Bulk-build the similar-case embedding index served by `/similar`.
+
+Every image of an ImageFolder (the training set by default) is run through the
+serving model once; the pooled features in front of its classifier are the
+embeddings (see `embedding_head` in embedding_index.py). PCA, quantization
+scales and list centroids are fitted on a random `--train-sample` of them,
+then all images are added under their path relative to `--data-dir` with
+their class index as label, and the index is compacted.
+
+Build it with the artefact the service loads by default, and rebuild it when
+that model changes: embeddings of different weights are not comparable.
+
+Usage (from the `ml/` directory):
+    python routes/build_index.py --model models/best_model.pth --data-dir data/train --output models/similar_index
+"""
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+from torchvision import datasets
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from embedding_index import EmbeddingIndex, embedding_head  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def load_model(path):
+    if path.suffix == '.pt':
+        return torch.jit.load(str(path), map_location='cpu').eval()
+    from export import load_checkpoint_model
+    return load_checkpoint_model(path)
+
+
+def embed_batches(head, dataset, batch_size, workers, device):
+    """Yields (embeddings, labels, dataset indices) per batch"""
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=workers,
+                        pin_memory=device.type == 'cuda')
+    position = 0
+    with torch.no_grad():
+        for images, labels in loader:
+            _, embeddings = head(images.to(device))
+            yield embeddings.float().cpu().numpy(), labels.numpy(), np.arange(position, position + len(labels))
+            position += len(labels)
+
+
+def add_batches(index, batches, keys):
+    if not batches:
+        return
+    positions = np.concatenate([positions for _, _, positions in batches])
+    index.add(np.concatenate([embeddings for embeddings, _, _ in batches]),
+              np.concatenate([labels for _, labels, _ in batches]).tolist(),
+              [keys[position] for position in positions])
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    base_dir = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description='Build the /similar embedding index from an ImageFolder')
+    parser.add_argument('--model', type=Path, default=base_dir / 'models' / 'best_model.pth',
+                        help='Training checkpoint / state_dict (.pth) or TorchScript model (.pt)')
+    parser.add_argument('--data-dir', type=Path, default=base_dir / 'data' / 'train')
+    parser.add_argument('--output', type=Path, default=base_dir / 'models' / 'similar_index')
+    parser.add_argument('--dim', type=int, default=128, help='PCA dimensions kept per vector')
+    parser.add_argument('--nlist', type=int, default=None, help='Inverted lists (default: 4 x sqrt(train sample))')
+    parser.add_argument('--train-sample', type=int, default=50000, help='Images the PCA and centroids are fitted on')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    from predict import val_transforms
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = load_model(args.model).to(device)
+    head = embedding_head(model)
+    if head is None:
+        sys.exit(f'{args.model} does not expose its penultimate features; use a .pth checkpoint or the fp32 TorchScript export')
+
+    dataset = datasets.ImageFolder(args.data_dir, transform=val_transforms)
+    keys = [str(Path(path).relative_to(args.data_dir)) for path, _ in dataset.samples]
+    start = time.time()
+
+    # Small datasets are embedded once and kept; large ones embed the training sample separately.
+    sample_size = min(args.train_sample, len(dataset))
+    if sample_size == len(dataset):
+        cached = list(embed_batches(head, dataset, args.batch_size, args.workers, device))
+        sample = np.concatenate([embeddings for embeddings, _, _ in cached])
+    else:
+        indices = np.random.default_rng(0).choice(len(dataset), sample_size, replace=False)
+        subset = Subset(dataset, sorted(indices.tolist()))
+        sample = np.concatenate([embeddings for embeddings, _, _ in embed_batches(head, subset, args.batch_size, args.workers, device)])
+        cached = None
+    logger.info(f"Embedded a training sample of {len(sample)} image(s) ({sample.shape[1]}-d) in {time.time() - start:.1f}s")
+
+    mark = time.time()
+    index = EmbeddingIndex.train(args.output, sample, dim=args.dim, nlist=args.nlist, classes=dataset.classes,
+                                 model=args.model.name)
+    index.compact_rows = len(dataset) + 1  # one compaction at the end instead of one per delta
+    logger.info(f"Fitted PCA to {index.meta['dim']} dims and {index.meta['nlist']} lists in {time.time() - mark:.1f}s")
+
+    mark = time.time()
+    batches = cached if cached is not None else embed_batches(head, dataset, args.batch_size, args.workers, device)
+    pending = []
+    for batch in batches:
+        pending.append(batch)
+        # Every add() is fsynced, so batches are appended a few thousand rows at a time.
+        if sum(len(labels) for _, labels, _ in pending) >= 4096:
+            add_batches(index, pending, keys)
+            pending = []
+    add_batches(index, pending, keys)
+    index.compact()
+    logger.info(f"Indexed {len(index)} image(s) in {time.time() - mark:.1f}s; total {time.time() - start:.1f}s")
+    logger.info(f"Serve it with SIMILAR_INDEX_PATH={args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Pre-decoded, memory-mapped dataset cache for training.
+
+`compile_dataset` decodes every image of an ImageFolder once, resizes it to the
+224x224 that `train_transforms`/`val_transforms` start with, and writes the
+uint8 pixels into fixed-size shards of raw HWC arrays plus a JSON manifest:
+
+    <out_dir>/manifest.json
+    <out_dir>/labels.npy
+    <out_dir>/shard_00000.u8, shard_00001.u8, ...
+
+The manifest records a fingerprint of the source files (relative paths, labels,
+sizes, mtimes; see `dataset_index.fingerprint`), so `load_or_compile` rebuilds
+the cache after an image is edited, replaced or renamed, not only when the
+sample count changes.
+
+`MemmapImageDataset` maps the shards read-only and wraps each sample as a PIL
+image over the mapped pixels, so each epoch only pays for the random
+augmentations (`cached_train_transforms`: `train_transforms` minus its Resize)
+instead of a JPEG decode and resize per sample. The PIL augmentations are kept
+on purpose: on CPU they are several times faster than their tensor versions
+(ColorJitter, RandomRotation).
+
+Usage (from the `ml/` directory):
+    python routes/dataset_cache.py compile --root data/train --out data/cache/train
+    python routes/dataset_cache.py bench --root data/train --cache data/cache/train
+"""
+import argparse
+import bisect
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from torchvision import datasets, transforms
+
+from dataset_index import fingerprint
+from predict import train_transforms, val_transforms
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+
+
+def _without_resize(pipeline):
+    assert isinstance(pipeline.transforms[0], transforms.Resize), "cache replaces the leading Resize"
+    return transforms.Compose(pipeline.transforms[1:])
+
+
+# The cache already holds the Resize((224, 224)) output, so only the rest of each pipeline runs per epoch
+cached_train_transforms = _without_resize(train_transforms)
+cached_val_transforms = _without_resize(val_transforms)
+
+
+class _ResizeToArray:
+    def __init__(self, size):
+        self.size = size
+
+    def __call__(self, image):
+        # Bilinear on PIL, exactly what transforms.Resize((size, size)) does
+        return np.asarray(image.convert('RGB').resize((self.size, self.size), Image.BILINEAR), dtype=np.uint8)
+
+
+def _collate(batch):
+    images, labels = zip(*batch)
+    return np.stack(images), np.asarray(labels, dtype=np.int64)
+
+
+def compile_dataset(root, out_dir, size=224, shard_size=4096, num_workers=4, batch_size=64):
+    """Decode and resize an ImageFolder once into memory-mappable uint8 shards"""
+    root, out_dir = Path(root), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    folder = datasets.ImageFolder(root, transform=_ResizeToArray(size))
+    # Taken before decoding, so a file changed mid-compile leaves the cache stale rather than wrong
+    source_fingerprint = fingerprint(folder.samples, root)
+    loader = DataLoader(folder, batch_size=batch_size, shuffle=False, num_workers=num_workers, collate_fn=_collate)
+
+    total = len(folder)
+    labels = np.empty(total, dtype=np.int64)
+    shards, shard, shard_index, shard_fill, written = [], None, -1, 0, 0
+    start = time.time()
+
+    for images, batch_labels in loader:
+        labels[written:written + len(batch_labels)] = batch_labels
+        offset = 0
+        while offset < len(images):
+            if shard is None or shard_fill == shard.shape[0]:
+                if shard is not None:
+                    shard.flush()
+                shard_index += 1
+                count = min(shard_size, total - written)
+                name = f'shard_{shard_index:05d}.u8'
+                shard = np.memmap(out_dir / name, dtype=np.uint8, mode='w+', shape=(count, size, size, 3))
+                shards.append({'file': name, 'count': count})
+                shard_fill = 0
+            take = min(len(images) - offset, shard.shape[0] - shard_fill)
+            shard[shard_fill:shard_fill + take] = images[offset:offset + take]
+            shard_fill += take
+            offset += take
+            written += take
+    if shard is not None:
+        shard.flush()
+
+    np.save(out_dir / 'labels.npy', labels)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'source': str(root.resolve()),
+        'size': size,
+        'num_samples': total,
+        'fingerprint': source_fingerprint,
+        'classes': folder.classes,
+        'class_to_idx': folder.class_to_idx,
+        'shards': shards,
+    }
+    with open(out_dir / 'manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    elapsed = time.time() - start
+    logger.info(f"Compiled {total} images from {root} into {len(shards)} shards at {out_dir} "
+                f"in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f} images/sec)")
+    return manifest
+
+
+def is_compiled(root, out_dir):
+    """True when out_dir holds a cache built from root's current files (paths, labels, sizes, mtimes)"""
+    manifest_path = Path(out_dir) / 'manifest.json'
+    if not manifest_path.exists():
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('source') != str(Path(root).resolve()):
+        return False
+    return manifest.get('fingerprint') == fingerprint(datasets.ImageFolder(root).samples, root)
+
+
+class MemmapImageDataset(Dataset):
+    """Zero-copy reader for a compiled cache; yields (transform(PIL image), label)"""
+
+    def __init__(self, cache_dir, transform=None):
+        self.cache_dir = Path(cache_dir)
+        with open(self.cache_dir / 'manifest.json') as f:
+            self.manifest = json.load(f)
+        self.transform = transform
+        self.classes = self.manifest['classes']
+        self.class_to_idx = self.manifest['class_to_idx']
+        self.targets = np.load(self.cache_dir / 'labels.npy')
+        self._offsets = np.cumsum([0] + [shard['count'] for shard in self.manifest['shards']]).tolist()
+        self._shards = None  # opened lazily so each DataLoader worker maps its own view
+
+    def __len__(self):
+        return self.manifest['num_samples']
+
+    def _open(self):
+        size = self.manifest['size']
+        self._shards = [
+            np.memmap(self.cache_dir / shard['file'], dtype=np.uint8, mode='r', shape=(shard['count'], size, size, 3))
+            for shard in self.manifest['shards']
+        ]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+    def __getitem__(self, index):
+        if self._shards is None:
+            self._open()
+        shard = bisect.bisect_right(self._offsets, index) - 1
+        image = Image.fromarray(self._shards[shard][index - self._offsets[shard]])
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, int(self.targets[index])
+
+
+def load_or_compile(root, cache_dir, transform, num_workers=4):
+    """Return a MemmapImageDataset for root, compiling the cache first if it is missing or stale"""
+    if not is_compiled(root, cache_dir):
+        compile_dataset(root, cache_dir, num_workers=num_workers)
+    return MemmapImageDataset(cache_dir, transform=transform)
+
+
+def measure_epoch(dataset, batch_size=64, num_workers=4, max_batches=None):
+    """Time one pass of a DataLoader over dataset; returns (seconds, images/sec)"""
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+    start, seen = time.time(), 0
+    for step, (images, _) in enumerate(loader):
+        seen += images.size(0)
+        if max_batches and step + 1 >= max_batches:
+            break
+    elapsed = time.time() - start
+    return elapsed, seen / max(elapsed, 1e-9)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Compile or benchmark the memory-mapped training dataset cache')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    compile_cmd = sub.add_parser('compile', help='Decode and resize an ImageFolder into shards')
+    compile_cmd.add_argument('--root', type=Path, required=True)
+    compile_cmd.add_argument('--out', type=Path, required=True)
+    compile_cmd.add_argument('--size', type=int, default=224)
+    compile_cmd.add_argument('--shard-size', type=int, default=4096)
+    compile_cmd.add_argument('--workers', type=int, default=4)
+
+    bench_cmd = sub.add_parser('bench', help='Compare one epoch of ImageFolder vs the compiled cache')
+    bench_cmd.add_argument('--root', type=Path, required=True)
+    bench_cmd.add_argument('--cache', type=Path, required=True)
+    bench_cmd.add_argument('--batch-size', type=int, default=64)
+    bench_cmd.add_argument('--workers', type=int, default=4)
+    bench_cmd.add_argument('--max-batches', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'compile':
+        compile_dataset(args.root, args.out, args.size, args.shard_size, args.workers)
+        return
+
+    if not is_compiled(args.root, args.cache):
+        compile_dataset(args.root, args.cache, num_workers=args.workers)
+    folder_time, folder_ips = measure_epoch(datasets.ImageFolder(args.root, transform=train_transforms),
+                                            args.batch_size, args.workers, args.max_batches)
+    cache_time, cache_ips = measure_epoch(MemmapImageDataset(args.cache, transform=cached_train_transforms),
+                                          args.batch_size, args.workers, args.max_batches)
+    logger.info(f"ImageFolder + PIL transforms: {folder_time:.2f}s/epoch, {folder_ips:.1f} images/sec")
+    logger.info(f"Memmap cache + augmentations only: {cache_time:.2f}s/epoch, {cache_ips:.1f} images/sec")
+    logger.info(f"Speedup: {cache_ips / max(folder_ips, 1e-9):.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Content-hash index of the training ImageFolder for incremental retraining.
+
+`DatasetIndex` records the SHA-256 of every image under the training directory
+and which of those hashes a completed training run has already learned from:
+
+    <save_dir>/dataset_index.json   {"version", "root", "classes",
+                                     "files": {relative path: [sha256, size, mtime_ns]},
+                                     "trained": [sha256, ...]}
+
+Rescans only re-hash files whose size or mtime changed, so after the first scan
+a weekly run reads the bytes of the new uploads alone. Identity is the content
+hash, so images that were renamed, moved or uploaded twice are not new.
+
+`plan_incremental` picks the samples an incremental run trains on: every image
+whose hash is not trained yet, plus a class-stratified random replay buffer of
+already trained images (at least one per class) so the fine-tune does not forget
+the rest of the corpus.
+
+`fingerprint` is the cheap identity of a file list (paths, labels, sizes and
+mtimes; nothing is read), used to tell whether a checkpoint or compiled cache
+still matches the images on disk.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(samples, root):
+    """SHA-256 over the relative path, label, size and mtime of every ImageFolder sample"""
+    digest = hashlib.sha256()
+    for path, label in samples:
+        stat = os.stat(path)
+        digest.update(f'{os.path.relpath(path, root)}\0{label}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+class DatasetIndex:
+    def __init__(self, path, root):
+        self.path = Path(path)
+        self.root = Path(root)
+        self.files = {}
+        self.trained = set()
+        self.classes = []
+        if self.path.exists():
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION and data.get('root') == str(self.root.resolve()):
+                self.files = data['files']
+                self.trained = set(data['trained'])
+                self.classes = data['classes']
+            else:
+                logger.warning(f"Ignoring {self.path}: built for another dataset root or format")
+
+    def scan(self, samples, classes, workers=8):
+        """Hash the ImageFolder `samples` ((path, label) pairs), reusing hashes of unchanged files"""
+        start = time.time()
+        current, stale = {}, []
+        for path, _ in samples:
+            relative = os.path.relpath(path, self.root)
+            stat = os.stat(path)
+            known = self.files.get(relative)
+            if known is not None and known[1] == stat.st_size and known[2] == stat.st_mtime_ns:
+                current[relative] = known
+            else:
+                stale.append((relative, path, stat))
+        # hashlib releases the GIL on large updates, so threads hash in parallel
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (relative, _, stat), digest in zip(stale, pool.map(file_sha256, [path for _, path, _ in stale])):
+                current[relative] = [digest, stat.st_size, stat.st_mtime_ns]
+        self.files = current
+        self.classes = list(classes)
+        logger.info(f"Indexed {len(current)} training images ({len(stale)} hashed) in {time.time() - start:.1f}s")
+
+    def sha256(self, path):
+        return self.files[os.path.relpath(path, self.root)][0]
+
+    def mark_trained(self, hashes=None):
+        """Record `hashes` (default: every indexed file) as learned by a completed run"""
+        self.trained.update(hashes if hashes is not None else (entry[0] for entry in self.files.values()))
+
+    def save(self):
+        temporary = self.path.with_suffix('.tmp')
+        with open(temporary, 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'root': str(self.root.resolve()),
+                'classes': self.classes,
+                'files': self.files,
+                'trained': sorted(self.trained),
+            }, f)
+        os.replace(temporary, self.path)
+
+
+def plan_incremental(index, samples, num_classes, replay_samples, seed=0):
+    """(new sample indices, replay sample indices) into `samples` for an incremental run"""
+    new, old, seen = [], [], set()
+    for position, (path, _) in enumerate(samples):
+        digest = index.sha256(path)
+        if digest in index.trained:
+            old.append(position)
+        elif digest not in seen:
+            # Duplicate uploads of one new image are trained on once
+            seen.add(digest)
+            new.append(position)
+
+    rng = np.random.default_rng(seed)
+    labels = np.asarray([samples[position][1] for position in old], dtype=np.int64)
+    replay = []
+    for label in range(num_classes):
+        members = np.asarray(old, dtype=np.int64)[labels == label]
+        if len(members) == 0:
+            continue
+        share = max(1, round(replay_samples * len(members) / max(len(old), 1)))
+        replay.extend(rng.choice(members, min(share, len(members)), replace=False).tolist())
+    return new, sorted(replay)
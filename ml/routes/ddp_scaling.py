@@ -0,0 +1,157 @@
+"""Epoch time vs process count for DDP training on one machine.
+
+`report` launches `torch.distributed.run --standalone` once per process count.
+Each launch runs `worker`, which trains MobileNetV2 for a few epochs with the
+same DistributedSampler/DDP helpers and all-reduced metrics that `predict.main`
+uses under torchrun. Rank 0 records the timings. The global batch stays fixed,
+so each rank gets `batch_size / nproc` images per step; only the wall-clock
+time per epoch should change. Results go to `<reports_dir>/ddp_scaling.json`
+and a markdown table in `<reports_dir>/ddp_scaling.md`.
+
+Usage (from the `ml/` directory):
+    python routes/ddp_scaling.py report --train-dir data/train --val-dir data/valid --procs 1 2 4
+    torchrun --standalone --nproc_per_node 4 routes/predict.py     # the real training run
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import Subset
+from torchvision import datasets, models
+
+from predict import (build_loaders, reduce_epoch_metrics, setup_distributed, train_epoch, train_transforms,
+                     val_transforms, validate_epoch, wrap_for_training)
+
+logger = logging.getLogger(__name__)
+
+
+def _subset(dataset, limit):
+    return Subset(dataset, range(min(limit, len(dataset)))) if limit else dataset
+
+
+def run_worker(args):
+    """One torchrun rank: train `args.epochs` epochs and (on rank 0) write the timings to args.out"""
+    rank, world_size = setup_distributed()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    train_folder = datasets.ImageFolder(args.train_dir, transform=train_transforms)
+    train_dataset = _subset(train_folder, args.max_images)
+    val_dataset = _subset(datasets.ImageFolder(args.val_dir, transform=val_transforms), args.max_images)
+    train_loader, val_loader, train_sampler = build_loaders(
+        train_dataset, val_dataset, max(1, args.batch_size // world_size), args.workers, world_size)
+
+    # Random init: the timing is the same as ImageNet weights and needs no download
+    model = models.mobilenet_v2(weights=None)
+    model.classifier[1] = nn.Linear(model.classifier[1].in_features, len(train_folder.classes))
+    for param in model.features[:-4].parameters():
+        param.requires_grad = False  # the fine-tune phase of predict.main
+    model = model.to(device)
+    train_model = wrap_for_training(model, world_size)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.AdamW(filter(lambda p: p.requires_grad, model.parameters()), lr=1e-4)
+
+    epochs = []
+    for epoch in range(args.epochs):
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+            dist.barrier()
+        start = time.time()
+        train_loss, train_acc = train_epoch(train_model, train_loader, criterion, optimizer, device)
+        if world_size > 1:
+            dist.barrier()  # the epoch ends when the slowest rank finishes
+        train_seconds = time.time() - start
+        val_loss, val_acc = validate_epoch(model, val_loader, criterion, device)
+        val_acc = reduce_epoch_metrics(val_loss, val_acc, len(val_loader), len(val_loader.sampler))[1]
+        epochs.append({'train_seconds': train_seconds, 'epoch_seconds': time.time() - start, 'val_acc': val_acc})
+
+    if rank == 0:
+        with open(args.out, 'w') as f:
+            json.dump({'procs': world_size, 'threads_per_proc': torch.get_num_threads(),
+                       'images': len(train_dataset), 'epochs': epochs}, f)
+    if world_size > 1:
+        dist.destroy_process_group()
+
+
+def run_report(args):
+    """Launch one torchrun job per process count and tabulate epoch time, speedup and efficiency"""
+    args.reports_dir.mkdir(parents=True, exist_ok=True)
+    results = []
+    for procs in args.procs:
+        with tempfile.TemporaryDirectory() as tmp:
+            out = Path(tmp) / 'result.json'
+            command = [
+                sys.executable, '-m', 'torch.distributed.run', '--standalone', f'--nproc_per_node={procs}',
+                str(Path(__file__).resolve()), 'worker', '--out', str(out),
+                '--train-dir', str(args.train_dir), '--val-dir', str(args.val_dir),
+                '--epochs', str(args.epochs), '--batch-size', str(args.batch_size),
+                '--workers', str(args.workers), '--max-images', str(args.max_images),
+            ]
+            logger.info(f"Running {procs} process(es)...")
+            subprocess.run(command, check=True, env={**os.environ, 'PYTHONPATH': str(Path(__file__).parent)})
+            with open(out) as f:
+                result = json.load(f)
+        # The first epoch includes DataLoader worker start-up and allocator warm-up
+        steady = result['epochs'][1:] or result['epochs']
+        result['train_seconds'] = sum(e['train_seconds'] for e in steady) / len(steady)
+        result['epoch_seconds'] = sum(e['epoch_seconds'] for e in steady) / len(steady)
+        result['images_per_sec'] = result['images'] / result['train_seconds']
+        results.append(result)
+
+    baseline = results[0]
+    for result in results:
+        result['speedup'] = baseline['train_seconds'] / result['train_seconds']
+        result['efficiency'] = result['speedup'] * baseline['procs'] / result['procs']
+
+    report = {'cpu_count': os.cpu_count(), 'batch_size': args.batch_size, 'results': results}
+    with open(args.reports_dir / 'ddp_scaling.json', 'w') as f:
+        json.dump(report, f, indent=2)
+
+    lines = [
+        f"# DDP scaling (gloo, {os.cpu_count()} CPUs, global batch {args.batch_size}, {baseline['images']} images)",
+        '',
+        '| processes | threads/proc | train s/epoch | epoch s (incl. val) | images/sec | speedup | efficiency |',
+        '|---|---|---|---|---|---|---|',
+    ]
+    for r in results:
+        lines.append(f"| {r['procs']} | {r['threads_per_proc']} | {r['train_seconds']:.2f} | {r['epoch_seconds']:.2f} | "
+                     f"{r['images_per_sec']:.1f} | {r['speedup']:.2f}x | {r['efficiency'] * 100:.0f}% |")
+    (args.reports_dir / 'ddp_scaling.md').write_text('\n'.join(lines) + '\n')
+    logger.info('\n' + '\n'.join(lines))
+    return report
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    base_dir = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description='Measure DDP epoch time against the number of processes')
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('report', 'worker'):
+        cmd = sub.add_parser(name)
+        cmd.add_argument('--train-dir', type=Path, default=base_dir / 'data' / 'train')
+        cmd.add_argument('--val-dir', type=Path, default=base_dir / 'data' / 'valid')
+        cmd.add_argument('--epochs', type=int, default=2)
+        cmd.add_argument('--batch-size', type=int, default=64)
+        cmd.add_argument('--workers', type=int, default=2, help='DataLoader workers per process')
+        cmd.add_argument('--max-images', type=int, default=0, help='Only use the first N images (0 = all)')
+    sub.choices['report'].add_argument('--procs', type=int, nargs='+', default=[1, 2, 4])
+    sub.choices['report'].add_argument('--reports-dir', type=Path, default=base_dir / 'reports')
+    sub.choices['worker'].add_argument('--out', type=Path, required=True)
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        run_worker(args)
+    else:
+        run_report(args)
+
+
+if __name__ == "__main__":
+    main()
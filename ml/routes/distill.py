@@ -0,0 +1,339 @@
+"""Knowledge distillation of the trained MobileNetV2 into smaller, faster students.
+
+Students are named `<arch>@<input size>`:
+
+    pooled_cnn@224          ImprovedCNN(pooled=True): the conv stack, global-average-pooled (~0.6M params)
+    mobilenet_v2_0.5@160    torchvision MobileNetV2 with width_mult=0.5, fed 160x160 images
+    mobilenet_v2@128        any width (default 1.0) at any resolution
+
+Teacher logits are computed once and cached next to the data, like the frozen
+backbone features of feature_cache.py:
+
+    <cache_dir>/manifest.json
+    <cache_dir>/teacher_logits.npy   (passes, N, num_classes) float16
+
+The manifest ties the logits to the teacher checkpoint, the seed and the
+training images' file fingerprint (`dataset_index.fingerprint`).
+
+The training set's random augmentation is seeded by (pass, image index), so epoch
+`e` replays augmentation pass `e % passes` image for image and the cached logits
+match what the student sees. Students get the same 224x224 tensors resized to
+their input size and train on
+
+    alpha * T^2 * KL(softmax(teacher / T) || softmax(student / T)) + (1 - alpha) * CE(student, labels)
+
+Each student's best epoch (by validation accuracy at its own input size) is saved
+as `<save_dir>/student_<arch>_<size>.pth`, with `arch`, `width_mult` and
+`input_size` stored next to the weights: `_build_model` in app.py (and
+export.load_checkpoint_model) rebuild the right network from them. Serve a
+student with MODEL_PATH pointing at it and MODEL_INPUT_SIZE set to its input size.
+
+Finally the teacher and every student are scored on the validation set and timed
+on CPU (batch 1, `--latency-threads` intra-op threads), and the table of
+accuracy, parameters, size and latency is written to
+`<reports_dir>/distillation_report.{json,md}`. Rows marked `*` are on the Pareto
+front: no other model is at least as accurate, as fast and as small.
+
+Usage (from the `ml/` directory):
+    python routes/distill.py --teacher models/best_model.pth --students pooled_cnn@224 mobilenet_v2_0.5@160 mobilenet_v2_0.75@192
+"""
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+from torchvision import datasets, transforms
+from tqdm import tqdm
+
+from dataset_index import fingerprint
+from export import build_model, evaluate_accuracy, load_checkpoint_model, measure_latency
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+DEFAULT_STUDENTS = ('pooled_cnn@224', 'mobilenet_v2_0.5@160', 'mobilenet_v2_0.75@192')
+
+
+def parse_student(name):
+    """'mobilenet_v2_0.5@160' -> ('mobilenet_v2', 0.5, 160)"""
+    arch, _, size = name.partition('@')
+    input_size = int(size) if size else 224
+    if arch in ('pooled_cnn', 'improved_cnn'):
+        return arch, 1.0, input_size
+    if arch.startswith('mobilenet_v2'):
+        width = arch[len('mobilenet_v2'):].lstrip('_')
+        return 'mobilenet_v2', float(width) if width else 1.0, input_size
+    raise ValueError(f"Unknown student '{name}'; expected pooled_cnn@<size> or mobilenet_v2[_<width>]@<size>")
+
+
+def student_path(save_dir, name):
+    arch, width_mult, input_size = parse_student(name)
+    return Path(save_dir) / f"student_{arch}{'' if width_mult == 1.0 else f'_{width_mult:g}'}_{input_size}.pth"
+
+
+def load_model(path):
+    if Path(path).suffix == '.pt':
+        return torch.jit.load(str(path), map_location='cpu').eval()
+    return load_checkpoint_model(path)
+
+
+def eval_transforms(input_size):
+    # What the service does with MODEL_INPUT_SIZE: resize straight to the model's input
+    return transforms.Compose([
+        transforms.Resize((input_size, input_size)),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+    ])
+
+
+class SeededPasses(Dataset):
+    """`dataset` with its random augmentation seeded by (seed, pass_index, index); yields (image, label, index)"""
+
+    def __init__(self, dataset, seed=0):
+        self.dataset = dataset
+        self.seed = seed
+        self.pass_index = 0
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        # torchvision transforms draw from torch's global generator (per DataLoader worker)
+        torch.manual_seed(((self.seed * 1_000_003 + self.pass_index) * 1_000_000_007 + index) % 2**63)
+        image, label = self.dataset[index]
+        return image, label, index
+
+
+def cache_teacher_logits(teacher, train_dataset, cache_dir, device, passes, teacher_id, seed=0,
+                         batch_size=128, num_workers=4):
+    """Teacher logits of `passes` seeded augmentation passes over the training set; reuses a matching cache"""
+    cache_dir = Path(cache_dir)
+    expected = {
+        'teacher': teacher_id,
+        'passes': passes,
+        'seed': seed,
+        'num_train': len(train_dataset),
+        'classes': list(train_dataset.classes),
+        # Replaced or relabelled images must not be paired with logits of the old ones
+        'data_fingerprint': fingerprint(train_dataset.samples, train_dataset.root),
+    }
+    manifest_path = cache_dir / 'manifest.json'
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION and all(manifest.get(k) == v for k, v in expected.items()):
+            logger.info(f"Reusing teacher logits at {cache_dir}")
+            return np.load(cache_dir / 'teacher_logits.npy', mmap_mode='r')
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path.unlink(missing_ok=True)
+    logits = np.lib.format.open_memmap(cache_dir / 'teacher_logits.npy', mode='w+', dtype=np.float16,
+                                       shape=(passes, len(train_dataset), len(train_dataset.classes)))
+    seeded = SeededPasses(train_dataset, seed)
+    teacher.eval()
+    start = time.time()
+    with torch.no_grad():
+        for pass_index in range(passes):
+            seeded.pass_index = pass_index
+            loader = DataLoader(seeded, batch_size=batch_size, shuffle=False, num_workers=num_workers,
+                                pin_memory=device.type == 'cuda')
+            for images, _, indices in tqdm(loader, desc=f"Teacher pass {pass_index + 1}/{passes}", leave=False):
+                logits[pass_index, indices.numpy()] = teacher(images.to(device)).float().cpu().numpy()
+    logits.flush()
+
+    # Written last, so an interrupted build is never mistaken for a complete one
+    with open(manifest_path, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, **expected}, f, indent=2)
+    logger.info(f"Cached teacher logits for {passes} x {len(train_dataset)} images in {time.time() - start:.1f}s")
+    return np.load(cache_dir / 'teacher_logits.npy', mmap_mode='r')
+
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature=4.0, alpha=0.7):
+    soft = F.kl_div(F.log_softmax(student_logits / temperature, dim=1), F.softmax(teacher_logits / temperature, dim=1),
+                    reduction='batchmean') * temperature ** 2
+    return alpha * soft + (1 - alpha) * F.cross_entropy(student_logits, labels)
+
+
+def distill_epoch(student, loader, teacher_logits, input_size, optimizer, device, temperature, alpha):
+    """One epoch over a SeededPasses loader; `teacher_logits` are the (N, C) logits of its pass"""
+    student.train()
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    total = 0
+
+    for images, labels, indices in tqdm(loader, desc="Distilling", leave=False):
+        images, labels = images.to(device, non_blocking=True), labels.to(device, non_blocking=True)
+        if images.shape[-1] != input_size:
+            images = F.interpolate(images, size=(input_size, input_size), mode='bilinear', align_corners=False,
+                                   antialias=True)
+        targets = torch.from_numpy(teacher_logits[indices.numpy()]).to(device).float()
+        optimizer.zero_grad(set_to_none=True)
+        outputs = student(images)
+        loss = distillation_loss(outputs, targets, labels, temperature, alpha)
+        loss.backward()
+        optimizer.step()
+
+        running_loss += loss.detach()
+        correct += (outputs.argmax(1) == labels).sum()
+        total += labels.size(0)
+
+    return running_loss.item() / max(len(loader), 1), correct.item() / max(total, 1)
+
+
+def validation_loader(val_dir, input_size, batch_size, num_workers):
+    dataset = datasets.ImageFolder(val_dir, transform=eval_transforms(input_size))
+    return DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+
+def train_student(name, train_dataset, val_dir, teacher_logits, args, device, teacher_id):
+    arch, width_mult, input_size = parse_student(name)
+    num_classes = len(train_dataset.classes)
+    student = build_model(arch, num_classes, width_mult).to(device)
+    path = student_path(args.save_dir, name)
+    logger.info(f"Distilling {name}: {sum(p.numel() for p in student.parameters()):,} parameters -> {path}")
+
+    seeded = SeededPasses(train_dataset, args.seed)
+    val_loader = validation_loader(val_dir, input_size, args.batch_size, args.workers)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+    best_acc = -1.0
+
+    for epoch in range(args.epochs):
+        seeded.pass_index = epoch % teacher_logits.shape[0]
+        loader = DataLoader(seeded, batch_size=args.batch_size, shuffle=True, num_workers=args.workers,
+                            pin_memory=device.type == 'cuda')
+        train_loss, train_acc = distill_epoch(student, loader, teacher_logits[seeded.pass_index], input_size,
+                                              optimizer, device, args.temperature, args.alpha)
+        scheduler.step()
+        student.eval()
+        val_acc = evaluate_accuracy(lambda images: student(images.to(device)).cpu(), val_loader)
+        logger.info(f"{name} epoch [{epoch + 1}/{args.epochs}] | Loss: {train_loss:.4f}, Train Acc: {train_acc * 100:.2f}% "
+                    f"| Val Acc: {val_acc * 100:.2f}%")
+        if val_acc > best_acc:
+            best_acc = val_acc
+            torch.save({
+                'model_state_dict': student.state_dict(),
+                'arch': arch,
+                'width_mult': width_mult,
+                'input_size': input_size,
+                'num_classes': num_classes,
+                'classes': list(train_dataset.classes),
+                'epoch': epoch,
+                'val_acc': val_acc,
+                'teacher': teacher_id,
+            }, path)
+    return path
+
+
+def pareto_front(rows):
+    """Marks rows that no other row beats or ties on accuracy, p50 latency and parameters at once"""
+    for row in rows:
+        row['pareto'] = not any(
+            other is not row
+            and other['accuracy'] >= row['accuracy'] and other['p50_ms'] <= row['p50_ms'] and other['params'] <= row['params']
+            and (other['accuracy'], other['p50_ms'], other['params']) != (row['accuracy'], row['p50_ms'], row['params'])
+            for other in rows
+        )
+    return rows
+
+
+def score_models(candidates, val_dir, reports_dir, batch_size, num_workers, latency_threads, latency_runs):
+    """candidates: (name, path, input_size); writes the Pareto report and returns its rows"""
+    rows = []
+    threads = torch.get_num_threads()
+    for name, path, input_size in candidates:
+        model = load_model(path)
+        accuracy = evaluate_accuracy(model, validation_loader(val_dir, input_size, batch_size, num_workers))
+        torch.set_num_threads(latency_threads)
+        try:
+            p50, p99 = measure_latency(model, runs=latency_runs, input_size=input_size)
+        finally:
+            torch.set_num_threads(threads)
+        rows.append({
+            'model': name,
+            'path': str(path),
+            'input_size': input_size,
+            'params': sum(p.numel() for p in model.parameters()),
+            'size_mb': Path(path).stat().st_size / 2**20,
+            'accuracy': accuracy,
+            'p50_ms': p50,
+            'p99_ms': p99,
+        })
+    pareto_front(rows)
+
+    with open(reports_dir / 'distillation_report.json', 'w') as f:
+        json.dump({'latency_threads': latency_threads, 'models': rows}, f, indent=2)
+    lines = ['| model | input | params | size (MB) | accuracy | p50 ms | p99 ms | pareto |',
+             '| --- | --- | --- | --- | --- | --- | --- | --- |']
+    for row in sorted(rows, key=lambda row: row['p50_ms']):
+        lines.append(
+            f"| {row['model']} | {row['input_size']} | {row['params'] / 1e6:.2f}M | {row['size_mb']:.2f} | "
+            f"{row['accuracy'] * 100:.2f}% | {row['p50_ms']:.2f} | {row['p99_ms']:.2f} | {'*' if row['pareto'] else ''} |"
+        )
+    with open(reports_dir / 'distillation_report.md', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    logger.info(f"Distillation report ({latency_threads} thread(s), batch 1):\n" + '\n'.join(lines))
+    return rows
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    base_dir = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description='Distill the trained classifier into smaller students')
+    parser.add_argument('--teacher', type=Path, default=base_dir / 'models' / 'best_model.pth')
+    parser.add_argument('--students', nargs='+', default=list(DEFAULT_STUDENTS), help='<arch>@<input size> names')
+    parser.add_argument('--train-dir', type=Path, default=base_dir / 'data' / 'train')
+    parser.add_argument('--val-dir', type=Path, default=base_dir / 'data' / 'valid')
+    parser.add_argument('--cache-dir', type=Path, default=base_dir / 'data' / 'teacher_logits')
+    parser.add_argument('--save-dir', type=Path, default=base_dir / 'models')
+    parser.add_argument('--reports-dir', type=Path, default=base_dir / 'reports')
+    parser.add_argument('--passes', type=int, default=5, help='Augmentation passes with cached teacher logits')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--weight-decay', type=float, default=1e-4)
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--alpha', type=float, default=0.7, help='Weight of the soft (teacher) loss')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency-threads', type=int, default=1, help='Intra-op threads while timing (edge-like default)')
+    parser.add_argument('--latency-runs', type=int, default=100)
+    parser.add_argument('--report-only', action='store_true', help='Score existing student checkpoints without training')
+    args = parser.parse_args()
+
+    from predict import train_transforms
+    for name in args.students:
+        parse_student(name)  # fail on a typo before the teacher pass
+    args.save_dir.mkdir(parents=True, exist_ok=True)
+    args.reports_dir.mkdir(parents=True, exist_ok=True)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    stat = args.teacher.stat()
+    teacher_id = f"{args.teacher.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    if args.report_only:
+        paths = {name: student_path(args.save_dir, name) for name in args.students}
+    else:
+        train_dataset = datasets.ImageFolder(args.train_dir, transform=train_transforms)
+        teacher = load_model(args.teacher).to(device)
+        teacher_logits = cache_teacher_logits(teacher, train_dataset, args.cache_dir, device, args.passes, teacher_id,
+                                              args.seed, args.batch_size * 2, args.workers)
+        del teacher
+        paths = {}
+        for name in args.students:
+            start = time.time()
+            paths[name] = train_student(name, train_dataset, args.val_dir, teacher_logits, args, device, teacher_id)
+            logger.info(f"Distilled {name} in {(time.time() - start) / 60:.1f} minutes")
+
+    candidates = [(f"teacher ({args.teacher.name})", args.teacher, 224)]
+    candidates += [(name, path, parse_student(name)[2]) for name, path in paths.items()]
+    score_models(candidates, args.val_dir, args.reports_dir, args.batch_size, args.workers, args.latency_threads,
+                 args.latency_runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Streaming evaluation of one or more classifiers over the validation set.
+
+`StreamingEvaluator` keeps a (C, C) confusion matrix and top-k hit counters on
+the model's device. Each batch adds one `bincount` of `label * C + prediction`,
+so no per-sample predictions are kept on the host. Accuracy, top-k accuracy
+and per-class precision/recall/F1 are all derived from those counts at the
+end.
+
+`evaluate_models` runs several models (e.g. checkpoints of one run) over the
+same batches, so images are decoded and transformed once. `write_reports`
+writes compact artefacts per model:
+
+    <reports_dir>/<prefix>evaluation.json          accuracy, top-k, macro/weighted averages, per-class metrics
+    <reports_dir>/<prefix>per_class_metrics.csv    one row per class
+    <reports_dir>/<prefix>confusion_matrix.csv     raw counts, rows = true label
+    <reports_dir>/<prefix>classification_report.txt
+    <reports_dir>/<prefix>confusion_matrix.png     only with plots=True
+
+Usage (from the `ml/` directory):
+    python routes/evaluate.py --checkpoints models/best_model.pth models/final_model.pth --val-dir data/valid
+"""
+import argparse
+import csv
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torchvision import datasets
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOPK = (1, 3, 5)
+
+
+class StreamingEvaluator:
+    """Confusion matrix and top-k counts accumulated batch by batch on `device`"""
+
+    def __init__(self, num_classes, device, topk=DEFAULT_TOPK):
+        self.num_classes = num_classes
+        self.topk = tuple(k for k in topk if k <= num_classes)
+        self.confusion = torch.zeros(num_classes * num_classes, dtype=torch.long, device=device)
+        self.topk_correct = torch.zeros(len(self.topk), dtype=torch.long, device=device)
+
+    def update(self, logits, labels):
+        preds = logits.argmax(1)
+        self.confusion += torch.bincount(labels * self.num_classes + preds, minlength=self.num_classes ** 2)
+        if self.topk:
+            hits = logits.topk(max(self.topk), dim=1).indices == labels.unsqueeze(1)
+            self.topk_correct += torch.stack([hits[:, :k].any(1).sum() for k in self.topk])
+
+    def confusion_matrix(self):
+        return self.confusion.view(self.num_classes, self.num_classes).cpu().numpy()
+
+    def metrics(self, class_names):
+        """Per-class precision/recall/F1/support plus accuracy, top-k and macro/weighted averages"""
+        cm = self.confusion_matrix().astype(np.float64)
+        tp, support, predicted = np.diag(cm), cm.sum(1), cm.sum(0)
+        total = support.sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.nan_to_num(tp / predicted)
+            recall = np.nan_to_num(tp / support)
+            f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+        weights = support / max(total, 1)
+        topk = self.topk_correct.cpu().numpy() / max(total, 1)
+        return {
+            'num_samples': int(total),
+            'accuracy': float(tp.sum() / max(total, 1)),
+            'topk_accuracy': {f'top{k}': float(acc) for k, acc in zip(self.topk, topk)},
+            'macro_avg': {'precision': float(precision.mean()), 'recall': float(recall.mean()), 'f1': float(f1.mean())},
+            'weighted_avg': {'precision': float(precision @ weights), 'recall': float(recall @ weights),
+                             'f1': float(f1 @ weights)},
+            'per_class': [
+                {'class': name, 'precision': float(p), 'recall': float(r), 'f1': float(f), 'support': int(s)}
+                for name, p, r, f, s in zip(class_names, precision, recall, f1, support)
+            ],
+        }
+
+
+def evaluate_models(models, loader, device, num_classes, topk=DEFAULT_TOPK, memory_format=torch.contiguous_format):
+    """One pass over `loader` feeding every model in the `{name: model}` dict; returns `{name: StreamingEvaluator}`"""
+    evaluators = {name: StreamingEvaluator(num_classes, device, topk) for name in models}
+    for model in models.values():
+        model.eval()
+    with torch.no_grad():
+        for images, labels in loader:
+            images = images.to(device, non_blocking=True, memory_format=memory_format)
+            labels = labels.to(device, non_blocking=True)
+            for name, model in models.items():
+                evaluators[name].update(model(images), labels)
+    return evaluators
+
+
+def format_report(metrics, digits=4):
+    """Plain-text table in the layout of sklearn's classification_report"""
+    width = max(12, *(len(row['class']) for row in metrics['per_class']))
+    header = f"{'':>{width}} {'precision':>9} {'recall':>9} {'f1-score':>9} {'support':>9}"
+    lines = [header, '']
+    for row in metrics['per_class']:
+        lines.append(f"{row['class']:>{width}} {row['precision']:>9.{digits}f} {row['recall']:>9.{digits}f} "
+                     f"{row['f1']:>9.{digits}f} {row['support']:>9}")
+    lines.append('')
+    total = metrics['num_samples']
+    lines.append(f"{'accuracy':>{width}} {'':>9} {'':>9} {metrics['accuracy']:>9.{digits}f} {total:>9}")
+    for key, label in (('macro_avg', 'macro avg'), ('weighted_avg', 'weighted avg')):
+        avg = metrics[key]
+        lines.append(f"{label:>{width}} {avg['precision']:>9.{digits}f} {avg['recall']:>9.{digits}f} "
+                     f"{avg['f1']:>9.{digits}f} {total:>9}")
+    for name, acc in metrics['topk_accuracy'].items():
+        lines.append(f"{name:>{width}} {'':>9} {'':>9} {acc:>9.{digits}f} {total:>9}")
+    return '\n'.join(lines) + '\n'
+
+
+def plot_confusion_matrix(cm, class_names, path, dpi=150):
+    """Row-normalised heatmap; cells are only annotated when the matrix is small enough to read"""
+    import matplotlib.pyplot as plt
+
+    normalised = cm / np.maximum(cm.sum(1, keepdims=True), 1)
+    size = max(6, len(class_names) * 0.3)
+    fig, ax = plt.subplots(figsize=(size * 1.2, size))
+    image = ax.imshow(normalised, cmap='Blues', vmin=0, vmax=1)
+    fig.colorbar(image, ax=ax, fraction=0.046, pad=0.04)
+    ax.set_xticks(range(len(class_names)), class_names, rotation=90, fontsize=6 if len(class_names) > 20 else 8)
+    ax.set_yticks(range(len(class_names)), class_names, fontsize=6 if len(class_names) > 20 else 8)
+    if len(class_names) <= 20:
+        for i, j in zip(*np.nonzero(cm)):
+            ax.text(j, i, int(cm[i, j]), ha='center', va='center', fontsize=7,
+                    color='white' if normalised[i, j] > 0.5 else 'black')
+    ax.set_xlabel('Predicted Label')
+    ax.set_ylabel('True Label')
+    ax.set_title('Confusion Matrix')
+    fig.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+
+def write_reports(evaluator, class_names, reports_dir, prefix='', plots=False):
+    """Write the JSON/CSV/text artefacts (and optionally the heatmap) for one evaluated model; returns the metrics"""
+    reports_dir = Path(reports_dir)
+    reports_dir.mkdir(parents=True, exist_ok=True)
+    metrics = evaluator.metrics(class_names)
+    cm = evaluator.confusion_matrix()
+
+    with open(reports_dir / f'{prefix}evaluation.json', 'w') as f:
+        json.dump(metrics, f, indent=2)
+    with open(reports_dir / f'{prefix}per_class_metrics.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['class', 'precision', 'recall', 'f1', 'support'])
+        writer.writeheader()
+        writer.writerows(metrics['per_class'])
+    with open(reports_dir / f'{prefix}confusion_matrix.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['true\\predicted', *class_names])
+        writer.writerows([name, *row] for name, row in zip(class_names, cm.tolist()))
+    with open(reports_dir / f'{prefix}classification_report.txt', 'w') as f:
+        f.write(format_report(metrics))
+    if plots:
+        plot_confusion_matrix(cm, class_names, reports_dir / f'{prefix}confusion_matrix.png')
+    return metrics
+
+
+def _load_model(path):
+    if path.suffix == '.pt':
+        return torch.jit.load(path, map_location='cpu').eval()
+    from export import load_checkpoint_model
+    return load_checkpoint_model(path)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    base_dir = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description='Evaluate one or more checkpoints in a single pass over the data')
+    parser.add_argument('--checkpoints', type=Path, nargs='+', default=[base_dir / 'models' / 'best_model.pth'],
+                        help='Training checkpoints / state_dicts (.pth) or TorchScript models (.pt)')
+    parser.add_argument('--val-dir', type=Path, default=base_dir / 'data' / 'valid')
+    parser.add_argument('--reports-dir', type=Path, default=base_dir / 'reports')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--topk', type=int, nargs='+', default=list(DEFAULT_TOPK))
+    parser.add_argument('--plots', action='store_true', help='Also render confusion matrix heatmaps')
+    args = parser.parse_args()
+    # Reports are named by file stem, or by file name when two checkpoints share one (best_model.pth/.pt)
+    stems = [path.stem for path in args.checkpoints]
+    names = stems if len(set(stems)) == len(stems) else [path.name for path in args.checkpoints]
+    if len(set(names)) < len(names):
+        parser.error(f"--checkpoints lists the same file name more than once: {', '.join(names)}")
+
+    from predict import val_transforms
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    dataset = datasets.ImageFolder(args.val_dir, transform=val_transforms)
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.workers,
+                        pin_memory=device.type == 'cuda')
+    models = {name: _load_model(path).to(device) for name, path in zip(names, args.checkpoints)}
+
+    start = time.time()
+    evaluators = evaluate_models(models, loader, device, len(dataset.classes), args.topk)
+    logger.info(f"Evaluated {len(models)} model(s) on {len(dataset)} images in {time.time() - start:.1f}s")
+
+    summary = {}
+    for name, evaluator in evaluators.items():
+        prefix = f'{name}_' if len(models) > 1 else ''
+        metrics = write_reports(evaluator, dataset.classes, args.reports_dir, prefix, args.plots)
+        summary[name] = {key: metrics[key] for key in ('accuracy', 'topk_accuracy', 'macro_avg', 'weighted_avg')}
+        logger.info(f"{name}:\n{format_report(metrics)}")
+    if len(models) > 1:
+        with open(args.reports_dir / 'evaluation_summary.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
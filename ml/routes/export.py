@@ -0,0 +1,260 @@
+"""Export the trained classifier into optimized serving variants.
+
+Each variant is written to the model directory under the file name that
+`MODEL_VARIANT` in `ml/app.py` looks for:
+
+    fp32          plant_disease_model.pt               torch.jit.script (what predict.py exports)
+    frozen        plant_disease_model_frozen.pt        torch.jit.freeze (optimize_for_inference at load)
+    int8          plant_disease_model_int8.pt          static INT8, calibrated on validation images
+    int8_dynamic  plant_disease_model_int8_dynamic.pt  dynamic INT8 (Linear layers only)
+    onnx          plant_disease_model.onnx             optional, needs the `onnx` package
+
+Afterwards every variant is evaluated on the validation set and timed on CPU,
+and a report with accuracy delta, file size and p50/p99 latency is written to
+the reports directory.
+
+Usage (from the `ml/` directory):
+    python routes/export.py --checkpoint models/best_model.pth --val-dir data/valid
+"""
+import argparse
+import copy
+import json
+import logging
+import statistics
+import time
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+from torchvision import datasets, models
+
+from predict import val_transforms
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FILENAMES = {
+    'fp32': 'plant_disease_model.pt',
+    'frozen': 'plant_disease_model_frozen.pt',
+    'int8': 'plant_disease_model_int8.pt',
+    'int8_dynamic': 'plant_disease_model_int8_dynamic.pt',
+    'onnx': 'plant_disease_model.onnx',
+}
+DEFAULT_VARIANTS = ('fp32', 'frozen', 'int8', 'int8_dynamic', 'onnx')
+
+
+def build_model(arch, num_classes, width_mult=1.0):
+    """Untrained classifier of a checkpoint's `arch`: mobilenet_v2 (any width_mult), improved_cnn or pooled_cnn"""
+    if arch == 'mobilenet_v2':
+        model = models.mobilenet_v2(weights=None, width_mult=width_mult)
+        model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+        return model
+    if arch in ('improved_cnn', 'pooled_cnn'):
+        from predict import ImprovedCNN
+        return ImprovedCNN(num_classes, pooled=arch == 'pooled_cnn')
+    raise ValueError(f"Unsupported arch '{arch}'")
+
+
+def load_checkpoint_model(checkpoint_path):
+    """Rebuild the classifier from a training checkpoint or bare state_dict
+
+    Checkpoints written by routes/distill.py name their `arch` and `width_mult`;
+    anything else is the full-width MobileNetV2.
+    """
+    state = torch.load(checkpoint_path, map_location='cpu')
+    arch, width_mult = 'mobilenet_v2', 1.0
+    if isinstance(state, dict):
+        arch, width_mult = state.get('arch', arch), state.get('width_mult', width_mult)
+    for key in ('model_state_dict', 'state_dict'):
+        if isinstance(state, dict) and key in state:
+            state = state[key]
+            break
+    num_classes = state['classifier.1.weight' if arch == 'mobilenet_v2' else 'fc3.weight'].shape[0]
+    model = build_model(arch, num_classes, width_mult)
+    model.load_state_dict(state)
+    return model.eval()
+
+
+def calibration_loader(dataset, num_images, batch_size=32):
+    """Evenly spaced slice of the (class-sorted) ImageFolder so every class is represented"""
+    step = max(1, len(dataset) // max(1, num_images))
+    indices = list(range(0, len(dataset), step))[:num_images]
+    return DataLoader(Subset(dataset, indices), batch_size=batch_size, shuffle=False, num_workers=2)
+
+
+def export_fp32(model, path):
+    torch.jit.script(model).save(str(path))
+
+
+def export_frozen(model, path):
+    # optimize_for_inference bakes in host-specific (MKLDNN) layouts that do not
+    # round-trip through save/load, so it is applied by the loader instead.
+    scripted = torch.jit.script(copy.deepcopy(model).eval())
+    torch.jit.freeze(scripted).save(str(path))
+
+
+def export_int8_static(model, calib_loader, path):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    example = (torch.randn(1, 3, 224, 224),)
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(copy.deepcopy(model).eval(), qconfig_mapping, example)
+    with torch.no_grad():
+        for images, _ in calib_loader:
+            prepared(images)
+    quantized = convert_fx(prepared)
+    traced = torch.jit.trace(quantized, example)
+    torch.jit.freeze(traced).save(str(path))
+
+
+def export_int8_dynamic(model, path):
+    quantized = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8)
+    torch.jit.script(quantized).save(str(path))
+
+
+def export_onnx(model, path):
+    torch.onnx.export(
+        copy.deepcopy(model).eval(),
+        (torch.randn(1, 3, 224, 224),),
+        str(path),
+        input_names=['input'],
+        output_names=['logits'],
+        dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=17,
+    )
+
+
+def _load_variant(name, path):
+    if name == 'onnx':
+        import onnxruntime as ort
+
+        session = ort.InferenceSession(str(path), providers=['CPUExecutionProvider'])
+        input_name = session.get_inputs()[0].name
+        return lambda images: torch.from_numpy(session.run(None, {input_name: images.numpy()})[0])
+    module = torch.jit.load(str(path), map_location='cpu').eval()
+    if name == 'frozen':
+        module = torch.jit.optimize_for_inference(module)
+    return module
+
+
+def evaluate_accuracy(fn, loader):
+    correct, total = 0, 0
+    with torch.no_grad():
+        for images, labels in loader:
+            correct += (fn(images).argmax(1) == labels).sum().item()
+            total += labels.size(0)
+    return correct / max(total, 1)
+
+
+def measure_latency(fn, batch_size=1, warmup=10, runs=100, input_size=224):
+    """p50/p99 wall-clock latency in milliseconds for one CPU forward pass"""
+    images = torch.randn(batch_size, 3, input_size, input_size)
+    samples = []
+    with torch.no_grad():
+        for _ in range(warmup):
+            fn(images)
+        for _ in range(runs):
+            start = time.perf_counter()
+            fn(images)
+            samples.append((time.perf_counter() - start) * 1000.0)
+    samples.sort()
+    return statistics.median(samples), samples[min(len(samples) - 1, int(0.99 * len(samples)))]
+
+
+def export_variants(model, val_dataset, save_dir, reports_dir, variants=DEFAULT_VARIANTS,
+                    calibration_images=512, eval_images=None, latency_runs=100):
+    """Write each requested variant to save_dir and a comparison report to reports_dir"""
+    model = copy.deepcopy(model).to('cpu').eval()
+    save_dir, reports_dir = Path(save_dir), Path(reports_dir)
+    eval_dataset = val_dataset
+    if eval_images:
+        eval_dataset = Subset(val_dataset, list(range(0, len(val_dataset), max(1, len(val_dataset) // eval_images))))
+    eval_loader = DataLoader(eval_dataset, batch_size=64, shuffle=False, num_workers=4)
+
+    baseline_acc = evaluate_accuracy(model, eval_loader)
+    logger.info(f"Eager FP32 accuracy: {baseline_acc*100:.2f}%")
+
+    rows = []
+    for name in variants:
+        path = save_dir / VARIANT_FILENAMES[name]
+        try:
+            if name == 'fp32':
+                export_fp32(model, path)
+            elif name == 'frozen':
+                export_frozen(model, path)
+            elif name == 'int8':
+                export_int8_static(model, calibration_loader(val_dataset, calibration_images), path)
+            elif name == 'int8_dynamic':
+                export_int8_dynamic(model, path)
+            elif name == 'onnx':
+                export_onnx(model, path)
+            else:
+                raise ValueError(f"Unknown variant '{name}'")
+        except Exception as e:
+            logger.warning(f"Skipping {name} export: {e}")
+            continue
+
+        row = {'variant': name, 'path': str(path), 'size_mb': path.stat().st_size / 2**20}
+        try:
+            fn = _load_variant(name, path)
+            row['accuracy'] = evaluate_accuracy(fn, eval_loader)
+            row['accuracy_delta'] = row['accuracy'] - baseline_acc
+            row['p50_ms'], row['p99_ms'] = measure_latency(fn, runs=latency_runs)
+        except ImportError as e:
+            logger.warning(f"Exported {name} but cannot benchmark it: {e}")
+        rows.append(row)
+        logger.info(f"Exported {name} -> {path} ({row['size_mb']:.2f} MB)")
+
+    report = {
+        'baseline_accuracy': baseline_acc,
+        'quantized_engine': torch.backends.quantized.engine,
+        'torch_threads': torch.get_num_threads(),
+        'variants': rows,
+    }
+    with open(reports_dir / 'export_report.json', 'w') as f:
+        json.dump(report, f, indent=2)
+
+    lines = ['| variant | size (MB) | accuracy | delta | p50 ms | p99 ms |', '| --- | --- | --- | --- | --- | --- |']
+    for row in rows:
+        if 'accuracy' in row:
+            lines.append(
+                f"| {row['variant']} | {row['size_mb']:.2f} | {row['accuracy']*100:.2f}% | "
+                f"{row['accuracy_delta']*100:+.2f} pp | {row['p50_ms']:.2f} | {row['p99_ms']:.2f} |"
+            )
+        else:
+            lines.append(f"| {row['variant']} | {row['size_mb']:.2f} | n/a | n/a | n/a | n/a |")
+    with open(reports_dir / 'export_report.md', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    logger.info("Export report:\n" + '\n'.join(lines))
+    return report
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    base_dir = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description='Export optimized serving variants of the trained model')
+    parser.add_argument('--checkpoint', type=Path, default=base_dir / 'models' / 'best_model.pth')
+    parser.add_argument('--val-dir', type=Path, default=base_dir / 'data' / 'valid')
+    parser.add_argument('--save-dir', type=Path, default=base_dir / 'models')
+    parser.add_argument('--reports-dir', type=Path, default=base_dir / 'reports')
+    parser.add_argument('--variants', nargs='+', default=list(DEFAULT_VARIANTS), choices=list(VARIANT_FILENAMES))
+    parser.add_argument('--calibration-images', type=int, default=512)
+    parser.add_argument('--eval-images', type=int, default=None, help='Evaluate on an evenly spaced subset')
+    parser.add_argument('--latency-runs', type=int, default=100)
+    parser.add_argument('--qengine', default=None, help='Quantized engine, e.g. x86/fbgemm for servers or qnnpack for ARM')
+    args = parser.parse_args()
+
+    if args.qengine:
+        torch.backends.quantized.engine = args.qengine
+    args.save_dir.mkdir(parents=True, exist_ok=True)
+    args.reports_dir.mkdir(parents=True, exist_ok=True)
+
+    model = load_checkpoint_model(args.checkpoint)
+    val_dataset = datasets.ImageFolder(args.val_dir, transform=val_transforms)
+    export_variants(model, val_dataset, args.save_dir, args.reports_dir, args.variants,
+                    args.calibration_images, args.eval_images, args.latency_runs)
+
+
+if __name__ == "__main__":
+    main()
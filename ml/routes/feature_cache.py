@@ -0,0 +1,182 @@
+"""Frozen-backbone feature cache for the first fine-tune phase.
+
+While `model.features` is frozen (epochs before `fine_tune_after_epoch`), every
+epoch only trains `model.classifier` on the same backbone outputs. This module
+runs the frozen MobileNetV2 backbone once, over the validation set and over a
+fixed number of augmentation passes of the training set, and stores the pooled
+1280-d embeddings as float16 `.npy` arrays (memory-mapped on read):
+
+    <cache_dir>/manifest.json
+    <cache_dir>/train_features.npy   (passes * N, 1280) float16
+    <cache_dir>/train_labels.npy     (passes * N,)      int64
+    <cache_dir>/val_features.npy     (M, 1280)          float16
+    <cache_dir>/val_labels.npy       (M,)               int64
+
+The manifest keys the cache by backbone, passes, classes and the fingerprint of
+the train and validation file lists (`dataset_index.fingerprint`), so replaced
+or relabelled images are re-embedded even when the counts stay the same.
+
+Head epochs then cycle through the augmentation passes and train the classifier
+from the cached features. The backbone runs in eval mode, so unlike the
+uncached frozen phase its BatchNorm running statistics are left untouched.
+"""
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+
+
+def pooled_features(model, images):
+    """MobileNetV2 forward up to (not including) the classifier"""
+    return torch.flatten(F.adaptive_avg_pool2d(model.features(images), 1), 1)
+
+
+def _extract(model, dataset, device, out, labels_out, offset, batch_size, num_workers, memory_format, desc):
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers,
+                        pin_memory=device.type == 'cuda')
+    with torch.no_grad():
+        for images, labels in tqdm(loader, desc=desc, leave=False):
+            images = images.to(device, non_blocking=True, memory_format=memory_format)
+            features = pooled_features(model, images)
+            count = labels.size(0)
+            out[offset:offset + count] = features.cpu().numpy().astype(np.float16)
+            labels_out[offset:offset + count] = labels.numpy()
+            offset += count
+    return offset
+
+
+def _manifest_matches(manifest, expected):
+    return manifest.get('version') == MANIFEST_VERSION and all(manifest.get(k) == v for k, v in expected.items())
+
+
+def build_feature_cache(model, train_dataset, val_dataset, cache_dir, device, data_fingerprint, passes=3,
+                        backbone='', batch_size=128, num_workers=4, channels_last=False):
+    """Embed the validation set once and the training set `passes` times; reuses a cache with the same
+    settings and `data_fingerprint` ([train, val] `dataset_index.fingerprint`s of the image folders)"""
+    cache_dir = Path(cache_dir)
+    expected = {
+        'backbone': backbone,
+        'passes': passes,
+        'num_train': len(train_dataset),
+        'num_val': len(val_dataset),
+        'classes': list(train_dataset.classes),
+        'data_fingerprint': list(data_fingerprint),
+    }
+    manifest_path = cache_dir / 'manifest.json'
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            if _manifest_matches(json.load(f), expected):
+                logger.info(f"Reusing feature cache at {cache_dir}")
+                return FeatureCache(cache_dir)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path.unlink(missing_ok=True)
+    model.eval()
+    dim = model.classifier[-1].in_features
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    start = time.time()
+
+    train_features = np.lib.format.open_memmap(cache_dir / 'train_features.npy', mode='w+', dtype=np.float16,
+                                               shape=(passes * len(train_dataset), dim))
+    train_labels = np.empty(passes * len(train_dataset), dtype=np.int64)
+    offset = 0
+    for index in range(passes):
+        # Each pass draws fresh random augmentations from train_dataset's transform
+        offset = _extract(model, train_dataset, device, train_features, train_labels, offset, batch_size,
+                          num_workers, memory_format, f"Embedding train pass {index + 1}/{passes}")
+    train_features.flush()
+    np.save(cache_dir / 'train_labels.npy', train_labels)
+
+    val_features = np.lib.format.open_memmap(cache_dir / 'val_features.npy', mode='w+', dtype=np.float16,
+                                             shape=(len(val_dataset), dim))
+    val_labels = np.empty(len(val_dataset), dtype=np.int64)
+    _extract(model, val_dataset, device, val_features, val_labels, 0, batch_size, num_workers, memory_format,
+             "Embedding validation")
+    val_features.flush()
+    np.save(cache_dir / 'val_labels.npy', val_labels)
+
+    # Written last, so an interrupted build is never mistaken for a complete one
+    with open(manifest_path, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'dim': dim, **expected}, f, indent=2)
+
+    elapsed = time.time() - start
+    images = passes * len(train_dataset) + len(val_dataset)
+    logger.info(f"Built feature cache at {cache_dir}: {images} images in {elapsed:.1f}s "
+                f"({images / max(elapsed, 1e-9):.1f} images/sec)")
+    return FeatureCache(cache_dir)
+
+
+class FeatureCache:
+    """Read side of a cache written by build_feature_cache"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        with open(self.cache_dir / 'manifest.json') as f:
+            self.manifest = json.load(f)
+        self.passes = self.manifest['passes']
+        self.num_train = self.manifest['num_train']
+        self._train_features = np.load(self.cache_dir / 'train_features.npy', mmap_mode='r')
+        self._train_labels = np.load(self.cache_dir / 'train_labels.npy')
+        self._val_features = np.load(self.cache_dir / 'val_features.npy', mmap_mode='r')
+        self._val_labels = np.load(self.cache_dir / 'val_labels.npy')
+
+    def train_pass(self, epoch):
+        """(features, labels) of the augmentation pass used for `epoch`"""
+        start = (epoch % self.passes) * self.num_train
+        end = start + self.num_train
+        return (torch.from_numpy(np.ascontiguousarray(self._train_features[start:end])),
+                torch.from_numpy(self._train_labels[start:end]))
+
+    def val(self):
+        return torch.from_numpy(np.ascontiguousarray(self._val_features)), torch.from_numpy(self._val_labels)
+
+
+def train_head_epoch(head, features, labels, criterion, optimizer, device, batch_size=64):
+    """Train the classifier head for one epoch on cached features"""
+    head.train()
+    features, labels = features.to(device).float(), labels.to(device)
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    order = torch.randperm(labels.size(0), device=device)
+    steps = 0
+
+    for batch in order.split(batch_size):
+        optimizer.zero_grad(set_to_none=True)
+        outputs = head(features[batch])
+        loss = criterion(outputs, labels[batch])
+        loss.backward()
+        optimizer.step()
+
+        running_loss += loss.detach()
+        correct += (outputs.argmax(1) == labels[batch]).sum()
+        steps += 1
+
+    return running_loss.item() / max(steps, 1), correct.item() / labels.size(0)
+
+
+def validate_head_epoch(head, features, labels, criterion, device, batch_size=256):
+    """Validate the classifier head on cached features"""
+    head.eval()
+    features, labels = features.to(device).float(), labels.to(device)
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    steps = 0
+
+    with torch.no_grad():
+        for batch_features, batch_labels in zip(features.split(batch_size), labels.split(batch_size)):
+            outputs = head(batch_features)
+            running_loss += criterion(outputs, batch_labels)
+            correct += (outputs.argmax(1) == batch_labels).sum()
+            steps += 1
+
+    return running_loss.item() / max(steps, 1), correct.item() / labels.size(0)
@@ -1,7 +1,12 @@
+import os
 import torch
+import torch.distributed as dist
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
-from torch.utils.data import DataLoader
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
 from torchvision import datasets, transforms, models
 import matplotlib.pyplot as plt
 import time
@@ -9,12 +14,10 @@ from pathlib import Path
 import logging
 from tqdm import tqdm
 import numpy as np
-import seaborn as sns
 
 # <--- NEW: Additional imports for improvements
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 from sklearn.utils.class_weight import compute_class_weight
-from sklearn.metrics import classification_report, confusion_matrix
 
 # =====================
 # Logging setup
@@ -53,8 +56,12 @@ val_transforms = transforms.Compose([
 # 3. Improved CNN model with batch normalization (Your original class, kept for reference)
 # =====================
 class ImprovedCNN(nn.Module):
-    def __init__(self, num_classes, dropout_rate=0.5):
+    """`pooled=True` global-average-pools the conv features instead of flattening 256x14x14 into fc1:
+    ~0.6M instead of ~26M parameters, and any input resolution (see routes/distill.py)"""
+
+    def __init__(self, num_classes, dropout_rate=0.5, pooled=False):
         super(ImprovedCNN, self).__init__()
+        self.pooled = pooled
         self.conv1 = nn.Conv2d(3, 32, kernel_size=3, padding=1)
         self.bn1 = nn.BatchNorm2d(32)
         self.pool = nn.MaxPool2d(2, 2)
@@ -64,7 +71,7 @@ class ImprovedCNN(nn.Module):
         self.bn3 = nn.BatchNorm2d(128)
         self.conv4 = nn.Conv2d(128, 256, kernel_size=3, padding=1)
         self.bn4 = nn.BatchNorm2d(256)
-        self.fc1 = nn.Linear(256 * 14 * 14, 512)
+        self.fc1 = nn.Linear(256 if pooled else 256 * 14 * 14, 512)
         self.fc2 = nn.Linear(512, 256)
         self.fc3 = nn.Linear(256, num_classes)
         self.relu = nn.ReLU(inplace=True)
@@ -84,16 +91,21 @@ class ImprovedCNN(nn.Module):
                 nn.init.normal_(m.weight, 0, 0.01)
                 nn.init.constant_(m.bias, 0)
 
-    def forward(self, x):
+    def embed(self, x):
+        """Penultimate 256-d features, the input of fc3 (used by the similar-case index)"""
         x = self.pool(self.relu(self.bn1(self.conv1(x))))
         x = self.pool(self.relu(self.bn2(self.conv2(x))))
         x = self.pool(self.relu(self.bn3(self.conv3(x))))
         x = self.pool(self.relu(self.bn4(self.conv4(x))))
-        x = x.view(x.size(0), -1)
+        if self.pooled:
+            x = torch.flatten(F.adaptive_avg_pool2d(x, 1), 1)
+        else:
+            x = x.view(x.size(0), -1)
         x = self.dropout(self.relu(self.fc1(x)))
-        x = self.dropout(self.relu(self.fc2(x)))
-        x = self.fc3(x)
-        return x
+        return self.relu(self.fc2(x))
+
+    def forward(self, x):
+        return self.fc3(self.dropout(self.embed(x)))
 
 # =====================
 # 4. Helper Functions
@@ -142,6 +154,99 @@ def validate_epoch(model, val_loader, criterion, device):
     
     return running_loss / len(val_loader), correct / total
 
+def _to_device(images, labels, device, channels_last):
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    return (images.to(device, non_blocking=True, memory_format=memory_format),
+            labels.to(device, non_blocking=True))
+
+def train_epoch_fast(model, train_loader, criterion, optimizer, device, amp_dtype=torch.bfloat16, channels_last=True):
+    """Train for one epoch with autocast and on-device metrics (one host sync per epoch)"""
+    model.train()
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    total = 0
+
+    for images, labels in tqdm(train_loader, desc="Training", leave=False):
+        images, labels = _to_device(images, labels, device, channels_last)
+        optimizer.zero_grad(set_to_none=True)
+        with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+            outputs = model(images)
+            loss = criterion(outputs, labels)
+        loss.backward()
+        optimizer.step()
+
+        running_loss += loss.detach()
+        correct += (outputs.argmax(1) == labels).sum()
+        total += labels.size(0)
+
+    return running_loss.item() / len(train_loader), correct.item() / total
+
+def validate_epoch_fast(model, val_loader, criterion, device, amp_dtype=torch.bfloat16, channels_last=True):
+    """Validate for one epoch with autocast and on-device metrics (one host sync per epoch)"""
+    model.eval()
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    total = 0
+
+    with torch.no_grad():
+        for images, labels in tqdm(val_loader, desc="Validation", leave=False):
+            images, labels = _to_device(images, labels, device, channels_last)
+            with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
+
+            running_loss += loss.detach()
+            correct += (outputs.argmax(1) == labels).sum()
+            total += labels.size(0)
+
+    return running_loss.item() / len(val_loader), correct.item() / total
+
+# =====================
+# Distributed (torchrun) helpers
+# =====================
+def setup_distributed(backend='gloo'):
+    """Join the torchrun process group; returns (rank, world_size), (0, 1) when not launched by torchrun"""
+    world_size = int(os.environ.get('WORLD_SIZE', '1'))
+    if world_size <= 1:
+        return 0, 1
+    if torch.cuda.is_available():
+        torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', '0')))
+    dist.init_process_group(backend)
+    # torchrun pins OMP_NUM_THREADS to 1; split this node's cores between its ranks instead
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', world_size))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    return dist.get_rank(), world_size
+
+def build_loaders(train_dataset, val_dataset, batch_size, num_workers, world_size=1):
+    """Train/val DataLoaders, sharded with DistributedSampler when world_size > 1"""
+    train_sampler = DistributedSampler(train_dataset, shuffle=True) if world_size > 1 else None
+    val_sampler = DistributedSampler(val_dataset, shuffle=False) if world_size > 1 else None
+    pin_memory = torch.cuda.is_available()
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=train_sampler is None, sampler=train_sampler,
+                              num_workers=num_workers, pin_memory=pin_memory)
+    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, sampler=val_sampler,
+                            num_workers=num_workers, pin_memory=pin_memory)
+    return train_loader, val_loader, train_sampler
+
+def wrap_for_training(model, world_size=1, compile_model=False):
+    """DDP (and optionally torch.compile) wrapper used for the training steps only"""
+    train_model = model
+    if world_size > 1:
+        # Only parameters with requires_grad at wrap time are synchronised, so re-wrap after unfreezing
+        device_ids = [torch.cuda.current_device()] if next(model.parameters()).is_cuda else None
+        train_model = DistributedDataParallel(model, device_ids=device_ids)
+    if compile_model:
+        train_model = torch.compile(train_model)
+    return train_model
+
+def reduce_epoch_metrics(loss, acc, num_batches, num_samples):
+    """Combine every rank's (mean loss, accuracy) into global values; a no-op outside torchrun"""
+    if not (dist.is_available() and dist.is_initialized()):
+        return loss, acc
+    totals = torch.tensor([loss * num_batches, acc * num_samples, num_batches, num_samples], dtype=torch.float64)
+    dist.all_reduce(totals)
+    return (totals[0] / totals[2]).item(), (totals[1] / totals[3]).item()
+
 def plot_training_history(train_acc, val_acc, train_loss, val_loss, save_path):
     """Plot and save training history"""
     plt.figure(figsize=(12, 5))
@@ -161,46 +266,44 @@ def plot_training_history(train_acc, val_acc, train_loss, val_loss, save_path):
     plt.savefig(save_path, dpi=300, bbox_inches='tight')
     plt.show()
 
-def save_checkpoint(model, optimizer, epoch, train_acc, val_acc, path):
-    """Save model checkpoint"""
+def save_checkpoint(model, optimizer, epoch, train_acc, val_acc, path, **state):
+    """Save model checkpoint; `state` adds the extra training state a resume needs"""
     torch.save({
         'epoch': epoch,
         'model_state_dict': model.state_dict(),
         'optimizer_state_dict': optimizer.state_dict(),
         'train_acc': train_acc,
         'val_acc': val_acc,
+        **state,
     }, path)
 
+def unfreeze_for_fine_tuning(model, config):
+    """Unfreeze the last 4 feature blocks; returns the optimizer and scheduler of the fine-tune phase"""
+    for param in model.features[-4:].parameters():
+        param.requires_grad = True
+    optimizer = optim.AdamW(
+        filter(lambda p: p.requires_grad, model.parameters()),
+        lr=config['fine_tune_lr'],
+        weight_decay=config['weight_decay']
+    )
+    return optimizer, ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=2)
+
 # <--- NEW: Function for detailed evaluation and reporting
-def evaluate_and_report(model, val_loader, device, class_names, reports_dir):
-    """Generate and save classification report and confusion matrix"""
-    model.eval()
-    all_preds, all_labels = [], []
-    with torch.no_grad():
-        for images, labels in val_loader:
-            images, labels = images.to(device), labels.to(device)
-            outputs = model(images)
-            preds = outputs.argmax(1)
-            all_preds.extend(preds.cpu().numpy())
-            all_labels.extend(labels.cpu().numpy())
-
-    # Classification Report
-    report = classification_report(all_labels, all_preds, target_names=class_names, digits=4)
-    logger.info("Classification Report:\n" + report)
-    with open(reports_dir / 'classification_report.txt', 'w') as f:
-        f.write(report)
-
-    # Confusion Matrix
-    cm = confusion_matrix(all_labels, all_preds)
-    plt.figure(figsize=(15, 12))
-    sns.heatmap(cm, annot=True, fmt="d", cmap='Blues', xticklabels=class_names, yticklabels=class_names)
-    plt.xlabel('Predicted Label')
-    plt.ylabel('True Label')
-    plt.title('Confusion Matrix')
-    plt.savefig(reports_dir / 'confusion_matrix.png', dpi=300, bbox_inches='tight')
-    plt.show()
+def evaluate_and_report(model, val_loader, device, class_names, reports_dir, plots=False, memory_format=torch.contiguous_format):
+    """Stream the validation set through the model and write the classification report artefacts"""
+    from evaluate import evaluate_models, format_report, write_reports
+    evaluator = evaluate_models({'model': model}, val_loader, device, len(class_names), memory_format=memory_format)['model']
+    metrics = write_reports(evaluator, class_names, reports_dir, plots=plots)
+    logger.info("Classification Report:\n" + format_report(metrics))
+    return metrics
 
 def main():
+    # Launched by torchrun (e.g. `torchrun --standalone --nproc_per_node 4 routes/predict.py`)?
+    rank, world_size = setup_distributed()
+    distributed = world_size > 1
+    if rank != 0:
+        logging.getLogger().setLevel(logging.WARNING)
+
     # =====================
     # Configuration
     # =====================
@@ -208,7 +311,8 @@ def main():
     config = {
     'train_dir': base_dir / 'data' / 'train',
     'val_dir': base_dir / 'data' / 'valid',
-    'batch_size': 64,            # 6GB can handle 64 easily
+    'batch_size': 64,            # 6GB can handle 64 easily (global: split across ranks under torchrun)
+    'num_workers': 4,            # DataLoader workers per process
     'num_epochs': 40,            # longer training = better fine-tuning
     'learning_rate': 3e-4,       # stable base LR
     'weight_decay': 1e-5,        # mild regularization
@@ -216,7 +320,21 @@ def main():
     'save_dir': base_dir / 'models',
     'reports_dir': base_dir / 'reports',
     'fine_tune_after_epoch': 5,  # start unfreezing after 5 epochs
-    'fine_tune_lr': 1e-5         # super-low LR for pretrained layers
+    'fine_tune_lr': 1e-5,        # super-low LR for pretrained layers
+    'export_variants': ('frozen', 'int8', 'int8_dynamic', 'onnx'),  # see routes/export.py
+    'dataset_cache_dir': None,   # e.g. base_dir / 'data' / 'cache' to train from pre-decoded memmap shards
+    'fast_train': False,         # bf16 autocast + channels_last + one host sync per epoch
+    'amp_dtype': torch.bfloat16, # autocast dtype for fast_train (None = FP32)
+    'channels_last': True,       # NHWC activations for fast_train
+    'compile': False,            # torch.compile the model for fast_train
+    'feature_cache_dir': None,   # e.g. base_dir / 'data' / 'features': train the frozen phase from cached embeddings
+    'feature_cache_passes': 3,   # augmentation passes of the training set embedded for the frozen phase
+    'evaluation_plots': False,   # also render reports/confusion_matrix.png (see routes/evaluate.py)
+    'resume': False,             # continue an interrupted run from save_dir/last_checkpoint.pth
+    'incremental': False,        # fine-tune best_model.pth on images no run has trained on yet, plus a replay buffer
+    'incremental_epochs': 3,     # epochs of an incremental run (already in the fine-tune phase)
+    'replay_samples': 2000,      # already-trained images replayed per incremental run, stratified by class
+    'incremental_max_val_drop': 0.005,  # accept an incremental model at most this far below the old val accuracy
 }
 
     config['save_dir'].mkdir(parents=True, exist_ok=True)
@@ -226,33 +344,86 @@ def main():
     # Dataset loading
     # =====================
     try:
-        train_dataset = datasets.ImageFolder(config['train_dir'], transform=train_transforms)
-        val_dataset = datasets.ImageFolder(config['val_dir'], transform=val_transforms)
+        if config['dataset_cache_dir']:
+            # Decode/resize once into memory-mapped shards; epochs then only run the augmentations
+            from dataset_cache import cached_train_transforms, cached_val_transforms, load_or_compile
+            train_dataset = load_or_compile(config['train_dir'], config['dataset_cache_dir'] / 'train', cached_train_transforms)
+            val_dataset = load_or_compile(config['val_dir'], config['dataset_cache_dir'] / 'valid', cached_val_transforms)
+        else:
+            train_dataset = datasets.ImageFolder(config['train_dir'], transform=train_transforms)
+            val_dataset = datasets.ImageFolder(config['val_dir'], transform=val_transforms)
         logger.info(f"Training samples: {len(train_dataset)}, Validation samples: {len(val_dataset)}")
         logger.info(f"Classes: {train_dataset.classes}")
     except Exception as e:
         logger.error(f"Error loading datasets: {e}. Check paths: {config['train_dir']}, {config['val_dir']}")
         return
+    class_names = train_dataset.classes
+    class_targets = np.asarray(train_dataset.targets)
+    if not config['incremental']:
+        # What last_checkpoint.pth was trained on; a resume after the images changed starts over
+        from dataset_index import fingerprint
+        data_fingerprint = [
+            fingerprint(datasets.ImageFolder(directory).samples, directory)
+            for directory in (config['train_dir'], config['val_dir'])
+        ]
+
+    # Content-hash index of the training images (see routes/dataset_index.py): what the next
+    # incremental run will consider new. Scanned before training, marked trained after it.
+    dataset_index = None
+    if rank == 0 or config['incremental']:
+        from dataset_index import DatasetIndex, plan_incremental
+        folder = train_dataset if isinstance(train_dataset, datasets.ImageFolder) else datasets.ImageFolder(config['train_dir'])
+        dataset_index = DatasetIndex(config['save_dir'] / 'dataset_index.json', config['train_dir'])
+        indexed_classes = dataset_index.classes
+        dataset_index.scan(folder.samples, folder.classes)
+
+    if config['incremental']:
+        if indexed_classes and indexed_classes != folder.classes:
+            logger.error("The class folders changed since the last run; run a full training instead of an incremental one")
+            return
+        if not dataset_index.trained:
+            logger.warning("No completed run is recorded in the dataset index: every image counts as new")
+        new, replay = plan_incremental(dataset_index, folder.samples, len(folder.classes), config['replay_samples'])
+        if not new:
+            logger.info("No new training images since the last run; nothing to do")
+            return
+        # Only a few thousand images: read them directly rather than recompiling the dataset cache
+        train_dataset = Subset(datasets.ImageFolder(config['train_dir'], transform=train_transforms), new + replay)
+        logger.info(f"Incremental run: {len(new)} new + {len(replay)} replayed of {len(folder)} training images")
     
-    train_loader = DataLoader(train_dataset, batch_size=config['batch_size'], shuffle=True, num_workers=4, pin_memory=True)
-    val_loader = DataLoader(val_dataset, batch_size=config['batch_size'], shuffle=False, num_workers=4, pin_memory=True)
+    train_loader, val_loader, train_sampler = build_loaders(
+        train_dataset, val_dataset, max(1, config['batch_size'] // world_size), config['num_workers'], world_size)
+    if distributed:
+        logger.info(f"Distributed training on {world_size} processes ({dist.get_backend()}), "
+                    f"{max(1, config['batch_size'] // world_size)} images per rank per step")
     
     # =====================
     # Model setup (Transfer Learning)
     # =====================
-    num_classes = len(train_dataset.classes)
-    model = models.mobilenet_v2(weights='IMAGENET1K_V1')
+    num_classes = len(class_names)
+    # Incremental runs start from the current best model instead of ImageNet
+    model = models.mobilenet_v2(weights=None if config['incremental'] else 'IMAGENET1K_V1')
     for param in model.parameters():
         param.requires_grad = False
     
     model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+    if config['incremental']:
+        checkpoint = torch.load(config['save_dir'] / 'best_model.pth', map_location='cpu')
+        model.load_state_dict(checkpoint['model_state_dict'])
+        config['num_epochs'] = config['incremental_epochs']
+        config['fine_tune_after_epoch'] = 0
     model = model.to(device)
+
+    if config['fast_train']:
+        if config['channels_last']:
+            model = model.to(memory_format=torch.channels_last)
+        logger.info(f"Fast training: amp_dtype={config['amp_dtype']}, channels_last={config['channels_last']}, compile={config['compile']}")
     
     # <--- NEW: Class weighting for imbalanced datasets
     class_weights = compute_class_weight(
         'balanced',
         classes=np.arange(num_classes),
-        y=[label for _, label in train_dataset.samples]
+        y=class_targets  # the whole corpus, also when an incremental run trains on a subset
     )
     weights = torch.tensor(class_weights, dtype=torch.float).to(device)
     logger.info(f"Using class weights: {weights}")
@@ -268,75 +439,185 @@ def main():
     # <--- NEW: Learning Rate Scheduler
     scheduler = ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=2)
 
+    history = {'train_loss': [], 'val_loss': [], 'train_acc': [], 'val_acc': [], 'train_images_per_sec': [], 'epoch_seconds': []}
+    best_val_acc = 0.0
+    patience_counter = 0
+    start_epoch = 0
+    last_checkpoint_path = config['save_dir'] / 'last_checkpoint.pth'
+    state = None
+    if config['resume'] and config['incremental']:
+        logger.warning("resume is ignored for incremental runs; they are short enough to restart")
+    elif config['resume'] and last_checkpoint_path.exists():
+        state = torch.load(last_checkpoint_path, map_location='cpu')
+        if state.get('classes', class_names) != class_names:
+            logger.error(f"{last_checkpoint_path} was trained on other classes; remove it or disable resume")
+            return
+        if state.get('completed'):
+            logger.info(f"{last_checkpoint_path} is from a finished run; starting a new run")
+            state = None
+        elif state.get('data_fingerprint') != data_fingerprint:
+            logger.warning(f"The images changed since {last_checkpoint_path} was saved; starting a new run")
+            state = None
+    elif config['resume']:
+        logger.info(f"No {last_checkpoint_path} to resume from; starting a new run")
+    if state is not None:
+        # The optimizer has to cover the same parameters as when it was saved before its state loads
+        if state['fine_tuned']:
+            optimizer, scheduler = unfreeze_for_fine_tuning(model, config)
+        model.load_state_dict(state['model_state_dict'])
+        optimizer.load_state_dict(state['optimizer_state_dict'])
+        scheduler.load_state_dict(state['scheduler_state_dict'])
+        best_val_acc, patience_counter, history = state['best_val_acc'], state['patience_counter'], state['history']
+        torch.set_rng_state(state['rng_state'])
+        start_epoch = state['epoch'] + 1
+        logger.info(f"Resuming from {last_checkpoint_path} at epoch {start_epoch + 1} "
+                    f"({'fine-tune' if state['fine_tuned'] else 'frozen'} phase, best val acc {best_val_acc*100:.2f}%)")
+
+    # The DDP/compiled wrapper only runs the steps; checkpoints and exports use `model` itself
+    # so state_dict keys stay free of the `module.`/`_orig_mod.` prefixes.
+    train_model = wrap_for_training(model, world_size, config['fast_train'] and config['compile'])
+
+    # Frozen phase: embed the data once with the frozen backbone, then train only the head
+    feature_cache = None
+    if config['feature_cache_dir'] and distributed:
+        logger.warning("feature_cache_dir is ignored under torchrun: the cached head phase is not sharded")
+    elif config['feature_cache_dir'] and config['fine_tune_after_epoch'] > start_epoch:
+        from feature_cache import build_feature_cache, train_head_epoch, validate_head_epoch
+        feature_cache = build_feature_cache(
+            model, train_dataset, val_dataset, config['feature_cache_dir'], device, data_fingerprint,
+            passes=config['feature_cache_passes'], backbone='mobilenet_v2/IMAGENET1K_V1',
+            batch_size=config['batch_size'], channels_last=config['fast_train'] and config['channels_last'],
+        )
+
     total_params = sum(p.numel() for p in model.parameters())
     trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
     logger.info(f"Total params: {total_params:,} | Initial trainable params: {trainable_params:,}")
     
+    if config['incremental']:
+        # The new model has to hold up on the validation set the old one was chosen on
+        baseline_loss, baseline_acc = validate_epoch(model, val_loader, criterion, device)
+        baseline_loss, baseline_acc = reduce_epoch_metrics(baseline_loss, baseline_acc, len(val_loader), len(val_loader.sampler))
+        best_val_acc = baseline_acc - config['incremental_max_val_drop']
+        logger.info(f"Current best model: {baseline_acc*100:.2f}% validation accuracy")
+    improved = False
+
     # =====================
     # Training loop
     # =====================
-    history = {'train_loss': [], 'val_loss': [], 'train_acc': [], 'val_acc': []}
-    best_val_acc = 0.0
-    patience_counter = 0
     start_time = time.time()
     logger.info("Starting training...")
     
-    for epoch in range(config['num_epochs']):
+    for epoch in range(start_epoch, config['num_epochs']):
         # <--- NEW: Fine-tuning logic
         if epoch == config['fine_tune_after_epoch']:
             logger.info("="*20)
             logger.info(f"Epoch {epoch+1}: Unfreezing last 4 blocks for fine-tuning.")
             logger.info("="*20)
             
-            # Unfreeze the last few layers
-            for param in model.features[-4:].parameters():
-                param.requires_grad = True
-
-            # Re-initialize optimizer with all trainable parameters
-            optimizer = optim.AdamW(
-                filter(lambda p: p.requires_grad, model.parameters()),
-                lr=config['fine_tune_lr'],
-                weight_decay=config['weight_decay']
-            )
-            # Reset scheduler with the new optimizer
-            scheduler = ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=2)
+            # Unfreeze the last few layers; new optimizer and scheduler over all trainable parameters
+            optimizer, scheduler = unfreeze_for_fine_tuning(model, config)
             
             trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
             logger.info(f"New number of trainable parameters: {trainable_params:,}")
+            train_model = wrap_for_training(model, world_size, config['fast_train'] and config['compile'])
 
-        train_loss, train_acc = train_epoch(model, train_loader, criterion, optimizer, device)
-        val_loss, val_acc = validate_epoch(model, val_loader, criterion, device)
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+
+        epoch_start = time.time()
+        if feature_cache is not None and epoch < config['fine_tune_after_epoch']:
+            train_loss, train_acc = train_head_epoch(model.classifier, *feature_cache.train_pass(epoch), criterion,
+                                                     optimizer, device, config['batch_size'])
+        elif config['fast_train']:
+            train_loss, train_acc = train_epoch_fast(train_model, train_loader, criterion, optimizer, device,
+                                                     config['amp_dtype'], config['channels_last'])
+        else:
+            train_loss, train_acc = train_epoch(train_model, train_loader, criterion, optimizer, device)
+        epoch_seconds = time.time() - epoch_start
+        images_per_sec = len(train_dataset) / epoch_seconds
+        if feature_cache is not None and epoch < config['fine_tune_after_epoch']:
+            val_loss, val_acc = validate_head_epoch(model.classifier, *feature_cache.val(), criterion, device)
+        elif config['fast_train']:
+            val_loss, val_acc = validate_epoch_fast(train_model, val_loader, criterion, device,
+                                                    config['amp_dtype'], config['channels_last'])
+        else:
+            val_loss, val_acc = validate_epoch(model, val_loader, criterion, device)
+        # Every rank ends up with the same global metrics, so the LR schedule stays in lockstep
+        train_loss, train_acc = reduce_epoch_metrics(train_loss, train_acc, len(train_loader), len(train_loader.sampler))
+        val_loss, val_acc = reduce_epoch_metrics(val_loss, val_acc, len(val_loader), len(val_loader.sampler))
         
         history['train_loss'].append(train_loss); history['val_loss'].append(val_loss)
         history['train_acc'].append(train_acc); history['val_acc'].append(val_acc)
+        history['train_images_per_sec'].append(images_per_sec)
+        history['epoch_seconds'].append(epoch_seconds)
         
         logger.info(
             f"Epoch [{epoch+1}/{config['num_epochs']}] | "
             f"Train Loss: {train_loss:.4f}, Acc: {train_acc*100:.2f}% | "
-            f"Val Loss: {val_loss:.4f}, Acc: {val_acc*100:.2f}%"
+            f"Val Loss: {val_loss:.4f}, Acc: {val_acc*100:.2f}% | "
+            f"{images_per_sec:.1f} train images/sec"
         )
         
         # <--- NEW: Scheduler Step
         scheduler.step(val_acc)
         
-        if val_acc > best_val_acc:
-            best_val_acc = val_acc
-            patience_counter = 0
-            save_checkpoint(model, optimizer, epoch, train_acc, val_acc, config['save_dir'] / 'best_model.pth')
-            logger.info(f"New best validation accuracy: {val_acc*100:.2f}%. Checkpoint saved.")
-        else:
-            patience_counter += 1
-        
-        if patience_counter >= config['patience']:
+        # Checkpointing and early stopping are decided on rank 0 only
+        stop = False
+        if rank == 0:
+            if val_acc > best_val_acc:
+                best_val_acc = val_acc
+                patience_counter = 0
+                improved = True
+                save_checkpoint(model, optimizer, epoch, train_acc, val_acc, config['save_dir'] / 'best_model.pth',
+                                classes=class_names)
+                logger.info(f"New best validation accuracy: {val_acc*100:.2f}%. Checkpoint saved.")
+            else:
+                patience_counter += 1
+            stop = patience_counter >= config['patience']
+            # Everything a resume needs, overwritten every epoch (incremental runs just restart)
+            if not config['incremental']:
+                save_checkpoint(model, optimizer, epoch, train_acc, val_acc, last_checkpoint_path,
+                                scheduler_state_dict=scheduler.state_dict(), best_val_acc=best_val_acc,
+                                patience_counter=patience_counter, history=history,
+                                fine_tuned=epoch >= config['fine_tune_after_epoch'],
+                                rng_state=torch.get_rng_state(), classes=class_names,
+                                data_fingerprint=data_fingerprint)
+        if distributed:
+            flag = torch.tensor([int(stop)])
+            dist.broadcast(flag, src=0)
+            stop = bool(flag.item())
+
+        if stop:
             logger.info(f"Early stopping at epoch {epoch+1}")
             break
+
+    if distributed:
+        dist.barrier()
+        dist.destroy_process_group()
+        if rank != 0:
+            return
+        # Final evaluation and exports run on rank 0 over the whole validation set
+        train_loader, val_loader, _ = build_loaders(train_dataset, val_dataset, config['batch_size'], config['num_workers'])
+
+    if not config['incremental'] and last_checkpoint_path.exists():
+        # A later resume=True run must not continue (and overwrite the exports of) a finished one
+        state = torch.load(last_checkpoint_path, map_location='cpu')
+        state['completed'] = True
+        torch.save(state, last_checkpoint_path)
             
     # =====================
     # Save final results
     # =====================
     total_time = time.time() - start_time
     logger.info(f"Training completed in {total_time/60:.2f} minutes")
+    if config['incremental'] and not improved:
+        logger.warning("No incremental epoch held up on the validation set; best_model.pth is unchanged "
+                       "and the new images stay pending for the next run")
+    elif dataset_index is not None:
+        dataset_index.mark_trained()
+        dataset_index.save()
     logger.info(f"Best validation accuracy: {best_val_acc*100:.2f}%")
+    logger.info(f"Mean training throughput: {np.mean(history['train_images_per_sec']):.1f} images/sec")
     
     torch.save(model.state_dict(), config['save_dir'] / 'final_model.pth')
     plot_training_history(history['train_acc'], history['val_acc'], history['train_loss'], history['val_loss'], config['reports_dir'] / 'training_history.png')
@@ -347,18 +628,26 @@ def main():
     logger.info("Loading best model for final evaluation...")
     checkpoint = torch.load(config['save_dir'] / 'best_model.pth')
     model.load_state_dict(checkpoint['model_state_dict'])
-    evaluate_and_report(model, val_loader, device, train_dataset.classes, config['reports_dir'])
+    evaluate_and_report(model, val_loader, device, class_names, config['reports_dir'],
+                        plots=config['evaluation_plots'],
+                        memory_format=torch.channels_last if config['fast_train'] and config['channels_last'] else torch.contiguous_format)
     
     # =====================
     # <--- NEW: Export for Deployment (TorchScript)
     # =====================
     logger.info("Exporting the best model to TorchScript for deployment...")
     model.eval()
-    model_cpu = model.to('cpu')
+    model_cpu = model.to('cpu', memory_format=torch.contiguous_format)
     scripted_model = torch.jit.script(model_cpu)
     scripted_model.save(config['save_dir'] / 'plant_disease_model.pt')
     logger.info(f"Model saved to {config['save_dir'] / 'plant_disease_model.pt'}")
 
+    # =====================
+    # Export optimized serving variants (frozen / INT8 / ONNX) and compare them
+    # =====================
+    from export import export_variants
+    export_variants(model_cpu, val_dataset, config['save_dir'], config['reports_dir'], variants=config['export_variants'])
+
     logger.info("Training pipeline completed successfully!")
 
 if __name__ == "__main__":
@@ -0,0 +1,359 @@
+"""Parallel hyperparameter sweep over the `predict.main` training recipe.
+
+`run` samples `--trials` configurations of the settings `main()` hardcodes
+(learning_rate, batch_size, fine_tune_after_epoch, fine_tune_lr, patience) and
+trains them with successive halving: every live trial is trained to the
+current rung's epoch budget (`--min-epochs`, then x `--eta` up to
+`--max-epochs`), after which only the best 1/eta by validation accuracy move
+on. A rung's trials run in parallel in a `--parallel` process pool, each
+process limited to `--threads` torch threads, and continue from their own
+checkpoint (`<work_dir>/trial_NNN.pth`) at the next rung. Training is
+`train_epoch`/`validate_epoch` with the frozen phase, unfreeze and early
+stopping of `main()`; a trial out of patience stops training but keeps
+competing on its best accuracy, so it can still be promoted (untrained) and
+take a slot at later rungs.
+
+All trials read one decoded dataset cache (`routes/dataset_cache.py`, compiled
+once before the pool starts): the shards are memory-mapped, so the processes
+share the page cache instead of each decoding every JPEG. Every trial and
+epoch, with its timings, is recorded in a SQLite file for `show`:
+
+    sweeps(id, started, finished, args)
+    trials(sweep_id, trial, params, status, rung, epochs, best_val_acc, best_epoch, train_seconds)
+    epochs(sweep_id, trial, epoch, train_loss, train_acc, val_loss, val_acc, seconds)
+
+Usage (from the `ml/` directory):
+    python routes/sweep.py run --trials 16 --parallel 4 --threads 2 --min-epochs 2 --max-epochs 16
+    python routes/sweep.py show                 # latest sweep, best trials first
+"""
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from sklearn.utils.class_weight import compute_class_weight
+from torch.optim.lr_scheduler import ReduceLROnPlateau
+from torchvision import models
+
+from dataset_cache import MemmapImageDataset, cached_train_transforms, cached_val_transforms, load_or_compile
+from predict import build_loaders, save_checkpoint, train_epoch, unfreeze_for_fine_tuning, validate_epoch
+
+logger = logging.getLogger(__name__)
+
+# (kind, low, high) for sampled ranges, a list for a choice
+SEARCH_SPACE = {
+    'learning_rate': ('log', 1e-4, 1e-3),
+    'batch_size': [32, 64, 128],
+    'fine_tune_after_epoch': ('int', 1, 8),
+    'fine_tune_lr': ('log', 3e-6, 1e-4),
+    'patience': ('int', 3, 10),
+}
+# main()'s values for everything the sweep does not vary
+FIXED = {'weight_decay': 1e-5}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sweeps (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    finished REAL,
+    args TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trials (
+    sweep_id INTEGER NOT NULL,
+    trial INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    rung INTEGER NOT NULL,
+    epochs INTEGER NOT NULL,
+    best_val_acc REAL,
+    best_epoch INTEGER,
+    train_seconds REAL NOT NULL,
+    PRIMARY KEY (sweep_id, trial)
+);
+CREATE TABLE IF NOT EXISTS epochs (
+    sweep_id INTEGER NOT NULL,
+    trial INTEGER NOT NULL,
+    epoch INTEGER NOT NULL,
+    train_loss REAL,
+    train_acc REAL,
+    val_loss REAL,
+    val_acc REAL,
+    seconds REAL,
+    PRIMARY KEY (sweep_id, trial, epoch)
+);
+"""
+
+
+def sample_params(rng, space=SEARCH_SPACE):
+    params = {}
+    for name, spec in space.items():
+        if isinstance(spec, list):
+            params[name] = spec[rng.integers(len(spec))]
+        elif spec[0] == 'log':
+            params[name] = float(math.exp(rng.uniform(math.log(spec[1]), math.log(spec[2]))))
+        else:
+            params[name] = int(rng.integers(spec[1], spec[2] + 1))
+    return {**FIXED, **params}
+
+
+def rung_budgets(min_epochs, max_epochs, eta):
+    """Cumulative epoch budget per rung: min_epochs, x eta, ..., ending at max_epochs"""
+    budgets = [min_epochs]
+    while budgets[-1] < max_epochs:
+        budgets.append(min(budgets[-1] * eta, max_epochs))
+    return budgets
+
+
+class SweepStore:
+    """The sweep's SQLite results file; only the parent process writes to it"""
+
+    def __init__(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), isolation_level=None)
+        self.conn.executescript(SCHEMA)
+
+    def start_sweep(self, args):
+        return self.conn.execute('INSERT INTO sweeps (started, args) VALUES (?, ?)',
+                                 (time.time(), json.dumps(args, default=str))).lastrowid
+
+    def finish_sweep(self, sweep_id):
+        self.conn.execute('UPDATE sweeps SET finished = ? WHERE id = ?', (time.time(), sweep_id))
+
+    def add_trial(self, sweep_id, trial, params):
+        self.conn.execute('INSERT INTO trials VALUES (?, ?, ?, ?, 0, 0, NULL, NULL, 0)',
+                          (sweep_id, trial, json.dumps(params), 'pending'))
+
+    def record(self, sweep_id, rung, result):
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO epochs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(sweep_id, result['trial'], e['epoch'], e['train_loss'], e['train_acc'], e['val_loss'],
+                  e['val_acc'], e['seconds']) for e in result['new_epochs']])
+            self.conn.execute(
+                'UPDATE trials SET status = ?, rung = ?, epochs = ?, best_val_acc = ?, best_epoch = ?, '
+                'train_seconds = train_seconds + ? WHERE sweep_id = ? AND trial = ?',
+                (result['status'], rung, result['epochs'], result['best_val_acc'], result['best_epoch'],
+                 sum(e['seconds'] for e in result['new_epochs']), sweep_id, result['trial']))
+
+    def set_status(self, sweep_id, trial, status):
+        self.conn.execute('UPDATE trials SET status = ? WHERE sweep_id = ? AND trial = ?', (status, sweep_id, trial))
+
+    def latest_sweep(self):
+        row = self.conn.execute('SELECT MAX(id) FROM sweeps').fetchone()
+        return row[0]
+
+    def trials(self, sweep_id):
+        rows = self.conn.execute(
+            'SELECT trial, params, status, rung, epochs, best_val_acc, best_epoch, train_seconds FROM trials '
+            'WHERE sweep_id = ? ORDER BY best_val_acc IS NULL, best_val_acc DESC, epochs DESC', (sweep_id,)).fetchall()
+        keys = ('trial', 'params', 'status', 'rung', 'epochs', 'best_val_acc', 'best_epoch', 'train_seconds')
+        return [{**dict(zip(keys, row)), 'params': json.loads(row[1])} for row in rows]
+
+
+def _init_worker(threads):
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+
+def _build_model(num_classes, weights):
+    model = models.mobilenet_v2(weights=weights)
+    for param in model.parameters():
+        param.requires_grad = False
+    model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+    return model
+
+
+def run_trial(spec):
+    """Train one trial up to spec['budget'] epochs, continuing from its checkpoint; runs in a pool process"""
+    params, checkpoint_path = spec['params'], Path(spec['checkpoint'])
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    # run_sweep compiled the cache, so no need to re-walk the ImageFolder here
+    train_dataset = MemmapImageDataset(Path(spec['cache_dir']) / 'train', cached_train_transforms)
+    val_dataset = MemmapImageDataset(Path(spec['cache_dir']) / 'valid', cached_val_transforms)
+    train_loader, val_loader, _ = build_loaders(train_dataset, val_dataset, params['batch_size'], spec['loader_workers'])
+
+    num_classes = len(train_dataset.classes)
+    model = _build_model(num_classes, None if checkpoint_path.exists() else spec['weights']).to(device)
+    weights = compute_class_weight('balanced', classes=np.arange(num_classes), y=np.asarray(train_dataset.targets))
+    criterion = nn.CrossEntropyLoss(weight=torch.tensor(weights, dtype=torch.float).to(device), label_smoothing=0.1)
+    optimizer = optim.AdamW(model.classifier.parameters(), lr=params['learning_rate'], weight_decay=params['weight_decay'])
+    scheduler = ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=2)
+    start_epoch, best_val_acc, best_epoch, patience_counter = 0, 0.0, None, 0
+    if checkpoint_path.exists():
+        state = torch.load(checkpoint_path, map_location='cpu')
+        if state['fine_tuned']:
+            optimizer, scheduler = unfreeze_for_fine_tuning(model, params)
+        model.load_state_dict(state['model_state_dict'])
+        optimizer.load_state_dict(state['optimizer_state_dict'])
+        scheduler.load_state_dict(state['scheduler_state_dict'])
+        start_epoch = state['epoch'] + 1
+        best_val_acc, best_epoch, patience_counter = state['best_val_acc'], state['best_epoch'], state['patience_counter']
+        torch.set_rng_state(state['rng_state'])
+    else:
+        torch.manual_seed(spec['seed'])
+
+    new_epochs, stopped = [], False
+    for epoch in range(start_epoch, spec['budget']):
+        if epoch == params['fine_tune_after_epoch']:
+            optimizer, scheduler = unfreeze_for_fine_tuning(model, params)
+        start = time.time()
+        train_loss, train_acc = train_epoch(model, train_loader, criterion, optimizer, device)
+        val_loss, val_acc = validate_epoch(model, val_loader, criterion, device)
+        scheduler.step(val_acc)
+        new_epochs.append({'epoch': epoch, 'train_loss': train_loss, 'train_acc': train_acc, 'val_loss': val_loss,
+                           'val_acc': val_acc, 'seconds': time.time() - start})
+        if val_acc > best_val_acc:
+            best_val_acc, best_epoch, patience_counter = val_acc, epoch, 0
+        else:
+            patience_counter += 1
+        if patience_counter >= params['patience']:
+            stopped = True
+            break
+
+    last_epoch = new_epochs[-1]['epoch'] if new_epochs else start_epoch - 1
+    if new_epochs:
+        save_checkpoint(model, optimizer, last_epoch, new_epochs[-1]['train_acc'], new_epochs[-1]['val_acc'],
+                        checkpoint_path, scheduler_state_dict=scheduler.state_dict(), best_val_acc=best_val_acc,
+                        best_epoch=best_epoch, patience_counter=patience_counter,
+                        fine_tuned=last_epoch >= params['fine_tune_after_epoch'], rng_state=torch.get_rng_state(),
+                        params=params)
+    return {'trial': spec['trial'], 'new_epochs': new_epochs, 'epochs': last_epoch + 1, 'best_val_acc': best_val_acc,
+            'best_epoch': best_epoch, 'status': 'stopped' if stopped else 'running'}
+
+
+def run_sweep(args):
+    """Successive halving over sampled trials; returns the sweep id"""
+    store = SweepStore(args.db)
+    budgets = rung_budgets(args.min_epochs, args.max_epochs, args.eta)
+    sweep_id = store.start_sweep(vars(args))
+    work_dir = args.work_dir / f'sweep_{sweep_id:04d}'
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    # Compiled once here; the trials only open the memory-mapped shards
+    load_or_compile(args.train_dir, args.cache_dir / 'train', cached_train_transforms)
+    load_or_compile(args.val_dir, args.cache_dir / 'valid', cached_val_transforms)
+
+    rng = np.random.default_rng(args.seed)
+    params = {trial: sample_params(rng) for trial in range(args.trials)}
+    for trial, trial_params in params.items():
+        store.add_trial(sweep_id, trial, trial_params)
+    logger.info(f"Sweep {sweep_id}: {args.trials} trials, epoch budgets {budgets}, "
+                f"{args.parallel} processes x {args.threads} threads")
+
+    # The pool's processes would otherwise all draw progress bars on one terminal
+    os.environ['TQDM_DISABLE'] = '1'
+    # Contenders: every trial not pruned yet; the running ones among them train at each rung
+    results, contenders = {}, list(params)
+    start = time.time()
+    context = multiprocessing.get_context('spawn')  # no fork of a process with torch threads running
+    with ProcessPoolExecutor(args.parallel, mp_context=context, initializer=_init_worker,
+                             initargs=(args.threads,)) as pool:
+        for rung, budget in enumerate(budgets):
+            futures = [pool.submit(run_trial, {
+                'trial': trial, 'params': params[trial], 'budget': budget, 'seed': args.seed + trial,
+                'checkpoint': str(work_dir / f'trial_{trial:03d}.pth'), 'weights': args.weights,
+                'cache_dir': str(args.cache_dir),
+                'loader_workers': args.loader_workers,
+            }) for trial in contenders if trial not in results or results[trial]['status'] == 'running']
+            for future in as_completed(futures):
+                result = future.result()
+                results[result['trial']] = result
+                store.record(sweep_id, rung, result)
+                logger.info(f"Rung {rung} trial {result['trial']}: {result['epochs']} epochs, "
+                            f"best val acc {result['best_val_acc']*100:.2f}% ({result['status']})")
+
+            ranked = sorted(contenders, key=lambda trial: results[trial]['best_val_acc'], reverse=True)
+            contenders = ranked if rung == len(budgets) - 1 else ranked[:max(1, len(ranked) // args.eta)]
+            for trial in ranked[len(contenders):]:
+                store.set_status(sweep_id, trial, 'pruned')
+                (work_dir / f'trial_{trial:03d}.pth').unlink(missing_ok=True)
+            # Trials out of patience keep their place in the ranking but train no further
+            if not any(results[trial]['status'] == 'running' for trial in contenders):
+                break
+    for trial in contenders:
+        if results[trial]['status'] == 'running':
+            store.set_status(sweep_id, trial, 'complete')
+    store.finish_sweep(sweep_id)
+    logger.info(f"Sweep {sweep_id} finished in {(time.time() - start)/60:.1f} minutes")
+    show(store, sweep_id)
+    return sweep_id
+
+
+def show(store, sweep_id=None, limit=10):
+    sweep_id = sweep_id or store.latest_sweep()
+    if sweep_id is None:
+        logger.info("No sweeps recorded yet")
+        return
+    names = list(SEARCH_SPACE)
+    lines = [
+        f"# Sweep {sweep_id}",
+        '',
+        '| trial | status | epochs | best val acc | best epoch | train min | ' + ' | '.join(names) + ' |',
+        '|' + '---|' * (6 + len(names)),
+    ]
+    for t in store.trials(sweep_id)[:limit]:
+        values = ' | '.join(f"{t['params'][name]:.3g}" for name in names)
+        accuracy = f"{t['best_val_acc']*100:.2f}%" if t['best_val_acc'] is not None else '-'
+        best_epoch = t['best_epoch'] + 1 if t['best_epoch'] is not None else '-'
+        lines.append(f"| {t['trial']} | {t['status']} | {t['epochs']} | {accuracy} | {best_epoch} | "
+                     f"{t['train_seconds']/60:.1f} | {values} |")
+    logger.info('\n' + '\n'.join(lines))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    base_dir = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description='Successive-halving hyperparameter sweep of the training recipe')
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('run', 'show'):
+        cmd = sub.add_parser(name)
+        cmd.add_argument('--db', type=Path, default=base_dir / 'reports' / 'sweeps.db')
+    run_cmd = sub.choices['run']
+    run_cmd.add_argument('--train-dir', type=Path, default=base_dir / 'data' / 'train')
+    run_cmd.add_argument('--val-dir', type=Path, default=base_dir / 'data' / 'valid')
+    run_cmd.add_argument('--cache-dir', type=Path, default=base_dir / 'data' / 'cache',
+                         help='Dataset cache shared by all trials (compiled if missing)')
+    run_cmd.add_argument('--work-dir', type=Path, default=base_dir / 'models' / 'sweeps',
+                         help='Per-trial checkpoints; pruned trials are deleted')
+    run_cmd.add_argument('--trials', type=int, default=16)
+    run_cmd.add_argument('--parallel', type=int, default=4, help='Trials trained at the same time')
+    run_cmd.add_argument('--threads', type=int, default=max(1, (os.cpu_count() or 1) // 4),
+                         help='torch threads per trial process')
+    run_cmd.add_argument('--loader-workers', type=int, default=1, help='DataLoader workers per trial')
+    run_cmd.add_argument('--min-epochs', type=int, default=2, help='Epoch budget of the first rung')
+    run_cmd.add_argument('--max-epochs', type=int, default=16)
+    run_cmd.add_argument('--eta', type=int, default=2, help='Keep 1/eta of the trials per rung, multiply the budget by eta')
+    run_cmd.add_argument('--weights', default='IMAGENET1K_V1', help="MobileNetV2 starting weights ('none' for random)")
+    run_cmd.add_argument('--seed', type=int, default=0)
+    sub.choices['show'].add_argument('--sweep', type=int, default=None, help='Sweep id (default: the latest)')
+    sub.choices['show'].add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        show(SweepStore(args.db), args.sweep, args.limit)
+    else:
+        # rung_budgets only terminates when the budget grows towards max_epochs
+        if args.eta < 2:
+            parser.error('--eta must be at least 2')
+        if args.min_epochs < 1:
+            parser.error('--min-epochs must be at least 1')
+        if args.max_epochs < args.min_epochs:
+            parser.error('--max-epochs must not be below --min-epochs')
+        if args.weights.lower() == 'none':
+            args.weights = None
+        run_sweep(args)
+
+
+if __name__ == "__main__":
+    main()
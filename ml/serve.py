@@ -0,0 +1,141 @@
+"""Pre-fork multi-worker server for the inference service.
+
+`uvicorn app:app --workers N` starts N independent interpreters that each load
+every model, so resident memory grows with model size times N. This launcher
+loads the models once in a parent process (app.preload_models() moves their
+weights into shared memory), binds the listening socket and then forks the
+workers, which adopt the preloaded modules instead of reading the artefacts:
+all of them map the same physical weight pages.
+
+Each worker sets `torch.set_num_threads(cpu_count // workers)` (override with
+`--threads`) so the workers together use every core once instead of each
+spinning up a full-width thread pool, then warms its models and serves the
+inherited socket under its own uvicorn event loop.
+
+The parent never runs a forward pass and keeps torch at one intra-op thread:
+GNU OpenMP, PyTorch's CPU backend, deadlocks in a forked child once the parent
+has used a multi-threaded parallel region. It re-forks workers that die and
+passes SIGTERM/SIGINT on to them.
+
+Only CPU models are shared. A hot reload or `/admin/models` activation loads the
+new artefact privately in each worker. Micro-batcher, prediction cache, job
+queue and `/metrics` are per worker (set PREDICTION_CACHE_URL to share the
+cache). EXECUTOR_MODE=process is not supported here: every worker is already a
+process.
+
+Usage (from the `ml/` directory):
+  python serve.py --workers 4 --port 8000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def _bind(host: str, port: int) -> socket.socket:
+	sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.bind((host, port))
+	sock.listen(2048)
+	sock.set_inheritable(True)
+	return sock
+
+
+def _run_worker(sock: socket.socket, threads: int, log_level: str) -> None:
+	import torch
+	import uvicorn
+
+	import app
+
+	torch.set_num_threads(threads)
+	config = uvicorn.Config(app.app, log_level=log_level, timeout_keep_alive=5)
+	uvicorn.Server(config).run(sockets=[sock])
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+	parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+	parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="Worker processes (default: SERVE_WORKERS or the CPU count)")
+	parser.add_argument("--threads", type=int, default=0, help="Intra-op threads per worker (default: CPU count / workers)")
+	parser.add_argument("--log-level", default="info")
+	args = parser.parse_args()
+
+	if os.getenv("EXECUTOR_MODE", "thread").lower() == "process":
+		sys.exit("serve.py workers are processes already; unset EXECUTOR_MODE=process")
+
+	import torch
+
+	# Before anything can start an OpenMP team in this process (see the module docstring).
+	torch.set_num_threads(1)
+
+	import app
+
+	started = time.perf_counter()
+	shared = app.preload_models()
+	threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+	print(
+		f"🧠 Preloaded models in {time.perf_counter() - started:.2f}s ({shared / 2**20:.1f} MiB shared); "
+		f"forking {args.workers} worker(s) x {threads} thread(s) on {args.host}:{args.port}"
+	)
+
+	sock = _bind(args.host, args.port)
+	workers: Dict[int, int] = {}
+	stopping = False
+
+	def spawn(index: int) -> None:
+		pid = os.fork()
+		if pid == 0:
+			code = 0
+			try:
+				signal.signal(signal.SIGTERM, signal.SIG_DFL)
+				signal.signal(signal.SIGINT, signal.SIG_DFL)
+				_run_worker(sock, threads, args.log_level)
+			except BaseException:  # pylint: disable=broad-except
+				import traceback
+
+				traceback.print_exc()
+				code = 1
+			finally:
+				os._exit(code)
+		workers[pid] = index
+
+	def stop(signum: int, _frame: object) -> None:
+		nonlocal stopping
+		stopping = True
+		for pid in list(workers):
+			try:
+				os.kill(pid, signum)
+			except ProcessLookupError:
+				pass
+
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+	for index in range(args.workers):
+		spawn(index)
+
+	while workers:
+		try:
+			pid, status = os.wait()
+		except ChildProcessError:
+			break
+		except InterruptedError:
+			continue
+		index = workers.pop(pid, None)
+		if index is not None and not stopping:
+			print(f"⚠️ Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting it")
+			time.sleep(1)
+			spawn(index)
+	sock.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,317 @@
+"""Streaming, validated ingestion of `/predict` image uploads.
+
+`read_image_form` parses the multipart request body chunk by chunk as it
+arrives, instead of letting Starlette spool the whole upload before the
+handler runs. The image part is checked as it grows:
+
+  - more than `max_bytes` fails with 413 as soon as the limit is crossed;
+  - the format is sniffed from the magic bytes (JPEG, PNG or WebP, otherwise
+    415) and the dimensions are read from the header (JPEG SOFn, PNG IHDR,
+    WebP VP8/VP8L/VP8X). More than `max_pixels` fails with 413 before the rest
+    of the body is read, which is what stops decompression bombs: small files
+    that decode into gigabytes of pixels.
+
+Small images stay in one in-memory buffer. Anything larger than
+`spool_bytes` continues into an anonymous temporary file, so slow uploads do
+not pin their full size in RSS while they trickle in. The finished file is
+memory-mapped read-only. Either way the buffer is handed to the decoder and the
+cache key without another copy (see `preprocess.open_image`).
+`/predict/batch` copies each multipart or archive entry into an `ImageSink`
+too (see bulk.py), so its entries get the same checks while they are read.
+"""
+
+from __future__ import annotations
+
+import mmap
+import struct
+import tempfile
+from dataclasses import dataclass, field
+from typing import IO, Callable, Dict, Iterable, List, Tuple, Union
+
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+
+# The dimensions of every supported format sit in the first few hundred bytes,
+# except for JPEGs with large EXIF/ICC segments in front of the SOF marker.
+SNIFF_LIMIT = 512 * 1024
+MAX_FIELD_BYTES = 4096
+
+ImageBuffer = Union[bytearray, mmap.mmap]
+
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_JPEG_STANDALONE = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+class UploadRejected(Exception):
+	def __init__(self, status_code: int, detail: str) -> None:
+		super().__init__(detail)
+		self.status_code = status_code
+		self.detail = detail
+
+
+@dataclass(frozen=True)
+class ImageHeader:
+	format: str
+	width: int
+	height: int
+
+	@property
+	def pixels(self) -> int:
+		return self.width * self.height
+
+
+def _sniff_jpeg(data: bytes) -> ImageHeader | None:
+	pos = 2
+	while pos + 4 <= len(data):
+		if data[pos] != 0xFF:
+			raise UploadRejected(400, "Corrupt JPEG header.")
+		marker = data[pos + 1]
+		if marker == 0xFF:  # fill byte
+			pos += 1
+			continue
+		if marker in _JPEG_STANDALONE:
+			pos += 2
+			continue
+		(length,) = struct.unpack(">H", data[pos + 2:pos + 4])
+		if marker in _JPEG_SOF:
+			if pos + 9 > len(data):
+				return None
+			height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+			return ImageHeader("JPEG", width, height)
+		if marker == 0xDA or length < 2:  # scan data before any frame header
+			raise UploadRejected(400, "Corrupt JPEG header.")
+		pos += 2 + length
+	return None
+
+
+def _sniff_webp(data: bytes) -> ImageHeader | None:
+	if len(data) < 30:
+		return None
+	chunk = data[12:16]
+	if chunk == b"VP8 ":
+		width, height = struct.unpack("<HH", data[26:30])
+		return ImageHeader("WEBP", width & 0x3FFF, height & 0x3FFF)
+	if chunk == b"VP8L":
+		(bits,) = struct.unpack("<I", data[21:25])
+		return ImageHeader("WEBP", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+	if chunk == b"VP8X":
+		width = int.from_bytes(data[24:27], "little") + 1
+		height = int.from_bytes(data[27:30], "little") + 1
+		return ImageHeader("WEBP", width, height)
+	raise UploadRejected(400, "Corrupt WebP header.")
+
+
+def sniff_image(data: bytes) -> ImageHeader | None:
+	"""Format and dimensions from the leading bytes of an image; None while more bytes are needed."""
+	if len(data) < 12:
+		return None
+	if data.startswith(b"\xff\xd8\xff"):
+		return _sniff_jpeg(data)
+	if data.startswith(b"\x89PNG\r\n\x1a\n"):
+		if len(data) < 24:
+			return None
+		if data[12:16] != b"IHDR":
+			raise UploadRejected(400, "Corrupt PNG header.")
+		width, height = struct.unpack(">II", data[16:24])
+		return ImageHeader("PNG", width, height)
+	if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+		return _sniff_webp(data)
+	raise UploadRejected(415, "Unsupported image format. Please upload a JPG or PNG image.")
+
+
+def _check_header(header: ImageHeader, max_pixels: int) -> None:
+	if header.width == 0 or header.height == 0:
+		raise UploadRejected(400, "Image has no pixels.")
+	if max_pixels and header.pixels > max_pixels:
+		raise UploadRejected(
+			413,
+			f"Image is {header.width}x{header.height} ({header.pixels / 1e6:.1f} MP); the limit is {max_pixels / 1e6:.1f} MP.",
+		)
+
+
+class ImageSink:
+	"""Collects one image part, enforcing the byte and pixel limits as data arrives."""
+
+	def __init__(self, max_bytes: int, max_pixels: int, spool_bytes: int = 1024 * 1024) -> None:
+		self.max_bytes = max_bytes
+		self.max_pixels = max_pixels
+		self.spool_bytes = spool_bytes
+		self._buffer = bytearray()
+		# Up to SNIFF_LIMIT leading bytes, kept in memory for the header even once the body is spooled.
+		self._head = bytearray()
+		self._file: IO[bytes] | None = None
+		self.size = 0
+		self.header: ImageHeader | None = None
+
+	def write(self, chunk: memoryview) -> None:
+		if self.max_bytes and self.size + len(chunk) > self.max_bytes:
+			raise UploadRejected(413, f"Image is larger than {self.max_bytes} bytes.")
+		if self._file is None and self.size + len(chunk) > self.spool_bytes:
+			self._file = tempfile.TemporaryFile()
+			self._file.write(self._buffer)
+			self._buffer = bytearray()
+		if self._file is not None:
+			self._file.write(chunk)
+		else:
+			self._buffer += chunk
+		self.size += len(chunk)
+		if self.header is None:
+			self._head += chunk[:SNIFF_LIMIT - len(self._head)]
+			self._sniff(final=False)
+
+	def _sniff(self, final: bool) -> None:
+		self.header = sniff_image(bytes(self._head))
+		if self.header is None and (final or self.size >= SNIFF_LIMIT):
+			raise UploadRejected(400, "Unable to read the image dimensions.")
+		if self.header is not None:
+			self._head = bytearray()
+			_check_header(self.header, self.max_pixels)
+
+	def finish(self) -> ImageBuffer:
+		if self.size == 0:
+			raise UploadRejected(400, "Uploaded file is empty.")
+		if self.header is None:
+			self._sniff(final=True)
+		if self._file is None:
+			return self._buffer
+		self._file.flush()
+		# The mapping keeps its own reference to the (already unlinked) file.
+		mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		self._file.close()
+		return mapped
+
+	def close(self) -> None:
+		if self._file is not None:
+			self._file.close()
+
+
+@dataclass
+class ImageForm:
+	image: ImageBuffer
+	header: ImageHeader
+	filename: str | None
+	content_type: str | None
+	fields: Dict[str, str] = field(default_factory=dict)
+
+
+class _FormReader:
+	def __init__(self, image_field: str, make_sink: Callable[[], ImageSink], allowed_types: Iterable[str]) -> None:
+		self.image_field = image_field
+		self.make_sink = make_sink
+		self.allowed_types = set(allowed_types)
+		self.fields: Dict[str, str] = {}
+		self.image: ImageForm | None = None
+		self._headers: List[Tuple[bytes, bytes]] = []
+		self._header_field = b""
+		self._header_value = b""
+		self._name = ""
+		self._filename: str | None = None
+		self._content_type: str | None = None
+		self._sink: ImageSink | None = None
+		self._value = bytearray()
+
+	def callbacks(self) -> Dict[str, Callable[..., None]]:
+		return {
+			"on_part_begin": self.on_part_begin,
+			"on_header_field": self.on_header_field,
+			"on_header_value": self.on_header_value,
+			"on_header_end": self.on_header_end,
+			"on_headers_finished": self.on_headers_finished,
+			"on_part_data": self.on_part_data,
+			"on_part_end": self.on_part_end,
+		}
+
+	def close(self) -> None:
+		# Drops the temporary file of an image part that was cut off.
+		if self._sink is not None:
+			self._sink.close()
+			self._sink = None
+
+	def on_part_begin(self) -> None:
+		self._headers = []
+		self._sink = None
+		self._value = bytearray()
+
+	def on_header_field(self, data: bytes, start: int, end: int) -> None:
+		self._header_field += data[start:end]
+
+	def on_header_value(self, data: bytes, start: int, end: int) -> None:
+		self._header_value += data[start:end]
+
+	def on_header_end(self) -> None:
+		self._headers.append((self._header_field.lower(), self._header_value))
+		self._header_field = b""
+		self._header_value = b""
+
+	def on_headers_finished(self) -> None:
+		headers = dict(self._headers)
+		_, options = parse_options_header(headers.get(b"content-disposition", b""))
+		self._name = options.get(b"name", b"").decode("utf-8", "replace")
+		filename = options.get(b"filename")
+		self._filename = filename.decode("utf-8", "replace") if filename is not None else None
+		content_type = headers.get(b"content-type")
+		self._content_type = content_type.decode("latin-1").strip().lower() if content_type is not None else None
+		if self._name == self.image_field and self._filename is not None:
+			if self.image is not None:
+				raise UploadRejected(400, f"Upload exactly one `{self.image_field}` file.")
+			if self._content_type not in self.allowed_types:
+				raise UploadRejected(415, "Unsupported file type. Please upload a JPG or PNG image.")
+			self._sink = self.make_sink()
+
+	def on_part_data(self, data: bytes, start: int, end: int) -> None:
+		if self._sink is not None:
+			self._sink.write(memoryview(data)[start:end])
+			return
+		if len(self._value) + end - start > MAX_FIELD_BYTES:
+			raise UploadRejected(413, f"Form field `{self._name}` is too large.")
+		self._value += data[start:end]
+
+	def on_part_end(self) -> None:
+		if self._sink is not None:
+			image = self._sink.finish()
+			self.image = ImageForm(image, self._sink.header, self._filename, self._content_type)  # type: ignore[arg-type]
+			self._sink = None
+		elif self._filename is None:
+			self.fields[self._name] = self._value.decode("utf-8", "replace")
+
+
+async def read_image_form(
+	request: Request,
+	image_field: str,
+	max_bytes: int,
+	max_pixels: int,
+	allowed_types: Iterable[str],
+	spool_bytes: int = 1024 * 1024,
+) -> ImageForm:
+	"""Stream a multipart body into one validated image buffer plus its small text fields."""
+	content_type, options = parse_options_header(request.headers.get("content-type", ""))
+	boundary = options.get(b"boundary")
+	if content_type != b"multipart/form-data" or not boundary:
+		raise UploadRejected(400, "Expected a multipart/form-data upload.")
+
+	try:
+		content_length = int(request.headers.get("content-length", "0"))
+	except ValueError:
+		content_length = 0
+	if max_bytes and content_length > max_bytes + 64 * 1024:
+		# Leaves room for the multipart framing and text fields around the image.
+		raise UploadRejected(413, f"Upload is larger than {max_bytes} bytes.")
+
+	reader = _FormReader(image_field, lambda: ImageSink(max_bytes, max_pixels, spool_bytes), allowed_types)
+	parser = MultipartParser(boundary, reader.callbacks())
+	try:
+		async for chunk in request.stream():
+			if chunk:
+				parser.write(chunk)
+		parser.finalize()
+	except MultipartParseError as exc:
+		raise UploadRejected(400, f"Malformed multipart body: {exc}") from exc
+	finally:
+		reader.close()
+
+	if reader.image is None:
+		raise UploadRejected(422, f"Missing `{image_field}` file.")
+	reader.image.fields = reader.fields
+	return reader.image
@@ -0,0 +1,119 @@
+"""Bounded worker pool that keeps CPU-heavy stages off the event loop.
+
+Image decode, preprocessing and (in process mode) the forward pass are handed
+to a `WorkerPool`. The pool admits at most `max_workers + max_pending` calls at
+once; anything beyond that fails fast with `PoolSaturated` so the API can
+answer 503 with a Retry-After hint instead of queueing without limit.
+Callers whose work continues past the pool call (thread mode hands the tensor
+to the micro-batcher) hold their slot with `admit()` until it is done, so that
+later stage is bounded by the same limit.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+
+SUPPORTED_MODES = ("thread", "process")
+
+
+class PoolSaturated(RuntimeError):
+	def __init__(self, retry_after: int) -> None:
+		super().__init__("Inference workers are saturated")
+		self.retry_after = retry_after
+
+
+class WorkerPool:
+	def __init__(
+		self,
+		mode: str = "thread",
+		max_workers: int | None = None,
+		max_pending: int = 32,
+		retry_after: int = 1,
+		initializer: Callable[..., None] | None = None,
+		initargs: Tuple[Any, ...] = (),
+	) -> None:
+		if mode not in SUPPORTED_MODES:
+			raise ValueError(f"Unsupported executor mode '{mode}'. Supported options: {', '.join(SUPPORTED_MODES)}")
+
+		self.mode = mode
+		self.max_workers = max_workers or os.cpu_count() or 1
+		self.max_pending = max(max_pending, 0)
+		self.retry_after = retry_after
+		self._inflight = 0
+		self._rejected = 0
+		self._lock = threading.Lock()
+
+		self._executor: Executor
+		if mode == "process":
+			# Spawned (not forked) children so torch thread pools and CUDA state start clean.
+			self._executor = ProcessPoolExecutor(
+				max_workers=self.max_workers,
+				mp_context=multiprocessing.get_context("spawn"),
+				initializer=initializer,
+				initargs=initargs,
+			)
+		else:
+			self._executor = ThreadPoolExecutor(
+				max_workers=self.max_workers,
+				thread_name_prefix="inference",
+				initializer=initializer,
+				initargs=initargs,
+			)
+
+	@property
+	def capacity(self) -> int:
+		return self.max_workers + self.max_pending
+
+	def _acquire(self) -> None:
+		with self._lock:
+			if self._inflight >= self.capacity:
+				self._rejected += 1
+				raise PoolSaturated(self.retry_after)
+			self._inflight += 1
+
+	def _release(self) -> None:
+		with self._lock:
+			self._inflight -= 1
+
+	@contextmanager
+	def admit(self) -> Iterator[None]:
+		"""Hold one slot for the block; raises `PoolSaturated` when none is free."""
+		self._acquire()
+		try:
+			yield
+		finally:
+			self._release()
+
+	async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+		with self.admit():
+			return await self.call(fn, *args)
+
+	async def call(self, fn: Callable[..., Any], *args: Any) -> Any:
+		"""Run `fn` on a slot the caller already holds through `admit()`."""
+		return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+	def warm(self) -> None:
+		# Start every worker up front so the first requests do not pay for model loading.
+		futures = [self._executor.submit(os.getpid) for _ in range(self.max_workers)]
+		for future in futures:
+			future.result()
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"mode": self.mode,
+				"max_workers": self.max_workers,
+				"max_pending": self.max_pending,
+				"in_flight": self._inflight,
+				"rejected": self._rejected,
+			}
+
+	def shutdown(self, wait: bool = True) -> None:
+		self._executor.shutdown(wait=wait, cancel_futures=True)